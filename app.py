@@ -1,16 +1,16 @@
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai import AsyncOpenAI
 from elevenlabs.client import AsyncElevenLabs
 import asyncio
 import json
 import os
 import argparse
-import concurrent.futures
+import tempfile
 import time
 import random
 
 from manga_extraction import (
-    extract_all_pages_as_images,
+    extract_all_pages_as_images_parallel,
     save_important_pages,
     split_volume_into_parts,
     save_all_pages,
@@ -18,10 +18,13 @@ from manga_extraction import (
     scale_base64_image,
 )
 from vision_analysis import (
-    analyze_images_with_gpt4_vision,
-    detect_important_pages,
-    get_important_panels,
+    analyze_images_with_gpt4_vision_async,
+    detect_important_pages_async,
+    get_important_panels_async,
+    ReferenceContext,
     VISION_PRICE_PER_TOKEN,
+    PROFILE_REFERENCE_TEXT,
+    CHAPTER_REFERENCE_TEXT,
 )
 from prompts import (
     DRAMATIC_PROMPT,
@@ -32,11 +35,24 @@ from prompts import (
     KEY_PANEL_IDENTIFICATION_PROMPT,
     KEY_PANEL_IDENTIFICATION_INSTRUCTIONS,
 )
+from page_store import open_page_store
+from render_cache import RenderCache, DEFAULT_RENDER_CACHE_DIR
+from panel_cache import PanelCache, DEFAULT_PANEL_CACHE_DIR
+from image_encoding import ImageEncoder, IMAGE_FORMATS
+from response_cache import (
+    ResponseCache,
+    CachedAsyncOpenAI,
+    DEFAULT_RESPONSE_CACHE_PATH,
+)
+from fake_backends import FakeAsyncOpenAI, FakeElevenLabs, RecordingElevenLabs
+from request_scheduler import (
+    RequestScheduler,
+    ScheduledAsyncOpenAI,
+    DEFAULT_REQUESTS_PER_MINUTE,
+    DEFAULT_TOKENS_PER_MINUTE,
+)
 from citation_processing import extract_text_and_citations, extract_script
-from movie_director import make_movie
-
-from openai import APIError, RateLimitError
-from tenacity import retry, stop_after_attempt, wait_exponential
+from movie_director import add_narrations_to_script, create_movie_from_script
 
 load_dotenv()  # Load environment variables from .env file
 
@@ -54,45 +70,82 @@ def write_text_to_file(movie_script, manga, volume_number):
     
     print(f"Extracted text has been written to {output_file}")
 
-@retry(stop=stop_after_attempt(5), wait=wait_exponential(multiplier=1, min=4, max=10))
-def retry_api_call(func, *args, **kwargs):
-    try:
-        return func(*args, **kwargs)
-    except RateLimitError as e:
-        print(f"Rate limit reached. Retrying in a moment...")
-        raise e
-    except APIError as e:
-        if "rate limit" in str(e).lower():
-            print(f"API error related to rate limit. Retrying...")
-            raise RateLimitError(str(e))
-        raise e
-
-async def main(volume_number, manga, text_only=False):
-    # Initialize OpenAI client with API key
-    client = OpenAI()
+async def main(
+    volume_number,
+    manga,
+    text_only=False,
+    render_workers=None,
+    page_store=None,
+    render_cache=None,
+    encoder=None,
+    contact_sheet=False,
+    scheduler=None,
+    response_cache=None,
+    client=None,
+    narration_client=None,
+    panel_workers=None,
+    panel_cache=None,
+    paper_th=0.35,
+    max_bubble=None,
+    text_detector=None,
+):
+    # Initialize OpenAI client with API key, unless a stand-in was given
+    client = client or AsyncOpenAI()
+    # Every OpenAI request goes through one scheduler with shared rate budgets
+    scheduler = scheduler or RequestScheduler()
+    client = ScheduledAsyncOpenAI(client, scheduler)
+    if response_cache is not None:
+        # Identical vision requests are answered from disk at no token cost,
+        # before they reach the scheduler
+        client = CachedAsyncOpenAI(client, response_cache)
+    encoder = encoder or ImageEncoder()
     # Only initialize ElevenLabs client if we're not in text-only mode
-    narration_client = None
-    if not text_only:
+    if text_only:
+        narration_client = None
+    elif narration_client is None:
         narration_client = AsyncElevenLabs(api_key=os.getenv("ELEVENLABS_API_KEY"))
 
     print("Extracting all pages from the volume...")
-    volume_scaled_and_unscaled = extract_all_pages_as_images(
-        f"{manga}/v{volume_number}/v{volume_number}.pdf"
+    volume_scaled_and_unscaled = extract_all_pages_as_images_parallel(
+        f"{manga}/v{volume_number}/v{volume_number}.pdf",
+        render_workers,
+        store=page_store,
+        cache=render_cache,
+        encoder=encoder,
     )
     volume = volume_scaled_and_unscaled["scaled"]
     volume_unscaled = volume_scaled_and_unscaled["full"]
+    # measured on the raw pixels while rendering, reused by panel extraction
+    paper_scores = volume_scaled_and_unscaled["paper"]
     print("Total pages in volume:", len(volume))
 
     if len(volume) == 0:
         print("Error: No images extracted from the PDF. Please check the PDF file.")
         return
 
-    profile_reference = extract_all_pages_as_images(f"{manga}/profile-reference.pdf")[
-        "scaled"
-    ]
-    chapter_reference = extract_all_pages_as_images(f"{manga}/chapter-reference.pdf")[
-        "scaled"
-    ]
+    profile_reference = extract_all_pages_as_images_parallel(
+        f"{manga}/profile-reference.pdf",
+        render_workers,
+        store=page_store,
+        cache=render_cache,
+        encoder=encoder,
+    )["scaled"]
+    chapter_reference = extract_all_pages_as_images_parallel(
+        f"{manga}/chapter-reference.pdf",
+        render_workers,
+        store=page_store,
+        cache=render_cache,
+        encoder=encoder,
+    )["scaled"]
+
+    # Build the reference messages once; every request below shares them
+    references = ReferenceContext(encoder=encoder, contact_sheet=contact_sheet)
+    profile_reference = references.add(
+        "profile", profile_reference, PROFILE_REFERENCE_TEXT
+    )
+    chapter_reference = references.add(
+        "chapter", chapter_reference, CHAPTER_REFERENCE_TEXT
+    )
 
     profile_pages = []
     chapter_pages = []
@@ -103,38 +156,37 @@ async def main(volume_number, manga, text_only=False):
 
     print("Identifying important pages in the volume...")
 
-    def process_batch(start_idx, pages):
-        response = retry_api_call(
-            detect_important_pages,
+    async def process_batch(start_idx, pages):
+        response = await detect_important_pages_async(
             profile_reference,
             chapter_reference,
             pages,
             client,
             KEY_PAGE_IDENTIFICATION_INSTRUCTIONS,
             KEY_PAGE_IDENTIFICATION_INSTRUCTIONS,
+            encoder=encoder,
         )
         return start_idx, response
 
-    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
-        futures = []
-        for i in range(0, len(volume), batch_size):
-            pages = volume[i : i + batch_size]
-            futures.append(executor.submit(process_batch, i, pages))
-
-        for future in concurrent.futures.as_completed(futures):
-            start_idx, response = future.result()
-            end_index = start_idx + batch_size - 1
-            print(f"Processing pages {start_idx} to {min(end_index, len(volume)-1)}")
+    # All batches are in flight at once; the scheduler bounds concurrency and rate
+    batches = [
+        process_batch(i, volume[i : i + batch_size])
+        for i in range(0, len(volume), batch_size)
+    ]
+    for batch in asyncio.as_completed(batches):
+        start_idx, response = await batch
+        end_index = start_idx + batch_size - 1
+        print(f"Processing pages {start_idx} to {min(end_index, len(volume)-1)}")
 
-            ip = response["parsed_response"]
-            print(json.dumps(ip, indent=2))
-            for page in ip:
-                if page["type"] == "profile":
-                    profile_pages.append(page["image_index"] + start_idx)
-                elif page["type"] == "chapter":
-                    chapter_pages.append(page["image_index"] + start_idx)
+        ip = response["parsed_response"]
+        print(json.dumps(ip, indent=2))
+        for page in ip:
+            if page["type"] == "profile":
+                profile_pages.append(page["image_index"] + start_idx)
+            elif page["type"] == "chapter":
+                chapter_pages.append(page["image_index"] + start_idx)
 
-            important_page_tokens += response["total_tokens"]
+        important_page_tokens += response["total_tokens"]
 
     profile_pages.sort()
     chapter_pages.sort()
@@ -149,9 +201,20 @@ async def main(volume_number, manga, text_only=False):
     print(f"{len(volume)}")
     print("\n__________\n")
     print("Saving important pages to disk for QA...")
-    save_important_pages(volume, profile_pages, chapter_pages, manga, volume_number)
+    save_important_pages(
+        volume,
+        profile_pages,
+        chapter_pages,
+        manga,
+        volume_number,
+        extension=encoder.extension,
+    )
 
-    character_profiles = [volume[i] for i in profile_pages]
+    character_profiles = references.add(
+        "character",
+        [volume[i] for i in profile_pages],
+        PROFILE_REFERENCE_TEXT,
+    )
     NUMBER_OF_JOBS = 7
     jobs = split_volume_into_parts(
         volume, volume_unscaled, chapter_pages, NUMBER_OF_JOBS
@@ -161,9 +224,13 @@ async def main(volume_number, manga, text_only=False):
     jobs = jobs["scaled_images"]
 
     # Summarize the images in the first job
-    response = retry_api_call(
-        analyze_images_with_gpt4_vision,
-        character_profiles, jobs[0], client, BASIC_PROMPT, BASIC_INSTRUCTIONS
+    response = await analyze_images_with_gpt4_vision_async(
+        character_profiles,
+        jobs[0],
+        client,
+        BASIC_PROMPT,
+        BASIC_INSTRUCTIONS,
+        encoder=encoder,
     )
     recap = response.choices[0].message.content
     tokens = response.usage.total_tokens
@@ -178,13 +245,14 @@ async def main(volume_number, manga, text_only=False):
     for i, job in enumerate(jobs):
         if i == 0:
             continue
-        response = retry_api_call(
-            analyze_images_with_gpt4_vision,
+        prompt = recap + "\n-----\n" + BASIC_PROMPT_WITH_CONTEXT
+        response = await analyze_images_with_gpt4_vision_async(
             character_profiles,
             job,
             client,
-            recap + "\n-----\n" + BASIC_PROMPT_WITH_CONTEXT,
+            prompt,
             BASIC_INSTRUCTIONS,
+            encoder=encoder,
         )
         recap = recap + "\n\n" + response.choices[0].message.content
         tokens += response.usage.total_tokens
@@ -202,19 +270,39 @@ async def main(volume_number, manga, text_only=False):
     print(narration_script)
     print("\n___________\n")
 
-    extract_panels(movie_script)
+    # Narration only needs the final text, so it runs alongside the panel stages
+    narration_task = None
+    if not text_only:
+        print("Narrating movie script...")
+        narration_task = asyncio.create_task(
+            add_narrations_to_script(movie_script, narration_client)
+        )
+
+    # Panel extraction is CPU-bound; every cited page is processed once, across
+    # a process pool, off the event loop
     print("Extracting panels from movie script...")
+    await asyncio.to_thread(
+        extract_panels,
+        movie_script,
+        volume_unscaled,
+        panel_workers,
+        panel_cache,
+        paper_scores,
+        paper_th,
+        max_bubble,
+        text_detector,
+    )
+    if panel_cache is not None:
+        print("Panel cache:", panel_cache.report())
     for i, segment in enumerate(movie_script):
         print(f"Processing segment {i}")
         print(f"Number of images in segment: {len(segment['images'])}")
         print(f"Number of unscaled images in segment: {len(segment['images_unscaled'])}")
 
         if len(segment['images']) == 0:
-            print(f"Warning: No images found in segment {i}. Skipping panel extraction.")
+            print(f"Warning: No images found in segment {i}.")
             continue
 
-        extract_panels(segment)
-
         all_panels_base64 = [
             panel for sublist in segment["panels"].values() for panel in sublist
         ]
@@ -232,8 +320,7 @@ async def main(volume_number, manga, text_only=False):
         print("number of panels:", len(all_panels_base64))
         print("number of images:", len(segment["images"]))
 
-    def process_segment(segment_tuple):
-        i, segment = segment_tuple
+    async def process_segment(i, segment):
         panels = []
         for j, page in enumerate(segment["images"]):
             if "panels" in segment:
@@ -245,15 +332,18 @@ async def main(volume_number, manga, text_only=False):
             else:
                 panels.append(page)
 
-        scaled_panels = [scale_base64_image(p) for p in panels]
+        scaled_panels = await asyncio.to_thread(
+            lambda: [scale_base64_image(p, encoder=encoder) for p in panels]
+        )
 
-        response = retry_api_call(
-            get_important_panels,
+        prompt = segment["text"] + "\n________\n" + KEY_PANEL_IDENTIFICATION_PROMPT
+        response = await get_important_panels_async(
             profile_reference,
             scaled_panels,
             client,
-            segment["text"] + "\n________\n" + KEY_PANEL_IDENTIFICATION_PROMPT,
+            prompt,
             KEY_PANEL_IDENTIFICATION_INSTRUCTIONS,
+            encoder=encoder,
         )
 
         important_panels = response["parsed_response"]
@@ -277,20 +367,18 @@ async def main(volume_number, manga, text_only=False):
     panel_tokens = 0
     important_panels_info = {}
 
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        futures = [
-            executor.submit(process_segment, (i, segment))
-            for i, segment in enumerate(movie_script)
-        ]
-
-        for future in concurrent.futures.as_completed(futures):
-            i, ip, tokens = future.result()
-            if ip:
-                print("Important panels for segment", i, "exist.")
-            else:
-                print("No important panels for segment", i)
-            movie_script[i]["important_panels"] = ip
-            panel_tokens += tokens
+    segments = [
+        process_segment(i, segment) for i, segment in enumerate(movie_script)
+    ]
+    for segment in asyncio.as_completed(segments):
+        # named so it doesn't clobber the summarization token count
+        i, ip, segment_tokens = await segment
+        if ip:
+            print("Important panels for segment", i, "exist.")
+        else:
+            print("No important panels for segment", i)
+        movie_script[i]["important_panels"] = ip
+        panel_tokens += segment_tokens
 
     ELEVENLABS_PRICE_PER_CHARACTER = 0.0003
     print(
@@ -341,12 +429,22 @@ async def main(volume_number, manga, text_only=False):
             " | ",
             "${:,.4f}".format(VISION_PRICE_PER_TOKEN * (total_gpt_tokens)),
         )
+    print("Upload images:", encoder.report())
+    print("OpenAI requests:", scheduler.report())
+    if response_cache is not None:
+        print("Response cache:", response_cache.report())
+    print(references.report())
 
     if text_only:
         write_text_to_file(movie_script, manga, volume_number)
         print("Text-only mode: Skipping narration and video creation.")
     else:
-        await make_movie(movie_script, manga, volume_number, narration_client)
+        await narration_task
+        print("Editing movie together...")
+        await asyncio.to_thread(
+            create_movie_from_script, movie_script, manga, volume_number
+        )
+        print("Movie created successfully!")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Process manga volumes.")
@@ -367,5 +465,290 @@ if __name__ == "__main__":
         action="store_true",
         help="Output extracted text to a file instead of creating a video",
     )
+    parser.add_argument(
+        "--render-workers",
+        type=int,
+        default=None,
+        help="Number of processes used to render PDF pages (default: CPU count)",
+    )
+    parser.add_argument(
+        "--panel-workers",
+        type=int,
+        default=None,
+        help="Number of processes used to extract panels (default: CPU count)",
+    )
+    parser.add_argument(
+        "--page-store",
+        type=str,
+        default=None,
+        help="Where rendered pages are kept on disk (default: a temporary directory)",
+    )
+    parser.add_argument(
+        "--packed-pages",
+        action="store_true",
+        help="Keep rendered pages in a single memory-mapped pack file",
+    )
+    parser.add_argument(
+        "--render-cache",
+        type=str,
+        default=DEFAULT_RENDER_CACHE_DIR,
+        help=f"Directory for cached page renders (default: {DEFAULT_RENDER_CACHE_DIR})",
+    )
+    parser.add_argument(
+        "--render-cache-size",
+        type=int,
+        default=2048,
+        help="Maximum size of the render cache in MB (default: 2048)",
+    )
+    parser.add_argument(
+        "--no-render-cache",
+        action="store_true",
+        help="Always re-render pages instead of using the render cache",
+    )
+    parser.add_argument(
+        "--panel-cache",
+        type=str,
+        default=DEFAULT_PANEL_CACHE_DIR,
+        help=f"Directory for cached panel geometry (default: {DEFAULT_PANEL_CACHE_DIR})",
+    )
+    parser.add_argument(
+        "--panel-cache-size",
+        type=int,
+        default=64,
+        help="Maximum size of the panel cache in MB (default: 64)",
+    )
+    parser.add_argument(
+        "--no-panel-cache",
+        action="store_true",
+        help="Always re-extract panels instead of using the panel cache",
+    )
+    parser.add_argument(
+        "--paper-threshold",
+        type=float,
+        default=0.35,
+        help="Share of mid-tones above which a page isn't split into panels (default: 0.35)",
+    )
+    parser.add_argument(
+        "--no-paper-check",
+        action="store_true",
+        help="Split every page into panels, whatever its texture",
+    )
+    parser.add_argument(
+        "--max-bubble",
+        type=int,
+        default=None,
+        help="Leave out panels that are more than this percentage speech bubble (detects text)",
+    )
+    parser.add_argument(
+        "--text-backend",
+        choices=["torch", "torchscript", "onnx"],
+        default="torch",
+        help="Text detector backend; export the model first for torchscript/onnx (default: torch)",
+    )
+    parser.add_argument(
+        "--text-model",
+        type=str,
+        default=None,
+        help="Exported text detector model (default: next to the CRAFT weights)",
+    )
+    parser.add_argument(
+        "--text-precision",
+        choices=["fp32", "bf16", "int8"],
+        default="fp32",
+        help="Text detector precision; bf16 and int8 are experimental (default: fp32)",
+    )
+    parser.add_argument(
+        "--fast-text-detection",
+        action="store_true",
+        help="Detect text at half resolution, refining only uncertain regions",
+    )
+    parser.add_argument(
+        "--adaptive-canvas",
+        action="store_true",
+        help="Size the text detector's canvas from the render resolution",
+    )
+    parser.add_argument(
+        "--image-format",
+        choices=list(IMAGE_FORMATS),
+        default="png",
+        help="Format of images sent to the vision API (default: png)",
+    )
+    parser.add_argument(
+        "--image-quality",
+        type=int,
+        default=85,
+        help="Quality for jpeg/webp images sent to the vision API (default: 85)",
+    )
+    parser.add_argument(
+        "--grayscale",
+        action="store_true",
+        help="Convert images sent to the vision API to grayscale",
+    )
+    parser.add_argument(
+        "--measure-image-savings",
+        action="store_true",
+        help="Also encode every uploaded image as PNG to report the bytes saved",
+    )
+    parser.add_argument(
+        "--contact-sheet",
+        action="store_true",
+        help="Send each set of reference pages as a single tiled image",
+    )
+    parser.add_argument(
+        "--max-concurrency",
+        type=int,
+        default=4,
+        help="Maximum number of OpenAI requests in flight (default: 4)",
+    )
+    parser.add_argument(
+        "--requests-per-minute",
+        type=int,
+        default=DEFAULT_REQUESTS_PER_MINUTE,
+        help=f"OpenAI requests-per-minute budget (default: {DEFAULT_REQUESTS_PER_MINUTE})",
+    )
+    parser.add_argument(
+        "--tokens-per-minute",
+        type=int,
+        default=DEFAULT_TOKENS_PER_MINUTE,
+        help=f"OpenAI tokens-per-minute budget (default: {DEFAULT_TOKENS_PER_MINUTE})",
+    )
+    parser.add_argument(
+        "--response-cache",
+        type=str,
+        default=DEFAULT_RESPONSE_CACHE_PATH,
+        help=f"SQLite file caching OpenAI responses (default: {DEFAULT_RESPONSE_CACHE_PATH})",
+    )
+    parser.add_argument(
+        "--response-cache-ttl",
+        type=float,
+        default=30,
+        help="Days before a cached OpenAI response expires (default: 30)",
+    )
+    parser.add_argument(
+        "--no-response-cache",
+        action="store_true",
+        help="Always send OpenAI requests instead of using cached responses",
+    )
+    parser.add_argument(
+        "--replay",
+        action="store_true",
+        help="Only use cached OpenAI responses and fail on any uncached request",
+    )
+    parser.add_argument(
+        "--narration-recordings",
+        type=str,
+        default=None,
+        help="Directory where narrations are recorded, and replayed from with --fake-apis",
+    )
+    parser.add_argument(
+        "--fake-apis",
+        action="store_true",
+        help="Use offline stand-ins for OpenAI and ElevenLabs, replaying the response cache",
+    )
+    parser.add_argument(
+        "--fake-latency",
+        type=float,
+        default=0.5,
+        help="Seconds each fake OpenAI request takes (default: 0.5)",
+    )
+    parser.add_argument(
+        "--fake-rate-limit-rate",
+        type=float,
+        default=0.0,
+        help="Fraction of fake OpenAI requests failing with a rate-limit error (default: 0)",
+    )
+    parser.add_argument(
+        "--fake-requests-per-minute",
+        type=int,
+        default=None,
+        help="Requests per minute the fake OpenAI API accepts before rate limiting",
+    )
+    parser.add_argument(
+        "--fake-seed",
+        type=int,
+        default=0,
+        help="Seed for the fake APIs' latency and errors (default: 0)",
+    )
     args = parser.parse_args()
-    asyncio.run(main(args.volume_number, args.manga, args.text_only))
+    response_cache = None
+    if not args.no_response_cache:
+        response_cache = ResponseCache(
+            args.response_cache,
+            ttl=args.response_cache_ttl * 24 * 3600,
+            read_only=args.replay or args.fake_apis,
+        )
+    client = None
+    narration_client = None
+    if args.fake_apis:
+        # recorded responses are replayed by the fake client itself, with latency
+        client = FakeAsyncOpenAI(
+            latency=args.fake_latency,
+            jitter=args.fake_latency / 2,
+            rate_limit_rate=args.fake_rate_limit_rate,
+            requests_per_minute=args.fake_requests_per_minute,
+            recordings=response_cache,
+            seed=args.fake_seed,
+        )
+        narration_client = FakeElevenLabs(recordings=args.narration_recordings)
+        response_cache = None
+    elif args.narration_recordings and not args.text_only:
+        narration_client = RecordingElevenLabs(
+            AsyncElevenLabs(api_key=os.getenv("ELEVENLABS_API_KEY")),
+            args.narration_recordings,
+        )
+    scheduler = RequestScheduler(
+        args.max_concurrency, args.requests_per_minute, args.tokens_per_minute
+    )
+    encoder = ImageEncoder(
+        args.image_format,
+        args.image_quality,
+        args.grayscale,
+        args.measure_image_savings,
+    )
+    render_cache = None
+    if not args.no_render_cache:
+        render_cache = RenderCache(
+            args.render_cache, max_bytes=args.render_cache_size * 1024 * 1024
+        )
+    panel_cache = None
+    if not args.no_panel_cache:
+        panel_cache = PanelCache(
+            args.panel_cache, max_bytes=args.panel_cache_size * 1024 * 1024
+        )
+    text_detector = {
+        "backend": args.text_backend,
+        "precision": args.text_precision,
+        "fast": args.fast_text_detection,
+        "adaptive_canvas": args.adaptive_canvas,
+    }
+    if args.text_model:
+        text_detector["model_path"] = args.text_model
+    with tempfile.TemporaryDirectory() as scratch_dir:
+        page_store_path = args.page_store or os.path.join(
+            scratch_dir, "pages.pack" if args.packed_pages else "pages"
+        )
+        page_store = open_page_store(page_store_path, args.packed_pages)
+        asyncio.run(
+            main(
+                args.volume_number,
+                args.manga,
+                args.text_only,
+                args.render_workers,
+                page_store,
+                render_cache,
+                encoder,
+                args.contact_sheet,
+                scheduler,
+                response_cache,
+                client,
+                narration_client,
+                args.panel_workers,
+                panel_cache,
+                None if args.no_paper_check else args.paper_threshold,
+                args.max_bubble,
+                text_detector,
+            )
+        )
+    if args.fake_apis:
+        print("Fake OpenAI:", client.report())
+        print("Fake ElevenLabs:", narration_client.report())
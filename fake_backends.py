@@ -0,0 +1,299 @@
+import asyncio
+import collections
+import hashlib
+import io
+import json
+import os
+import random
+import threading
+import time
+import types
+import wave
+
+import httpx
+from openai import RateLimitError
+from openai.types.chat import ChatCompletion
+
+from response_cache import request_key
+
+
+def _image_count(message):
+    content = message.get("content")
+    if not isinstance(content, list):
+        return 0
+    return sum(1 for part in content if part.get("type") == "image_url")
+
+
+def _text_length(messages):
+    length = 0
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            length += len(content)
+        elif isinstance(content, list):
+            length += sum(len(part.get("text", "")) for part in content)
+    return length
+
+
+class FakeOpenAI:
+    """
+    Offline stand-in for the OpenAI client's `chat.completions.create`.
+
+    Requests are answered from `recordings` (a ResponseCache filled by earlier
+    live runs) when they were recorded, and with a synthetic answer in the
+    format each vision stage expects otherwise. Every request takes `latency`
+    seconds (plus up to `jitter`), and fails with a 429 RateLimitError either
+    at random (`rate_limit_rate`, retried after `retry_after` seconds) or once
+    `requests_per_minute` requests were accepted in the last minute (retried
+    once the oldest of them is a minute old). All randomness comes from
+    `seed`, so runs are reproducible.
+    """
+
+    def __init__(
+        self,
+        latency=0.5,
+        jitter=0.0,
+        tokens_per_image=85,
+        completion_tokens=None,
+        rate_limit_rate=0.0,
+        requests_per_minute=None,
+        retry_after=1.0,
+        recordings=None,
+        seed=0,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.tokens_per_image = tokens_per_image
+        self.completion_tokens = completion_tokens
+        self.rate_limit_rate = rate_limit_rate
+        self.requests_per_minute = requests_per_minute
+        self.retry_after = retry_after
+        self.recordings = recordings
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._recent = collections.deque()
+        self._in_flight = 0
+        self.stats = {
+            "requests": 0,
+            "replayed": 0,
+            "rate_limited": 0,
+            "max_in_flight": 0,
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+        }
+        self.chat = types.SimpleNamespace(
+            completions=types.SimpleNamespace(create=self._create)
+        )
+
+    def _begin(self, request):
+        # decide the outcome up front so the random sequence doesn't depend on
+        # how the requests happen to interleave
+        with self._lock:
+            now = time.monotonic()
+            while self._recent and now - self._recent[0] >= 60:
+                self._recent.popleft()
+            delay = self.latency + self._random.uniform(0, self.jitter)
+            self.stats["requests"] += 1
+            if self._random.random() < self.rate_limit_rate:
+                self.stats["rate_limited"] += 1
+                return delay, self._rate_limit_error(self.retry_after)
+            if (
+                self.requests_per_minute is not None
+                and len(self._recent) >= self.requests_per_minute
+            ):
+                # like the real API, rejected requests don't count towards the
+                # limit, and the client is told when the oldest one leaves it
+                self.stats["rate_limited"] += 1
+                retry_after = 60 - (now - self._recent[0])
+                return delay, self._rate_limit_error(retry_after)
+            self._recent.append(now)
+            self._in_flight += 1
+            self.stats["max_in_flight"] = max(
+                self.stats["max_in_flight"], self._in_flight
+            )
+            return delay, None
+
+    def _finish(self, request):
+        response = self._replay(request) or self._synthesize(request)
+        with self._lock:
+            self._in_flight -= 1
+            if response.usage is not None:
+                self.stats["prompt_tokens"] += response.usage.prompt_tokens
+                self.stats["completion_tokens"] += response.usage.completion_tokens
+        return response
+
+    def _rate_limit_error(self, retry_after):
+        request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+        response = httpx.Response(
+            429, headers={"retry-after": f"{retry_after:.3f}"}, request=request
+        )
+        return RateLimitError(
+            "Rate limit reached (simulated)", response=response, body=None
+        )
+
+    def _replay(self, request):
+        if self.recordings is None:
+            return None
+        cached = self.recordings.get(request_key(**request))
+        if cached is None:
+            return None
+        with self._lock:
+            self.stats["replayed"] += 1
+        return ChatCompletion.model_validate_json(cached)
+
+    def _synthesize(self, request):
+        messages = request.get("messages", [])
+        system = messages[0].get("content", "") if messages else ""
+        pages = _image_count(messages[-1]) if messages else 0
+        if '"important_pages"' in system:
+            # every batch opens a chapter, with a profile page right after it
+            important = [{"image_index": 0, "type": "chapter"}]
+            if pages > 1:
+                important.append({"image_index": 1, "type": "profile"})
+            content = json.dumps({"important_pages": important})
+        elif '"important_panels"' in system:
+            # seeded by the request, so the pick doesn't depend on request order
+            rng = random.Random(request_key(**request))
+            panels = sorted(rng.sample(range(pages), min(3, pages)))
+            content = json.dumps({"important_panels": panels})
+        elif request.get("response_format", {}).get("type") == "json_object":
+            content = "{}"
+        else:
+            # a recap citing every page it was given, in the model's citation format
+            content = " ".join(
+                f"Something happens on page {i}.[^{{{i}}}]" for i in range(pages)
+            )
+
+        images = sum(_image_count(message) for message in messages)
+        prompt_tokens = self.tokens_per_image * images + _text_length(messages) // 4
+        completion_tokens = self.completion_tokens
+        if completion_tokens is None:
+            completion_tokens = len(content) // 4
+        return ChatCompletion.model_validate(
+            {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request.get("model", "gpt-4o"),
+                "choices": [
+                    {
+                        "index": 0,
+                        "finish_reason": "stop",
+                        "message": {"role": "assistant", "content": content},
+                    }
+                ],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens,
+                },
+            }
+        )
+
+    def _create(self, **request):
+        delay, error = self._begin(request)
+        time.sleep(delay)
+        if error is not None:
+            raise error
+        return self._finish(request)
+
+    def report(self):
+        return (
+            f"{self.stats['requests']} requests ({self.stats['replayed']} replayed, "
+            f"{self.stats['rate_limited']} rate limited), "
+            f"at most {self.stats['max_in_flight']} in flight, "
+            f"{self.stats['prompt_tokens']:,} prompt + "
+            f"{self.stats['completion_tokens']:,} completion tokens"
+        )
+
+
+class FakeAsyncOpenAI(FakeOpenAI):
+    """FakeOpenAI for code written against an AsyncOpenAI client."""
+
+    async def _create(self, **request):
+        delay, error = self._begin(request)
+        await asyncio.sleep(delay)
+        if error is not None:
+            raise error
+        return self._finish(request)
+
+
+def narration_key(text, voice_id):
+    return hashlib.sha256(f"{voice_id}\0{text}".encode("utf-8")).hexdigest()
+
+
+def silent_audio(duration, sample_rate=16000):
+    """Return `duration` seconds of silence as WAV bytes."""
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as audio:
+        audio.setnchannels(1)
+        audio.setsampwidth(2)
+        audio.setframerate(sample_rate)
+        audio.writeframes(b"\0\0" * int(duration * sample_rate))
+    return buffer.getvalue()
+
+
+class FakeElevenLabs:
+    """
+    Offline stand-in for the AsyncElevenLabs client's
+    `text_to_speech.convert`.
+
+    Narrations recorded by RecordingElevenLabs in `recordings` are replayed;
+    other texts get silence lasting as long as the text would take to read
+    (`chars_per_second`). Each narration takes `latency` seconds.
+    """
+
+    CHUNK_SIZE = 4096
+
+    def __init__(self, latency=1.0, chars_per_second=15, recordings=None):
+        self.latency = latency
+        self.chars_per_second = chars_per_second
+        self.recordings = recordings
+        self.stats = {"narrations": 0, "replayed": 0}
+        self.text_to_speech = types.SimpleNamespace(convert=self._convert)
+
+    def _audio(self, text, voice_id):
+        if self.recordings is not None:
+            path = os.path.join(self.recordings, narration_key(text, voice_id) + ".mp3")
+            if os.path.exists(path):
+                self.stats["replayed"] += 1
+                with open(path, "rb") as f:
+                    return f.read()
+        return silent_audio(max(1.0, len(text) / self.chars_per_second))
+
+    async def _convert(self, text, voice_id, **kwargs):
+        self.stats["narrations"] += 1
+        await asyncio.sleep(self.latency)
+        audio = self._audio(text, voice_id)
+        for start in range(0, len(audio), self.CHUNK_SIZE):
+            yield audio[start : start + self.CHUNK_SIZE]
+
+    def report(self):
+        return (
+            f"{self.stats['narrations']} narrations "
+            f"({self.stats['replayed']} replayed)"
+        )
+
+
+class RecordingElevenLabs:
+    """
+    Wraps an AsyncElevenLabs client and saves every narration to
+    `directory`, where FakeElevenLabs can replay it.
+    """
+
+    def __init__(self, client, directory):
+        self.client = client
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.text_to_speech = types.SimpleNamespace(convert=self._convert)
+
+    async def _convert(self, text, voice_id, **kwargs):
+        audio = io.BytesIO()
+        async for chunk in self.client.text_to_speech.convert(
+            text=text, voice_id=voice_id, **kwargs
+        ):
+            audio.write(chunk)
+            yield chunk
+        path = os.path.join(self.directory, narration_key(text, voice_id) + ".mp3")
+        with open(path, "wb") as f:
+            f.write(audio.getvalue())
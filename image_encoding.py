@@ -0,0 +1,115 @@
+import io
+
+from PIL import Image
+
+# format name -> (Pillow format, mime type, file extension)
+IMAGE_FORMATS = {
+    "png": ("PNG", "image/png", "png"),
+    "jpeg": ("JPEG", "image/jpeg", "jpg"),
+    "webp": ("WEBP", "image/webp", "webp"),
+}
+
+
+class ImageEncoder:
+    """
+    Encoding settings for images that are uploaded to the vision API.
+
+    Covers the output format, the lossy quality and an optional grayscale
+    conversion (manga scans rarely need colour). The encoder also keeps a tally
+    of how many bytes it produced; with `measure_savings` it encodes every image
+    as plain PNG as well, so a run can report how much upload volume the
+    settings saved, at the cost of a second encode per image.
+    """
+
+    def __init__(
+        self, format="png", quality=85, grayscale=False, measure_savings=False
+    ):
+        if format not in IMAGE_FORMATS:
+            raise ValueError(
+                f"Unsupported image format {format!r}, expected one of {list(IMAGE_FORMATS)}"
+            )
+        self.format = format
+        self.quality = quality
+        self.grayscale = grayscale
+        self.measure_savings = measure_savings
+        self.stats = {"images": 0, "bytes": 0, "png_bytes": 0}
+
+    @property
+    def mime_type(self):
+        return IMAGE_FORMATS[self.format][1]
+
+    @property
+    def extension(self):
+        return IMAGE_FORMATS[self.format][2]
+
+    @property
+    def tag(self):
+        """Short description of the settings, used in cache keys."""
+        tag = self.format
+        if self.format != "png":
+            tag += f"-q{self.quality}"
+        if self.grayscale:
+            tag += "-gray"
+        return tag
+
+    def clone(self):
+        """Return an encoder with the same settings and empty statistics."""
+        return ImageEncoder(
+            self.format, self.quality, self.grayscale, self.measure_savings
+        )
+
+    def _save(self, image, format, **params):
+        buffer = io.BytesIO()
+        image.save(buffer, format=format, **params)
+        return buffer.getvalue()
+
+    def encode(self, image):
+        """
+        Encode a PIL image with the configured settings.
+
+        Args:
+        - image (PIL.Image.Image): The image to encode.
+
+        Returns:
+        - bytes: The encoded image.
+        """
+        original = image
+        if self.grayscale and image.mode != "L":
+            image = image.convert("L")
+
+        pil_format = IMAGE_FORMATS[self.format][0]
+        if pil_format == "PNG":
+            encoded = self._save(image, "PNG")
+        else:
+            if image.mode not in ("L", "RGB"):
+                image = image.convert("RGB")
+            encoded = self._save(image, pil_format, quality=self.quality)
+
+        self.stats["images"] += 1
+        self.stats["bytes"] += len(encoded)
+        if self.measure_savings:
+            # PNG of the unmodified image is the baseline for the savings report
+            if image is original and pil_format == "PNG":
+                self.stats["png_bytes"] += len(encoded)
+            else:
+                self.stats["png_bytes"] += len(self._save(original, "PNG"))
+        return encoded
+
+    def data_url(self, image_base64):
+        return f"data:{self.mime_type};base64,{image_base64}"
+
+    def merge(self, stats):
+        """Add statistics collected by a clone, e.g. in a worker process."""
+        for key, value in stats.items():
+            self.stats[key] += value
+
+    def report(self):
+        images = self.stats["images"]
+        encoded = self.stats["bytes"]
+        report = f"Encoded {images} images as {self.tag}: {encoded:,} bytes"
+        if not self.measure_savings:
+            return report
+        baseline = self.stats["png_bytes"]
+        saved = baseline - encoded
+        pct = 100 * saved / baseline if baseline else 0
+        return f"{report} (PNG: {baseline:,} bytes, saved {saved:,} bytes / {pct:.1f}%)"
@@ -1,10 +1,22 @@
 import fitz  # Import the PyMuPDF library
+import numpy as np
 from PIL import Image
 import io
 import base64
 import shutil
 import os
-from panel_extractor.panel_extractor import PanelExtractor
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from panel_extractor.panel_extractor import Panel, PanelExtractor
+from panel_extractor.utils import load_image_from_bytes
+from page_store import PageHandle, page_bytes, page_digest, page_image
+from render_cache import file_digest
+from image_encoding import ImageEncoder
+
+# PyMuPDF's default resolution, which pages are rendered at unless told otherwise
+RENDER_DPI = 72
+# render cache entries holding a page's paper score
+PAPER_SCORE_SUFFIX = ".score"
 
 
 def generate_image_array_from_pdfs(pdf_files):
@@ -16,23 +28,249 @@ def generate_image_array_from_pdfs(pdf_files):
             pix = page.get_pixmap()  # Render page to a pixmap (an image)
             img = pix.tobytes("png")  # Convert the pixmap to PNG bytes (in memory)
             images.append(img)  # Append the PNG image bytes to the array
+        doc.close()  # Close the PDF file
 
-    doc.close()  # Close the PDF file
     return images  # Return the array of images
 
 
-def scale_image(image_bytes, square_size=512):
+def _render_page_shard(shard):
+    """
+    Render and scale a contiguous range of pages from a PDF.
+
+    Runs inside a worker process, so the document is opened here rather than
+    shared with the parent (fitz documents cannot be pickled). Pages found in
+    the render cache are not rasterized or scaled again, and the document is
+    only opened if at least one page has to be rendered.
+
+    Args:
+    - shard (tuple): (pdf_file, start, stop, square_size, dpi, cache, pdf_digest,
+      encoder, paper_row_step).
+
+    Returns:
+    - tuple: (list of (full PNG bytes, scaled image bytes, paper score) for
+      each page in the range, statistics of the scaled image encoder). The
+      paper score (see PanelExtractor.paper_score) is taken from the raw
+      pixels, and cached next to the render.
+    """
+    (
+        pdf_file,
+        start,
+        stop,
+        square_size,
+        dpi,
+        cache,
+        pdf_digest,
+        encoder,
+        paper_row_step,
+    ) = shard
+    # a fresh copy, so the statistics returned cover only this shard
+    encoder = encoder.clone()
+    scaled_suffix = "." + encoder.extension
+    doc = None
+    rendered = []
+    try:
+        for index in range(start, stop):
+            img = scaled = pix = paper = None
+            if cache is not None:
+                full_key = cache.key(pdf_digest, index, dpi, "full")
+                scaled_key = cache.key(
+                    pdf_digest, index, dpi, f"{square_size}.{encoder.tag}"
+                )
+                paper_key = cache.key(pdf_digest, index, dpi, f"paper.{paper_row_step}")
+                img = cache.get(full_key)
+                scaled = cache.get(scaled_key, scaled_suffix)
+                paper = cache.get(paper_key, PAPER_SCORE_SUFFIX)
+                if paper is not None:
+                    paper = float(paper)
+
+            if img is None:
+                if doc is None:
+                    doc = fitz.open(pdf_file)
+                # scale via the matrix so the default 72 dpi render is unchanged
+                zoom = dpi / 72
+                pix = doc[index].get_pixmap(matrix=fitz.Matrix(zoom, zoom))
+                img = pix.tobytes("png")
+                paper = pixmap_paper_score(pix, paper_row_step)
+                if cache is not None:
+                    cache.put(full_key, img)
+                    cache.put(paper_key, repr(paper).encode(), PAPER_SCORE_SUFFIX)
+            elif paper is None:
+                # cached by a run from before scores were cached
+                paper = PanelExtractor.paper_score(
+                    load_image_from_bytes(img), paper_row_step
+                )
+                if cache is not None:
+                    cache.put(paper_key, repr(paper).encode(), PAPER_SCORE_SUFFIX)
+            if scaled is None:
+                # scale from the raw pixels when we have them, skipping a PNG decode
+                source = pixmap_to_image(pix) if pix is not None else img
+                scaled = scale_image(source, square_size, encoder)
+                if cache is not None:
+                    cache.put(scaled_key, scaled, scaled_suffix)
+
+            rendered.append((img, scaled, paper))
+    finally:
+        if doc is not None:
+            doc.close()
+    return rendered, encoder.stats
+
+
+def generate_image_array_from_pdf_parallel(
+    pdf_file,
+    workers=None,
+    square_size=512,
+    store=None,
+    cache=None,
+    dpi=RENDER_DPI,
+    encoder=None,
+    paper_scores=False,
+    paper_row_step=2,
+):
+    """
+    Render every page of a PDF across a pool of worker processes.
+
+    Pages are split into contiguous shards, each worker opens its own copy of
+    the document, and the pages of each shard are put in place (and in the
+    store, if given) as soon as it finishes.
+
+    Args:
+    - pdf_file (str): Path to the PDF.
+    - workers (int): Number of worker processes, defaults to the CPU count.
+    - square_size (int): Bounding square for the scaled copy of each page.
+    - store (PageStore): If given, pages are written to the store as each shard
+      finishes and page handles are returned instead of bytes.
+    - cache (RenderCache): If given, rendered and scaled pages are reused from
+      and saved to this persistent cache.
+    - dpi (int): Render resolution (72 is PyMuPDF's default).
+    - encoder (ImageEncoder): Encoding for the scaled pages, PNG by default.
+      Full pages are always PNG.
+    - paper_scores (bool): Also return the paper score of each page.
+    - paper_row_step (int): Row step of the paper score (see PanelExtractor).
+
+    Returns:
+    - tuple: (list of full pages, list of scaled pages[, list of paper scores]).
+    """
+    doc = fitz.open(pdf_file)
+    page_count = doc.page_count
+    doc.close()
+
+    encoder = encoder or ImageEncoder()
+    pdf_digest = None
+    if cache is not None:
+        pdf_digest = file_digest(pdf_file)
+        scaled_suffix = "." + encoder.extension
+        fully_cached = all(
+            cache.contains(cache.key(pdf_digest, index, dpi, "full"))
+            and cache.contains(
+                cache.key(pdf_digest, index, dpi, f"{square_size}.{encoder.tag}"),
+                scaled_suffix,
+            )
+            for index in range(page_count)
+        )
+        if fully_cached:
+            # nothing to render, so a process pool would only add startup cost
+            workers = 1
+
+    workers = workers or os.cpu_count() or 1
+    workers = max(1, min(workers, page_count))
+    # a few shards per worker keeps the pool busy when some pages are slower
+    shard_size = max(1, -(-page_count // (workers * 4)))
+    shards = [
+        (
+            pdf_file,
+            start,
+            min(start + shard_size, page_count),
+            square_size,
+            dpi,
+            cache,
+            pdf_digest,
+            encoder,
+            paper_row_step,
+        )
+        for start in range(0, page_count, shard_size)
+    ]
+
+    full_images = [None] * page_count
+    scaled_images = [None] * page_count
+    scores = [None] * page_count
+
+    def collect(start, result):
+        rendered, stats = result
+        encoder.merge(stats)
+        for index, (img, scaled, paper) in enumerate(rendered, start):
+            if store is not None:
+                img, scaled = store.put(img), store.put(scaled)
+            full_images[index] = img
+            scaled_images[index] = scaled
+            scores[index] = paper
+
+    if workers == 1:
+        for shard in shards:
+            collect(shard[1], _render_page_shard(shard))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(_render_page_shard, shard): shard[1] for shard in shards
+            }
+            # shards are written to the store as they finish, in any order, so
+            # only the shards that are not collected yet are held in memory
+            for future in as_completed(futures):
+                collect(futures.pop(future), future.result())
+
+    if cache is not None:
+        cache.evict()
+
+    if paper_scores:
+        return full_images, scaled_images, scores
+    return full_images, scaled_images
+
+
+def pixmap_to_image(pix):
+    """
+    Build a PIL Image directly from a pixmap's raw samples.
+
+    Avoids encoding the pixmap to PNG only to decode it again with PIL.
+
+    Args:
+    - pix (fitz.Pixmap): The rendered page.
+
+    Returns:
+    - PIL.Image.Image: The page as an in-memory image.
+    """
+    mode = {1: "L", 2: "LA", 3: "RGB", 4: "RGBA"}[pix.n]
+    return Image.frombytes(mode, (pix.width, pix.height), pix.samples)
+
+
+def pixmap_paper_score(pix, row_step=2):
+    """
+    PanelExtractor.paper_score of a rendered page, straight from the pixmap's
+    samples.
+    """
+    samples = np.frombuffer(pix.samples_mv, dtype=np.uint8)
+    samples = samples.reshape(pix.height, pix.stride)[:, : pix.width * pix.n]
+    samples = samples.reshape(pix.height, pix.width, pix.n)
+    # the first channel of the BGR pages the extractor decodes is blue
+    channel = 2 if pix.n >= 3 else 0
+    return PanelExtractor.paper_score(samples[:, :, channel], row_step)
+
+
+def scale_image(image_bytes, square_size=512, encoder=None):
     """
     Scale the image to fit within a 512x512 square, maintaining aspect ratio.
 
     Args:
-    - image_bytes (bytes): The original image in bytes.
+    - image_bytes (bytes or PIL.Image.Image): The original image, either encoded
+      bytes or an already decoded image.
+    - encoder (ImageEncoder): Output encoding, PNG by default.
 
     Returns:
     - bytes: The scaled image in bytes.
     """
-    # Convert bytes to a PIL Image
-    image = Image.open(io.BytesIO(image_bytes))
+    if isinstance(image_bytes, Image.Image):
+        image = image_bytes
+    else:
+        # Convert bytes to a PIL Image
+        image = Image.open(io.BytesIO(image_bytes))
 
     # Calculate the target size to maintain aspect ratio
     target_size = square_size
@@ -45,20 +283,19 @@ def scale_image(image_bytes, square_size=512):
     resized_image = image.resize((new_width, new_height), Image.Resampling.LANCZOS)
 
     # Convert the PIL Image back to bytes
-    img_byte_arr = io.BytesIO()
-    resized_image.save(img_byte_arr, format="PNG")  # Save as PNG
-    scaled_image_bytes = img_byte_arr.getvalue()
+    encoder = encoder or ImageEncoder()
+    scaled_image_bytes = encoder.encode(resized_image)
 
     return scaled_image_bytes
 
 
 # Function to decode base64 to bytes, scale the image, and encode it back to base64
-def scale_base64_image(base64_image, square_size=512):
-    # Decode base64 to bytes
-    image_bytes = base64.b64decode(base64_image)
+def scale_base64_image(base64_image, square_size=512, encoder=None):
+    # Decode the page (or crop the panel out of its page)
+    image = page_image(base64_image)
 
     # Scale the image
-    scaled_image_bytes = scale_image(image_bytes, square_size)
+    scaled_image_bytes = scale_image(image, square_size, encoder)
 
     # Encode the scaled image back to base64
     scaled_base64_str = base64.b64encode(scaled_image_bytes).decode("utf-8")
@@ -73,21 +310,34 @@ def encode_images_to_base64(image_array):
     return base64_images
 
 
-def extract_all_pages_as_images(filename):
-    # Generate the image array from the specified PDFs
-    image_array = generate_image_array_from_pdfs([filename])
+def extract_all_pages_as_images(filename, store=None, encoder=None):
+    # Render in-process, scaling each page from its raw pixels
+    return extract_all_pages_as_images_parallel(
+        filename, workers=1, store=store, encoder=encoder
+    )
 
-    scaled_images = [scale_image(img) for img in image_array]
 
-    base_64_images = encode_images_to_base64(scaled_images)
+def extract_all_pages_as_images_parallel(
+    filename, workers=None, store=None, cache=None, encoder=None
+):
+    # Same output as extract_all_pages_as_images, rendered across worker processes
+    image_array, scaled_images, paper_scores = generate_image_array_from_pdf_parallel(
+        filename, workers, store=store, cache=cache, encoder=encoder, paper_scores=True
+    )
+
+    if store is not None:
+        return {"scaled": scaled_images, "full": image_array, "paper": paper_scores}
 
     return {
         "scaled": encode_images_to_base64(scaled_images),
         "full": encode_images_to_base64(image_array),
+        "paper": paper_scores,
     }
 
 
-def save_important_pages(volume, profile_pages, chapter_pages, manga, volume_number):
+def save_important_pages(
+    volume, profile_pages, chapter_pages, manga, volume_number, extension="png"
+):
     profile_dir = f"{manga}/v{volume_number}/profiles"
     chapter_dir = f"{manga}/v{volume_number}/chapters"
 
@@ -102,13 +352,13 @@ def save_important_pages(volume, profile_pages, chapter_pages, manga, volume_num
 
     # Save profile images
     for i in profile_pages:
-        with open(f"{profile_dir}/{i}.png", "wb") as f:
-            f.write(base64.b64decode(volume[i]))
+        with open(f"{profile_dir}/{i}.{extension}", "wb") as f:
+            f.write(page_bytes(volume[i]))
 
     # Save chapter images
     for i in chapter_pages:
-        with open(f"{chapter_dir}/{i}.png", "wb") as f:
-            f.write(base64.b64decode(volume[i]))
+        with open(f"{chapter_dir}/{i}.{extension}", "wb") as f:
+            f.write(page_bytes(volume[i]))
 
 
 def save_all_pages(volume, manga, volume_number):
@@ -121,22 +371,212 @@ def save_all_pages(volume, manga, volume_number):
 
     for i, img in enumerate(volume):
         with open(f"{pages_dir}/{i}.png", "wb") as f:
-            f.write(base64.b64decode(img))
+            f.write(page_bytes(img))
 
     return pages_dir
 
 
-def extract_panels(movie_script):
+# each panel worker process keeps one extractor for all its pages
+_panel_extractor = None
+
+
+def _new_panel_extractor(paper_th=0.35, max_bubble=None, detector_options=None):
+    return PanelExtractor(
+        keep_text=True,
+        min_pct_panel=2,
+        max_pct_panel=90,
+        paper_th=paper_th,
+        max_pct_bubble=max_bubble,
+        grayscale=True,
+        detector_options=detector_options,
+    )
+
+
+def _init_panel_worker(max_bubble=None, detector_options=None, threads=None):
+    global _panel_extractor
+    # workers share the cores instead of each detecting text with all of them
+    detector_options = {"threads": threads, **(detector_options or {})}
+    _panel_extractor = _new_panel_extractor(
+        max_bubble=max_bubble, detector_options=detector_options
+    )
+
+
+def _analyze_page(page):
+    # only the geometry travels back from the worker, not the crops; the page
+    # is decoded straight from its bytes, without a base64 round-trip
+    img = load_image_from_bytes(page_bytes(page), _panel_extractor.grayscale)
+    return _panel_extractor.analyze_page(img)
+
+
+def _page_key(page):
+    # identical pages share a key: handles by content digest, base64 by value
+    if isinstance(page, PageHandle):
+        return page.digest
+    return page
+
+
+def extract_volume_panels(
+    pages,
+    workers=None,
+    cache=None,
+    paper_scores=None,
+    paper_th=0.35,
+    max_bubble=None,
+    detector_options=None,
+    dpi=RENDER_DPI,
+):
+    """
+    Extract the panels of a set of pages across a pool of worker processes.
+
+    Identical pages are only processed once, and every worker keeps a single
+    PanelExtractor for all the pages it is given. Panels are returned as
+    Panel descriptors pointing at their page; `page_image` crops them.
+
+    Args:
+    - pages (dict): Page index -> page (handle or base64 string).
+    - workers (int): Number of worker processes, defaults to the CPU count.
+    - cache (PanelCache): If given, page analyses are reused from and saved
+      to this persistent cache.
+    - paper_scores (dict): Page index -> paper score measured when the page
+      was rendered, or None. Pages known to fail the paper texture check are
+      neither decoded nor analyzed.
+    - paper_th (float): Paper texture threshold (see PanelExtractor), None to
+      extract panels from every page.
+    - max_bubble (int): Leave out panels that are more than this percentage
+      speech bubble, None to keep them. Text is only detected with this set.
+    - detector_options (dict): Keyword arguments for the TextDetector.
+    - dpi (int): Resolution the pages were rendered at, which sizes the text
+      detector's canvas when it is adaptive.
+
+    Returns:
+    - dict: Page index -> list of Panel descriptors.
+    """
+    detector_options = dict(detector_options or {})
+    if detector_options.get("adaptive_canvas"):
+        detector_options.setdefault("dpi", dpi)
+    extractor = _new_panel_extractor(paper_th, max_bubble, detector_options)
+    unique = {}
+    not_paper = set()
+    for index, page in pages.items():
+        key = _page_key(page)
+        unique.setdefault(key, page)
+        score = (paper_scores or {}).get(index)
+        if score is not None and not extractor.is_paper_score(score):
+            not_paper.add(key)
+
+    analyses = {}
+    digests = {}
+    settings = extractor.analysis_settings()
+    if cache is not None:
+        for key, page in unique.items():
+            if key in not_paper:
+                continue
+            digests[key] = page_digest(page)
+            analysis = cache.get_analysis(digests[key], settings)
+            if analysis is not None:
+                analyses[key] = analysis
+    missing = [key for key in unique if key not in analyses and key not in not_paper]
+
+    if missing:
+        workers = workers or os.cpu_count() or 1
+        workers = max(1, min(workers, len(missing)))
+        todo = [unique[key] for key in missing]
+        threads = max(1, (os.cpu_count() or 1) // workers)
+        initargs = (max_bubble, detector_options, threads)
+        if workers == 1:
+            _init_panel_worker(*initargs)
+            results = list(map(_analyze_page, todo))
+        else:
+            # the pool is started from a worker thread (app.main runs this
+            # with asyncio.to_thread), where forking the process is unsafe
+            with ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_panel_worker,
+                initargs=initargs,
+            ) as executor:
+                chunksize = max(1, len(todo) // (workers * 4))
+                results = list(executor.map(_analyze_page, todo, chunksize=chunksize))
+        for key, analysis in zip(missing, results):
+            analyses[key] = analysis
+            if cache is not None:
+                cache.put_analysis(digests[key], analysis, settings)
+        if cache is not None:
+            cache.evict()
+
+    # the thresholds are applied here, so cached analyses serve any settings
+    panels = {}
+    for key, page in unique.items():
+        if key in not_paper:
+            # the whole page, sized from its header alone
+            width, height = Image.open(io.BytesIO(page_bytes(page))).size
+            panels[key] = [Panel((0, 0, width, height))]
+        else:
+            panels[key] = extractor.select_panels(analyses[key])
+        for panel in panels[key]:
+            panel.page = page
+    return {index: panels[_page_key(page)] for index, page in pages.items()}
+
+
+def extract_panels(
+    movie_script,
+    volume=None,
+    workers=None,
+    cache=None,
+    paper_scores=None,
+    paper_th=0.35,
+    max_bubble=None,
+    detector_options=None,
+    dpi=RENDER_DPI,
+):
+    """
+    Extract the panels of every page cited in the movie script, once per page.
+
+    Each segment gets a "panels" map from the index of a page in its
+    "images_unscaled" to that page's panels.
 
-    panel_extractor = PanelExtractor(keep_text=True, min_pct_panel=2, max_pct_panel=90)
+    Args:
+    - movie_script (list): The segments of the script.
+    - volume (list): The full-size pages of the volume, to index pages by their
+      position in it. Pages are numbered in order of appearance otherwise.
+    - workers (int): Number of worker processes, defaults to the CPU count.
+    - cache (PanelCache): Persistent cache of page analyses.
+    - paper_scores (list): Paper score of each page of `volume` from
+      rendering (see extract_all_pages_as_images_parallel), or None.
+    - paper_th (float): Paper texture threshold, None to skip the check.
+    - max_bubble (int): Leave out panels that are more than this percentage
+      speech bubble, None to keep them.
+    - detector_options (dict): Keyword arguments for the TextDetector.
+    - dpi (int): Resolution the pages were rendered at.
 
+    Returns:
+    - dict: Page index -> list of Panel descriptors.
+    """
+    volume = volume or []
+    indices = {}
+    for index, page in enumerate(volume):
+        indices.setdefault(_page_key(page), index)
+    pages = {}
+    for segment in movie_script:
+        for page in segment["images_unscaled"]:
+            key = _page_key(page)
+            if key not in indices:
+                indices[key] = len(volume) + len(pages)
+            pages[indices[key]] = page
+
+    print("Number of pages to extract panels from:", len(pages))
+    scores = {}
+    if paper_scores is not None:
+        scores = {index: paper_scores[index] for index in pages if index < len(volume)}
+    panels = extract_volume_panels(
+        pages, workers, cache, scores, paper_th, max_bubble, detector_options, dpi
+    )
     for segment in movie_script:
-        base64_images = segment["images_unscaled"]
-        print("Number of unscaled images in segment:", len(base64_images))
-        panels = panel_extractor.extract(base64_images)
-        print("Number of panels generated:", len(panels))
-        segment["panels"] = panels
-        print("Panels generated for text:", segment["text"])
+        segment["panels"] = {
+            j: panels[indices[_page_key(page)]]
+            for j, page in enumerate(segment["images_unscaled"])
+        }
+    return panels
 
 
 def split_volume_into_parts(volume, volume_unscaled, chapter_pages, num_parts):
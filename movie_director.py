@@ -13,6 +13,8 @@ from moviepy import (
 )
 import moviepy as mpe
 
+from page_store import page_image
+
 
 async def make_movie(movie_script, manga, volume_number, narration_client):
     print("Narrating movie script...")
@@ -81,12 +83,8 @@ def create_movie_from_script(script, manga, volume_number):
         image_display_duration = audio_duration / len(scene_images)
         segment_clips = []
         for base64_image in scene_images:
-            image_data = base64.b64decode(base64_image)
-            scaled_image = scale_image_to_720p(
-                image_data
-            )  # Assume this function returns scaled image data
-
-            image = Image.open(BytesIO(scaled_image))
+            # pages and panels alike are decoded (or cropped) once, then scaled
+            image = scale_image_to_720p(page_image(base64_image))
             final_image = add_image_to_background(
                 image
             )  # Assume this function adds image to background
@@ -133,27 +131,16 @@ def create_movie_from_script(script, manga, volume_number):
     return final_movie_path
 
 
-def scale_image_to_720p(image_bytes, target_width=1280, target_height=720):
-    # Convert bytes to a PIL Image
-    image = Image.open(io.BytesIO(image_bytes))
-
+def scale_image_to_720p(image, target_width=1280, target_height=720):
     # Calculate the target size to maintain aspect ratio
     original_width, original_height = image.size
     ratio = min(target_width / original_width, target_height / original_height)
     new_width = int(original_width * ratio)
     new_height = int(original_height * ratio)
 
-    # Resize the image
-    resized_image = image.resize((new_width, new_height), Image.Resampling.LANCZOS)
-
-    # Convert the PIL Image back to bytes
-    img_byte_arr = io.BytesIO()
-    resized_image.save(
-        img_byte_arr, format="JPEG"
-    )  # Save as JPEG for better compatibility with video formats
-    scaled_image_bytes = img_byte_arr.getvalue()
-
-    return scaled_image_bytes
+    # Resize the image; it goes straight onto the background, no need to
+    # encode it in between
+    return image.resize((new_width, new_height), Image.Resampling.LANCZOS)
 
 
 def add_image_to_background(image, background_size=(1280, 720)):
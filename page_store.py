@@ -0,0 +1,207 @@
+import base64
+import functools
+import hashlib
+import io
+import mmap
+import os
+import struct
+import tempfile
+import threading
+
+import numpy as np
+from PIL import Image
+
+
+class PageHandle:
+    """
+    Lightweight reference to a page kept in a page store.
+
+    Handles only hold the content digest and where the bytes live, so lists of
+    handles can be sliced and copied freely; the image bytes are read from disk
+    when `read()` or `base64()` is called.
+    """
+
+    __slots__ = ("store", "digest", "offset", "length")
+
+    def __init__(self, store, digest, offset=0, length=None):
+        self.store = store
+        self.digest = digest
+        self.offset = offset
+        self.length = length
+
+    def read(self):
+        return self.store.read(self)
+
+    def base64(self):
+        return base64.b64encode(self.read()).decode("utf-8")
+
+    def __eq__(self, other):
+        return isinstance(other, PageHandle) and self.digest == other.digest
+
+    def __hash__(self):
+        return hash(self.digest)
+
+    def __repr__(self):
+        return f"PageHandle({self.digest[:12]})"
+
+
+class PageStore:
+    """
+    Content-addressed directory of page images.
+
+    Each page is written once to `<directory>/<digest[:2]>/<digest>.png`, so
+    identical pages (e.g. blank pages, or re-runs into the same directory) are
+    only stored once.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, digest):
+        return os.path.join(self.directory, digest[:2], digest + ".png")
+
+    def put(self, image_bytes):
+        digest = hashlib.sha256(image_bytes).hexdigest()
+        path = self._path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # write to a temporary file first so readers never see a partial page
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, "wb") as f:
+                f.write(image_bytes)
+            os.replace(tmp_path, path)
+        return PageHandle(self, digest, 0, len(image_bytes))
+
+    def read(self, handle):
+        with open(self._path(handle.digest), "rb") as f:
+            return f.read()
+
+
+class PackedPageStore:
+    """
+    Single append-only pack file of page images, read back through mmap.
+
+    Every record is a header (32-byte sha256 digest, 8-byte length) followed by
+    the image bytes. The index is rebuilt by scanning the headers when an
+    existing pack is opened, so the pack is reusable across runs.
+    """
+
+    HEADER = struct.Struct("<32sQ")
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._index = {}
+        self._map = None
+        self._reader = None
+        open(path, "ab").close()
+        self._load_index()
+
+    def __getstate__(self):
+        # the mmap and file objects are per-process; workers reopen lazily
+        return {"path": self.path}
+
+    def __setstate__(self, state):
+        self.path = state["path"]
+        self._lock = threading.Lock()
+        self._index = {}
+        self._map = None
+        self._reader = None
+        self._load_index()
+
+    def _load_index(self):
+        with open(self.path, "rb") as f:
+            offset = 0
+            while True:
+                header = f.read(self.HEADER.size)
+                if len(header) < self.HEADER.size:
+                    break
+                digest, length = self.HEADER.unpack(header)
+                offset += self.HEADER.size
+                self._index[digest.hex()] = (offset, length)
+                offset += length
+                f.seek(offset)
+
+    def put(self, image_bytes):
+        raw_digest = hashlib.sha256(image_bytes).digest()
+        digest = raw_digest.hex()
+        with self._lock:
+            if digest not in self._index:
+                with open(self.path, "ab") as f:
+                    f.write(self.HEADER.pack(raw_digest, len(image_bytes)))
+                    offset = f.tell()
+                    f.write(image_bytes)
+                self._index[digest] = (offset, len(image_bytes))
+            offset, length = self._index[digest]
+        return PageHandle(self, digest, offset, length)
+
+    def read(self, handle):
+        end = handle.offset + handle.length
+        with self._lock:
+            # remap when the pack has grown past the current mapping
+            if self._map is None or len(self._map) < end:
+                if self._map is not None:
+                    self._map.close()
+                    self._reader.close()
+                self._reader = open(self.path, "rb")
+                self._map = mmap.mmap(self._reader.fileno(), 0, access=mmap.ACCESS_READ)
+            return self._map[handle.offset : end]
+
+    def close(self):
+        with self._lock:
+            if self._map is not None:
+                self._map.close()
+                self._reader.close()
+                self._map = None
+                self._reader = None
+
+
+def open_page_store(path, packed=False):
+    if packed:
+        return PackedPageStore(path)
+    return PageStore(path)
+
+
+def page_bytes(page):
+    """Return the image bytes of a page given as a handle or a base64 string."""
+    if isinstance(page, PageHandle):
+        return page.read()
+    return base64.b64decode(page)
+
+
+def page_base64(page):
+    """Return the base64 string of a page given as a handle or a base64 string."""
+    if isinstance(page, PageHandle):
+        return page.base64()
+    return page
+
+
+@functools.lru_cache(maxsize=8)
+def _decoded_page(page):
+    # the panels of a page are usually cropped one after another, so the last
+    # few pages are kept decoded
+    image = Image.open(io.BytesIO(page_bytes(page)))
+    if image.mode not in ("L", "RGB"):
+        image = image.convert("RGB")
+    return np.asarray(image)
+
+
+def page_image(page):
+    """
+    Return a page given as a handle or a base64 string, or a panel of one, as
+    a PIL image.
+
+    Panels are descriptors (see panel_extractor.Panel) whose `page` is a handle
+    or base64 string; they are only cropped out of the decoded page here.
+    """
+    if isinstance(page, (PageHandle, str)):
+        return Image.open(io.BytesIO(page_bytes(page)))
+    return Image.fromarray(page.crop(_decoded_page(page.page)))
+
+
+def page_digest(page):
+    """Return the sha256 hex digest of the image bytes of a page."""
+    if isinstance(page, PageHandle):
+        return page.digest
+    return hashlib.sha256(page_bytes(page)).hexdigest()
@@ -0,0 +1,99 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from panel_extractor.panel_extractor import Panel
+from render_cache import RenderCache
+
+DEFAULT_PANEL_CACHE_DIR = os.path.join(
+    os.path.expanduser("~"), ".cache", "manga-reader", "panels"
+)
+
+# bump when the panel analysis changes, so older entries are ignored
+PANEL_ANALYSIS_VERSION = 2
+
+
+def _dump_analysis(analysis):
+    data = {
+        "size": list(analysis["size"]),
+        "paper_score": analysis["paper_score"],
+        "candidates": [
+            [
+                area,
+                list(panel.bbox),
+                None if panel.polygon is None else panel.polygon[:, 0].tolist(),
+            ]
+            for area, panel in analysis["candidates"]
+        ],
+    }
+    if "bubble_shares" in analysis:
+        data["bubble_shares"] = analysis["bubble_shares"]
+    return json.dumps(data).encode("utf-8")
+
+
+def _load_analysis(data):
+    analysis = json.loads(data)
+    loaded = {
+        "size": tuple(analysis["size"]),
+        "paper_score": analysis["paper_score"],
+        "candidates": [
+            (
+                area,
+                Panel(
+                    bbox,
+                    (
+                        None
+                        if polygon is None
+                        else np.array(polygon, dtype=np.int32).reshape(-1, 1, 2)
+                    ),
+                ),
+            )
+            for area, bbox, polygon in analysis["candidates"]
+        ],
+    }
+    if "bubble_shares" in analysis:
+        loaded["bubble_shares"] = analysis["bubble_shares"]
+    return loaded
+
+
+class PanelCache(RenderCache):
+    """
+    Persistent cache of panel analyses (see PanelExtractor.analyze_page).
+
+    Entries are keyed by the content hash of the page and the extractor
+    settings the analysis depends on (see PanelExtractor.analysis_settings).
+    The analysis is taken before the paper texture threshold and the panel
+    size limits are applied, so changing any of those reuses every cached page
+    instead of invalidating it. Only geometry is kept, panels are cropped when
+    needed.
+    Eviction is the same least recently used scheme as the render cache.
+    """
+
+    SUFFIX = ".json"
+    SUFFIXES = (SUFFIX,)
+
+    def __init__(self, directory=DEFAULT_PANEL_CACHE_DIR, max_bytes=64 * 1024**2):
+        super().__init__(directory, max_bytes)
+        self.stats = {"hits": 0, "misses": 0}
+
+    @staticmethod
+    def key(page_digest, settings=None):
+        settings = json.dumps(settings or {}, sort_keys=True)
+        key = f"{page_digest}:panels-v{PANEL_ANALYSIS_VERSION}:{settings}"
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    def get_analysis(self, page_digest, settings=None):
+        data = self.get(self.key(page_digest, settings))
+        if data is None:
+            self.stats["misses"] += 1
+            return None
+        self.stats["hits"] += 1
+        return _load_analysis(data)
+
+    def put_analysis(self, page_digest, analysis, settings=None):
+        self.put(self.key(page_digest, settings), _dump_analysis(analysis))
+
+    def report(self):
+        return f"{self.stats['hits']} pages cached, {self.stats['misses']} analyzed"
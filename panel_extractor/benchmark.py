@@ -0,0 +1,170 @@
+# stdlib
+import argparse
+from argparse import RawTextHelpFormatter
+import base64
+from pathlib import Path
+import time
+import tracemalloc
+
+# 3p
+import cv2
+import numpy as np
+
+# project
+from .panel_extractor import PanelExtractor
+from .utils import load_image, load_image_from_base64
+
+
+def generate_panel_blocks_full_page(img):
+    img = img if len(img.shape) == 2 else img[:, :, 0]
+    blur = cv2.GaussianBlur(img, (5, 5), 0)
+    thresh = cv2.threshold(blur, 230, 255, cv2.THRESH_BINARY)[1]
+    cv2.rectangle(thresh, (0, 0), tuple(img.shape[::-1]), (0, 0, 0), 10)
+    num_labels, labels, stats, centroids = cv2.connectedComponentsWithStats(
+        thresh, 4, cv2.CV_32S
+    )
+    if len(stats) < 2:
+        return np.ones(img.shape, dtype="uint8") * 255
+    ind = np.argsort(stats[:, 4])[::-1][1]
+    return ((labels == ind) * 255).astype("uint8")
+
+
+def generate_panels_full_page(extractor, img):
+    """
+    The original `generate_panels`: an int64 block mask, and every contour
+    masked in an int32 buffer the size of the page.
+    """
+    block_mask = generate_panel_blocks_full_page(img)
+    cv2.rectangle(
+        block_mask, (0, 0), tuple(block_mask.shape[::-1]), (255, 255, 255), 10
+    )
+    contours, hierarchy = cv2.findContours(
+        block_mask, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE
+    )
+    panels = []
+    for contour in contours:
+        area = cv2.contourArea(contour)
+        img_area = img.shape[0] * img.shape[1]
+        if area < (extractor.min_panel * img_area) or area > (
+            extractor.max_panel * img_area
+        ):
+            continue
+        x, y, w, h = cv2.boundingRect(contour)
+        panel_mask = np.ones_like(block_mask, "int32")
+        cv2.fillPoly(panel_mask, [contour.astype("int32")], color=(0, 0, 0))
+        panel_mask = panel_mask[y : y + h, x : x + w].copy()
+        panel = img[y : y + h, x : x + w].copy()
+        panel[panel_mask == 1] = 255
+        panels.append(panel)
+    return panels
+
+
+def measure(generate, imgs, repeat):
+    """Seconds per page and peak traced memory (bytes) of `generate`."""
+    panels = [generate(img) for img in imgs]  # warm up
+    start = time.time()
+    for _ in range(repeat):
+        for img in imgs:
+            generate(img)
+    elapsed = (time.time() - start) / (repeat * len(imgs))
+
+    peak = 0
+    for img in imgs:
+        tracemalloc.start()
+        generate(img)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return panels, elapsed, peak
+
+
+def main(args):
+    paths = sorted(
+        path
+        for path in Path(args.folder).iterdir()
+        if path.suffix.lower() in (".jpg", ".jpeg", ".png")
+    )
+    imgs = [load_image(str(path)) for path in paths]
+    if args.scale != 1:
+        imgs = [
+            cv2.resize(
+                img, None, fx=args.scale, fy=args.scale, interpolation=cv2.INTER_CUBIC
+            )
+            for img in imgs
+        ]
+    print(
+        f"{len(imgs)} pages from {args.folder}, {imgs[0].shape[1]}x{imgs[0].shape[0]}"
+    )
+
+    extractor = PanelExtractor(
+        min_pct_panel=args.min_panel, max_pct_panel=args.max_panel
+    )
+    reference, reference_time, reference_peak = measure(
+        lambda img: generate_panels_full_page(extractor, img), imgs, args.repeat
+    )
+    panels, elapsed, peak = measure(extractor.generate_panels, imgs, args.repeat)
+
+    identical = all(
+        len(a) == len(b) and all(np.array_equal(p, q) for p, q in zip(a, b))
+        for a, b in zip(panels, reference)
+    )
+    print(f"{'masking':>10} {'ms/page':>8} {'peak MB':>8}")
+    for name, t, m in (
+        ("full page", reference_time, reference_peak),
+        ("ROI", elapsed, peak),
+    ):
+        print(f"{name:>10} {t * 1000:>8.1f} {m / 2**20:>8.1f}")
+    print(
+        f"{reference_time / elapsed:.2f}x faster, "
+        f"{reference_peak / max(peak, 1):.2f}x less peak memory, "
+        f"panels {'identical' if identical else 'DIFFER'}"
+    )
+
+    # whole-page extraction, from the base64 PNG the pipeline passes around to
+    # the encoded panels, with colour and grayscale decoding
+    pages = [
+        base64.b64encode(cv2.imencode(".png", img)[1]).decode("utf-8") for img in imgs
+    ]
+    print(
+        f"{'decoding':>10} {'ms/page':>8} {'peak MB':>8} {'page MB':>8} {'panel KB':>9}"
+    )
+    for grayscale in (False, True):
+        extractor = PanelExtractor(
+            keep_text=True,
+            min_pct_panel=args.min_panel,
+            max_pct_panel=args.max_panel,
+            grayscale=grayscale,
+        )
+        encoded, t, m = measure(extractor.extract_page, pages, args.repeat)
+        page_mb = load_image_from_base64(pages[0], grayscale).nbytes / 2**20
+        panel_kb = sum(len(p) for panels in encoded for p in panels) * 3 / 4 / 1024
+        print(
+            f"{'grayscale' if grayscale else 'colour':>10} {t * 1000:>8.1f} "
+            f"{m / 2**20:>8.1f} {page_mb:>8.1f} {panel_kb / len(pages):>9.0f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="""Compare ROI-local panel masking with the original full-page masking,
+and colour with grayscale page extraction.""",
+        formatter_class=RawTextHelpFormatter,
+    )
+    parser.add_argument(
+        "-f",
+        "--folder",
+        default=str(Path(__file__).parent / "images"),
+        type=str,
+        help="Folder of manga pages to extract panels from.",
+    )
+    parser.add_argument(
+        "--scale",
+        type=float,
+        default=1,
+        help="Resize the pages first, e.g. to benchmark high-resolution scans.",
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--min_panel", type=int, default=2)
+    parser.add_argument("--max_panel", type=int, default=90)
+
+    args = parser.parse_args()
+    main(args)
@@ -1,18 +1,205 @@
 # stdlib
 import argparse
 from argparse import RawTextHelpFormatter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import json
+import os
+import re
+
+# 3p
+import cv2
+from tqdm import tqdm
 
 # project
-from panel_extractor import PanelExtractor
+from .panel_extractor import PanelExtractor
+from .utils import drop_colour, get_files, load_image
+
+# pages whose panels are all on disk, one relative path per line
+MANIFEST = ".extracted"
+
+# each worker process keeps one extractor (and text detector) for all its pages
+_panel_extractor = None
+
+
+def _init_worker(settings, threads):
+    global _panel_extractor
+    # workers share the cores instead of each using all of them
+    settings = dict(settings)
+    settings["detector_options"] = {
+        "threads": threads,
+        **(settings.get("detector_options") or {}),
+    }
+    _panel_extractor = PanelExtractor(**settings)
+    cv2.setNumThreads(threads)
+
+
+def _write(path, img):
+    # write to a temporary file first so a resumed run never sees a partial panel
+    root, ext = os.path.splitext(path)
+    tmp_path = f"{root}.tmp{ext}"
+    if not cv2.imwrite(tmp_path, img):
+        raise OSError(f"Could not write {path}")
+    os.replace(tmp_path, path)
+
+
+def _panel_ext(img_file):
+    # panels keep the format of their page, unless OpenCV cannot encode it
+    ext = os.path.splitext(img_file)[1]
+    return ext if cv2.haveImageWriter(img_file) else ".png"
+
+
+def _clear_panels(out_dir, name):
+    # panels left by an earlier run of the page, which may have found more
+    pattern = re.compile(rf"{re.escape(name)}_\d+(\.tmp)?\.[^.]+")
+    for file in os.listdir(out_dir):
+        if pattern.fullmatch(file):
+            os.remove(os.path.join(out_dir, file))
+
+
+def extract_page(img_file, out_dir, name):
+    """
+    Extract the panels of one page and save them as `<name>_<k><ext>` in
+    `out_dir`, replacing the panels of earlier runs. Pages failing the paper
+    texture check are saved whole. Panels keep the format of the page, or are
+    saved as PNG when OpenCV cannot write it.
+
+    Returns:
+    - int: Number of panels saved.
+    """
+    img = cv2.cvtColor(load_image(img_file), cv2.COLOR_RGB2BGR)
+    if _panel_extractor.grayscale:
+        img = drop_colour(img)
+    panels = _panel_extractor.extract_image(img)
+
+    ext = _panel_ext(img_file)
+    os.makedirs(out_dir, exist_ok=True)
+    _clear_panels(out_dir, name)
+    for k, panel in enumerate(panels):
+        _write(os.path.join(out_dir, f"{name}_{k}{ext}"), panel)
+    return len(panels)
+
+
+def extract_folder(folder, settings, workers=None, resume=True):
+    """
+    Extract the panels of every page under `folder` across a pool of worker
+    processes.
+
+    Panels are written to `<folder>/panels`, mirroring the layout of the
+    folder, as soon as each page is done. Finished pages are recorded in a
+    manifest there, along with the settings, and are skipped when the folder
+    is processed again with the same settings. Panels are named after their
+    page, so pages differing only by extension (`a.jpg`, `a.png`) in the same
+    folder are rejected with a ValueError before anything is written.
+
+    Args:
+    - settings (dict): Keyword arguments for PanelExtractor.
+    - workers (int): Number of worker processes, defaults to the CPU count.
+    - resume (bool): Skip pages already recorded in the manifest, unless the
+      settings have changed since.
+
+    Returns:
+    - int: Number of panels saved.
+    """
+    out_root = os.path.join(folder, "panels")
+    img_files, _, _ = get_files(folder)
+    # never pick up our own output as input
+    img_files = sorted(
+        f
+        for f in img_files
+        if os.path.commonpath([os.path.abspath(f), os.path.abspath(out_root)])
+        != os.path.abspath(out_root)
+    )
+
+    # panels are named after the page without its extension, so `a.jpg` and
+    # `a.png` would overwrite (and clear) each other's panels
+    pages = {}
+    for img_file in img_files:
+        rel = os.path.relpath(img_file, folder)
+        pages.setdefault(os.path.splitext(rel)[0], []).append(rel)
+    collisions = [rels for rels in pages.values() if len(rels) > 1]
+    if collisions:
+        raise ValueError(
+            "Pages with the same name would write the same panels, rename them: "
+            + "; ".join(", ".join(rels) for rels in collisions)
+        )
+
+    os.makedirs(out_root, exist_ok=True)
+    manifest = os.path.join(out_root, MANIFEST)
+    # the first line of the manifest holds the settings its pages were run with
+    header = json.dumps(settings, sort_keys=True)
+    done = set()
+    if resume and os.path.exists(manifest):
+        with open(manifest) as f:
+            lines = f.read().splitlines()
+        if lines[:1] == [header]:
+            done = set(lines[1:])
+        else:
+            print("Settings changed since the last run, extracting every page again")
+    if not done:
+        with open(manifest, "w") as f:
+            f.write(header + "\n")
+
+    jobs = []
+    for img_file in img_files:
+        rel = os.path.relpath(img_file, folder)
+        if rel in done:
+            continue
+        rel_dir, base = os.path.split(rel)
+        name = os.path.splitext(base)[0]
+        jobs.append((rel, img_file, os.path.join(out_root, rel_dir), name))
+    print(f"{len(img_files)} pages found, {len(jobs)} to extract")
+    if not jobs:
+        return 0
+
+    workers = workers or os.cpu_count() or 1
+    workers = max(1, min(workers, len(jobs)))
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    total = 0
+    with open(manifest, "a") as record, ProcessPoolExecutor(
+        max_workers=workers, initializer=_init_worker, initargs=(settings, threads)
+    ) as executor:
+        futures = {
+            executor.submit(extract_page, img_file, out_dir, name): rel
+            for rel, img_file, out_dir, name in jobs
+        }
+        for future in tqdm(
+            as_completed(futures), total=len(futures), desc="Extracting panels"
+        ):
+            try:
+                total += future.result()
+            except Exception as e:
+                # left out of the manifest, so the next run retries it
+                print(f"Failed to extract {futures[future]}: {e}")
+                continue
+            # recorded only once all of the page's panels are written
+            record.write(futures[future] + "\n")
+            record.flush()
+    return total
 
 
 def main(args):
-    panel_extractor = PanelExtractor(
+    settings = dict(
         keep_text=args.keep_text,
         min_pct_panel=args.min_panel,
         max_pct_panel=args.max_panel,
+        erase_bubbles=args.erase_bubbles,
+        max_pct_bubble=args.max_bubble,
+        grayscale=args.grayscale,
+        detector_options=dict(
+            backend=args.backend,
+            precision=args.precision,
+            fast=args.fast,
+            adaptive_canvas=args.adaptive_canvas,
+            dpi=args.dpi,
+        ),
     )
-    panel_extractor.extract(args.folder)
+    if args.model_path:
+        settings["detector_options"]["model_path"] = args.model_path
+    try:
+        total = extract_folder(args.folder, settings, args.workers, not args.restart)
+    except ValueError as e:
+        raise SystemExit(e)
+    print(f"{total} panels saved to {os.path.join(args.folder, 'panels')}")
 
 
 if __name__ == "__main__":
@@ -26,6 +213,63 @@ if __name__ == "__main__":
         action="store_true",
         help="Do not erase the dialogue bubble text.",
     )
+    parser.add_argument(
+        "-eb",
+        "--erase_bubbles",
+        action="store_true",
+        help="Erase whole speech bubbles, not only the detected text.",
+    )
+    parser.add_argument(
+        "-maxb",
+        "--max_bubble",
+        type=int,
+        choices=range(1, 101),
+        default=None,
+        metavar="[1-100]",
+        help="Skip panels whose area is more than this percentage speech bubble.",
+    )
+    parser.add_argument(
+        "-g",
+        "--grayscale",
+        action="store_true",
+        help="Process monochrome pages as a single channel (colour pages are kept).",
+    )
+    parser.add_argument(
+        "--backend",
+        choices=["torch", "torchscript", "onnx"],
+        default="torch",
+        help="""Text detector backend (default: torch).
+Export the model first for torchscript/onnx, see `text_detector/export.py`.""",
+    )
+    parser.add_argument(
+        "--model_path",
+        type=str,
+        default=None,
+        help="Exported text detector model (default: next to the CRAFT weights).",
+    )
+    parser.add_argument(
+        "--precision",
+        choices=["fp32", "bf16", "int8"],
+        default="fp32",
+        help="""Text detector precision (default: fp32).
+bf16 and int8 are experimental, see `text_detector/precision_report.py`.""",
+    )
+    parser.add_argument(
+        "--fast",
+        action="store_true",
+        help="Detect text at half resolution first, and refine only uncertain regions.",
+    )
+    parser.add_argument(
+        "--adaptive_canvas",
+        action="store_true",
+        help="Size the text detection canvas from the resolution of the pages (needs --dpi).",
+    )
+    parser.add_argument(
+        "--dpi",
+        type=float,
+        default=None,
+        help="Resolution the pages were scanned at.",
+    )
     parser.add_argument(
         "-minp",
         "--min_panel",
@@ -47,11 +291,25 @@ if __name__ == "__main__":
     parser.add_argument(
         "-f",
         "--folder",
-        default="./images/",
+        default=os.path.join(os.path.dirname(__file__), "images"),
         type=str,
         help="""folder path to input manga pages.
 Panels will be saved to a directory named `panels` in this folder.""",
     )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of worker processes (default: CPU count).",
+    )
+    parser.add_argument(
+        "--restart",
+        action="store_true",
+        help="Extract every page again instead of resuming from the last run.",
+    )
 
     args = parser.parse_args()
+    if args.adaptive_canvas and not args.dpi:
+        parser.error("--adaptive_canvas needs the --dpi of the pages")
     main(args)
@@ -5,18 +5,87 @@
 # 3p
 from tqdm import tqdm
 import numpy as np
-from skimage import measure
 import cv2
 import base64
 
 # project
-from .text_detector.main_text_detector import TextDetector
 from .utils import get_files, load_image, load_image_from_base64
 
 
+class Panel:
+    """
+    Where a panel is on its page, without its pixels.
+
+    `bbox` is (x, y, w, h) in page pixels and `polygon` the panel's outline in
+    page coordinates, or None when the panel fills its bounding box. `page`
+    identifies the page the panel comes from and is left to the caller.
+    """
+
+    __slots__ = ("page", "bbox", "polygon")
+
+    def __init__(self, bbox, polygon=None, page=None):
+        self.page = page
+        self.bbox = tuple(int(v) for v in bbox)
+        self.polygon = polygon
+
+    def mask(self, scratch=None):
+        """
+        Mask of the panel over its bounding box: 1 inside the outline, 0
+        outside.
+
+        Args:
+        - scratch (np.ndarray): Optional uint8 buffer at least as large as the
+          bounding box, reused for the mask.
+        """
+        x, y, w, h = self.bbox
+        if scratch is None:
+            scratch = np.empty((h, w), dtype=np.uint8)
+        panel_mask = scratch[:h, :w]
+        if self.polygon is None:
+            panel_mask.fill(1)
+            return panel_mask
+        # drawn over the bounding box only, with the outline moved into it
+        panel_mask.fill(0)
+        cv2.fillPoly(panel_mask, [self.polygon], color=1, offset=(-x, -y))
+        return panel_mask
+
+    def crop(self, img, scratch=None):
+        """
+        Cut the panel out of its page, with everything outside its outline
+        painted white.
+
+        Args:
+        - img (np.ndarray): The page, grayscale or colour.
+        - scratch (np.ndarray): See `mask`.
+
+        Returns:
+        - np.ndarray: The panel.
+        """
+        x, y, w, h = self.bbox
+        panel = img[y : y + h, x : x + w].copy()
+        if self.polygon is not None:
+            panel[self.mask(scratch) == 0] = 255
+        return panel
+
+    def __repr__(self):
+        # pages may be whole base64 images, so they are left out
+        return f"Panel({self.bbox}, polygon={self.polygon is not None})"
+
+
 class PanelExtractor:
     def __init__(
-        self, keep_text=False, min_pct_panel=2, max_pct_panel=90, paper_th=0.35
+        self,
+        keep_text=False,
+        min_pct_panel=2,
+        max_pct_panel=90,
+        paper_th=0.35,
+        paper_row_step=2,
+        erase_bubbles=False,
+        max_pct_bubble=None,
+        bubble_margin=1.0,
+        bubble_max_margin=8.0,
+        grayscale=False,
+        detector_options=None,
     ):
         self.keep_text = keep_text
         assert (
@@ -24,12 +93,36 @@ class PanelExtractor:
         ), "Minimum percentage must be smaller than maximum percentage"
         self.min_panel = min_pct_panel / 100
         self.max_panel = max_pct_panel / 100
+        # pages with more mid-tones than this aren't paper; None skips the check
         self.paper_th = paper_th
+        # the check only looks at every `paper_row_step`-th row
+        self.paper_row_step = paper_row_step
+        # erase whole speech bubbles rather than only the detected text
+        self.erase_bubbles = erase_bubbles
+        # drop panels that are more than this much speech bubble
+        self.max_bubble = None if max_pct_bubble is None else max_pct_bubble / 100
+        # how far around a text box its bubble is looked for first, relative
+        # to the box, and how far a larger bubble may reach
+        self.bubble_margin = bubble_margin
+        self.bubble_max_margin = bubble_max_margin
+        # decode monochrome pages to a single channel, so panels are too
+        self.grayscale = grayscale
+        # keyword arguments for the TextDetector, e.g. backend or precision
+        self.detector_options = dict(detector_options or {})
+        self._text_detector = None
 
-        # Load text detector
-        print("Load text detector ... ", end="")
-        self.text_detector = TextDetector()
-        print("Done!")
+    @property
+    def text_detector(self):
+        # the detector is only needed to remove text, so it (and torch) is
+        # loaded on first use and shared by every extractor in the process
+        if self._text_detector is None:
+            from .text_detector.main_text_detector import get_text_detector
+
+            # text regions are only filled in as masks, boxes are enough
+            self._text_detector = get_text_detector(
+                **{"poly": False, **self.detector_options}
+            )
+        return self._text_detector
 
     def _generate_panel_blocks(self, img):
         img = img if len(img.shape) == 2 else img[:, :, 0]
@@ -47,10 +140,18 @@ class PanelExtractor:
             ][1]
         else:
             return np.ones(img.shape, dtype="uint8") * 255
-        panel_block_mask = ((labels == ind) * 255).astype("uint8")
+        # 255 where labels == ind, straight into a uint8 mask
+        panel_block_mask = cv2.compare(labels, int(ind), cv2.CMP_EQ)
         return panel_block_mask
 
-    def generate_panels(self, img):
+    def find_panel_candidates(self, img):
+        """
+        Find every closed region of a page that could be a panel, before the
+        panel size limits are applied.
+
+        Returns:
+        - list: (area, Panel) for each region, in contour order.
+        """
         block_mask = self._generate_panel_blocks(img)
         cv2.rectangle(
             block_mask, (0, 0), tuple(block_mask.shape[::-1]), (255, 255, 255), 10
@@ -60,92 +161,368 @@ class PanelExtractor:
         contours, hierarchy = cv2.findContours(
             block_mask, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE
         )
-        panels = []
+        candidates = []
+        for contour in contours:
+            area = cv2.contourArea(contour)
+            x, y, w, h = cv2.boundingRect(contour)
+            # an upright rectangle fills its bounding box and needs no mask
+            corners = {(x, y), (x + w - 1, y), (x + w - 1, y + h - 1), (x, y + h - 1)}
+            if len(contour) == 4 and set(map(tuple, contour[:, 0])) == corners:
+                contour = None
+            candidates.append((area, Panel((x, y, w, h), contour)))
+        return candidates
 
-        for i in range(len(contours)):
-            area = cv2.contourArea(contours[i])
-            img_area = img.shape[0] * img.shape[1]
+    def _filter_panels(self, candidates, img_area):
+        # if the contour is very small or very big, it's likely wrongly detected
+        return [
+            panel
+            for area, panel in candidates
+            if self.min_panel * img_area <= area <= self.max_panel * img_area
+        ]
 
-            # if the contour is very small or very big, it's likely wrongly detected
-            if area < (self.min_panel * img_area) or area > (self.max_panel * img_area):
-                continue
+    def locate_panels(self, img):
+        """
+        Find the panels of a page.
 
-            x, y, w, h = cv2.boundingRect(contours[i])
-            # create panel mask
-            panel_mask = np.ones_like(block_mask, "int32")
-            cv2.fillPoly(panel_mask, [contours[i].astype("int32")], color=(0, 0, 0))
-            panel_mask = panel_mask[y : y + h, x : x + w].copy()
-            # apply panel mask
-            panel = img[y : y + h, x : x + w].copy()
-            panel[panel_mask == 1] = 255
-            panels.append(panel)
+        Returns:
+        - list: A Panel for each panel, in contour order.
+        """
+        img_area = img.shape[0] * img.shape[1]
+        return self._filter_panels(self.find_panel_candidates(img), img_area)
 
-        return panels
+    def generate_panels(self, img, bubble_mask=None):
+        # scratch buffer, reused by every panel's mask
+        scratch = np.empty(img.shape[:2], dtype=np.uint8)
+        panels = self.locate_panels(img)
+        if bubble_mask is not None and self.max_bubble is not None:
+            panels = [
+                panel
+                for panel in panels
+                if self.bubble_share(panel, bubble_mask, scratch) <= self.max_bubble
+            ]
+        return [panel.crop(img, scratch) for panel in panels]
 
-    def remove_text(self, imgs):
-        # detect text
-        res = self.text_detector.detect(imgs)
+    @staticmethod
+    def bubble_share(panel, bubble_mask, scratch=None):
+        """Share of the panel's area covered by speech bubbles."""
+        x, y, w, h = panel.bbox
+        inside = panel.mask(scratch)
+        area = np.count_nonzero(inside)
+        if area == 0:
+            return 0
+        bubbles = np.count_nonzero(bubble_mask[y : y + h, x : x + w][inside != 0])
+        return bubbles / area
 
-        print("Removing text ... ", end="")
-        text_masks = []
-        for i, (_, polys) in enumerate(res):
-            mask_text = np.zeros_like(imgs[i], "int32")
-            for poly in polys:
-                cv2.fillPoly(mask_text, [poly.astype("int32")], color=(255, 255, 255))
-            text_masks.append(mask_text)
+    def detect_text(self, imgs):
+        # boxes (or polygons) of the text on each page; the detector takes
+        # three channels, so grayscale pages are only expanded for it
+        imgs = [
+            cv2.cvtColor(img, cv2.COLOR_GRAY2BGR) if len(img.shape) == 2 else img
+            for img in imgs
+        ]
+        return [polys for _, polys in self.text_detector.detect(imgs)]
 
-        # self.get_speech_bubble_mask(imgs, text_masks)
+    @staticmethod
+    def get_text_mask(img, polys):
+        mask_text = np.zeros(img.shape[:2], dtype=np.uint8)
+        for poly in polys:
+            cv2.fillPoly(mask_text, [poly.astype("int32")], color=255)
+        return mask_text
 
+    def remove_text(self, imgs, masks=None):
+        """
+        Paint the text (or whatever `masks` covers) white.
+
+        Args:
+        - imgs (list): The pages, modified in place.
+        - masks (list): uint8 mask per page of what to erase. The text is
+          detected and its boxes erased when None.
+        """
+        if masks is None:
+            masks = [
+                self.get_text_mask(img, polys)
+                for img, polys in zip(imgs, self.detect_text(imgs))
+            ]
+
+        print("Removing text ... ", end="")
         without_text = []
-        for i, img in enumerate(imgs):
-            img[text_masks[i] == 255] = 255
+        for img, mask in zip(imgs, masks):
+            img[mask == 255] = 255
             without_text.append(img)
         print("Done!")
 
         return without_text
 
-    def get_speech_bubble_mask(self, imgs, text_masks):
+    def get_speech_bubble_mask(self, imgs, text_polys):
+        """
+        Mask the speech bubbles around detected text.
+
+        Each text box is first looked at within a window extending
+        `bubble_margin` times its size on every side. Bright regions of the
+        window that overlap the box without reaching the window's edge are the
+        inside of its bubble. When a region under the box does reach the edge,
+        it may be a bubble larger than the window: the bright regions of the
+        whole page are then labelled (once per page), and the region is a
+        bubble if it stays within `bubble_max_margin` times the box's size
+        around it. Text that isn't in a closed bubble only masks its own box.
+
+        Args:
+        - imgs (list): The pages.
+        - text_polys (list): The text boxes of each page, from `detect_text`.
+
+        Returns:
+        - list: A uint8 mask per page, 255 on speech bubbles and text.
+        """
         bubble_masks = []
-        for i, img in enumerate(imgs):
-            # get connected components
-            _, bw = cv2.threshold(img, 230, 255.0, cv2.THRESH_BINARY)
-            all_labels = measure.label(bw, background=25000)
+        for img, polys in zip(imgs, text_polys):
+            gray = img if len(img.shape) == 2 else img[:, :, 0]
+            mask = self.get_text_mask(img, polys)
+            page_components = None
+            for poly in polys:
+                box = cv2.boundingRect(poly.astype("int32"))
+                window = self._bubble_window(gray.shape, box, self.bubble_margin)
+                if self._mask_bubble(mask, gray, box, window):
+                    continue
+                # the bubble is larger than the window, if there is one
+                if page_components is None:
+                    page_components = self._bright_components(gray)
+                labels, stats = page_components
+                x0, y0, x1, y1 = self._bubble_window(
+                    gray.shape, box, self.bubble_max_margin
+                )
+                x, y, w, h = box
+                for k in np.unique(labels[y : y + h, x : x + w]):
+                    left, top, cw, ch = stats[k, :4]
+                    if k == 0 or not (
+                        x0 < left and y0 < top and left + cw < x1 and top + ch < y1
+                    ):
+                        continue
+                    region = mask[top : top + ch, left : left + cw]
+                    region[labels[top : top + ch, left : left + cw] == k] = 255
+            bubble_masks.append(mask)
+        return bubble_masks
+
+    @staticmethod
+    def _bright_components(gray):
+        _, bright = cv2.threshold(gray, 230, 255, cv2.THRESH_BINARY)
+        _, labels, stats, _ = cv2.connectedComponentsWithStats(bright, connectivity=4)
+        return labels, stats
 
-            # speech labels
-            labels = np.unique(all_labels[text_masks[i] == 255])
+    @staticmethod
+    def _bubble_window(shape, box, margin):
+        # (x0, y0, x1, y1) extending `margin` times the box on every side
+        height, width = shape
+        x, y, w, h = box
+        mx, my = int(w * margin) + 1, int(h * margin) + 1
+        return (
+            max(0, x - mx),
+            max(0, y - my),
+            min(width, x + w + mx),
+            min(height, y + h + my),
+        )
 
-            # buble mask
-            bubble_masks.append(np.isin(all_labels, labels) * 255)
+    def _mask_bubble(self, mask, gray, box, window):
+        # mask the bubbles of a text box found within `window`; False when a
+        # bright region under the box reaches the window's edge
+        x, y, w, h = box
+        x0, y0, x1, y1 = window
+        labels, stats = self._bright_components(gray[y0:y1, x0:x1])
+
+        # speech labels: under the text box and closed within the window
+        touched = np.zeros(len(stats), dtype=bool)
+        touched[labels[y - y0 : y - y0 + h, x - x0 : x - x0 + w]] = True
+        touched[0] = False  # dark pixels
+        left, top = stats[:, cv2.CC_STAT_LEFT], stats[:, cv2.CC_STAT_TOP]
+        closed = (
+            (left > 0)
+            & (top > 0)
+            & (left + stats[:, cv2.CC_STAT_WIDTH] < x1 - x0)
+            & (top + stats[:, cv2.CC_STAT_HEIGHT] < y1 - y0)
+        )
+        if np.any(touched & ~closed):
+            return False
+
+        # bubble mask
+        mask[y0:y1, x0:x1][touched[labels]] = 255
+        return True
+
+    def _remove_text_and_bubbles(self, imgs):
+        # one text detection pass serves both erasing text and spotting
+        # dialogue-only panels; returns the pages and their bubble masks
+        bubble_masks = [None] * len(imgs)
+        if self.keep_text and self.max_bubble is None:
+            return imgs, bubble_masks
+        text_polys = self.detect_text(imgs)
+        if self.erase_bubbles or self.max_bubble is not None:
+            bubble_masks = self.get_speech_bubble_mask(imgs, text_polys)
+        if not self.keep_text:
+            if self.erase_bubbles:
+                masks = bubble_masks
+            else:
+                masks = [
+                    self.get_text_mask(img, polys)
+                    for img, polys in zip(imgs, text_polys)
+                ]
+            imgs = self.remove_text(imgs, masks)
+        return imgs, bubble_masks
+
+    @staticmethod
+    def paper_score(img, row_step=2):
+        """
+        Share of mid-tone pixels, low on (black and white) paper.
+
+        Only the first channel of every `row_step`-th row is counted, straight
+        from the image's buffer.
+        """
+        hist = cv2.calcHist([img[::row_step]], [0], None, [256], [0, 256])
+        return float(hist[50:200].sum() / hist.sum())
+
+    def is_paper_score(self, score):
+        return self.paper_th is None or score < self.paper_th
+
+    def is_paper(self, img):
+        # Check for paper texture
+        if self.paper_th is None:
+            return True
+        return self.is_paper_score(self.paper_score(img, self.paper_row_step))
+
+    def analyze_page(self, img):
+        """
+        Everything `extract_page(..., geometry=True)` needs from the pixels of
+        a page, before any of the extractor's thresholds are applied, so it can
+        be cached and reused with other settings by `select_panels`.
+
+        Returns:
+        - dict: "size" (width, height), "paper_score" and "candidates" (see
+          `find_panel_candidates`). With `max_pct_bubble`, also
+          "bubble_shares", the share of speech bubble in each candidate.
+        """
+        analysis = {
+            "size": (img.shape[1], img.shape[0]),
+            "paper_score": self.paper_score(img, self.paper_row_step),
+            "candidates": self.find_panel_candidates(img),
+        }
+        if self.max_bubble is not None:
+            [polys] = self.detect_text([img])
+            [bubble_mask] = self.get_speech_bubble_mask([img], [polys])
+            scratch = np.empty(img.shape[:2], dtype=np.uint8)
+            analysis["bubble_shares"] = [
+                self.bubble_share(panel, bubble_mask, scratch)
+                for _, panel in analysis["candidates"]
+            ]
+        return analysis
+
+    def analysis_settings(self):
+        """
+        The settings `analyze_page` depends on, so cached analyses are only
+        reused by extractors that would compute the same.
+
+        Returns:
+        - dict: JSON-serialisable settings.
+        """
+        settings = {"paper_row_step": self.paper_row_step, "grayscale": self.grayscale}
+        if self.max_bubble is not None:
+            # threads change how fast text is detected, not what is detected
+            detector = {
+                k: v for k, v in self.detector_options.items() if k != "threads"
+            }
+            settings["bubbles"] = {
+                "margin": self.bubble_margin,
+                "max_margin": self.bubble_max_margin,
+                "detector": {k: str(v) for k, v in sorted(detector.items())},
+            }
+        return settings
+
+    def select_panels(self, analysis):
+        """
+        Apply the paper texture check, the panel size limits and, when
+        measured, the speech bubble limit to the result of `analyze_page`.
+
+        Returns:
+        - list: A Panel for each panel, or one covering the whole page if it
+          fails the paper texture check.
+        """
+        width, height = analysis["size"]
+        if not self.is_paper_score(analysis["paper_score"]):
+            return [Panel((0, 0, width, height))]
+        candidates = analysis["candidates"]
+        if self.max_bubble is not None and "bubble_shares" in analysis:
+            candidates = [
+                candidate
+                for candidate, share in zip(candidates, analysis["bubble_shares"])
+                if share <= self.max_bubble
+            ]
+        return self._filter_panels(candidates, width * height)
+
+    def encode_panels(self, img, bubble_mask=None):
+        base64_panels = []
+        for panel in self.generate_panels(img, bubble_mask):
+            # Convert panel to base64 encoded PNG
+            _, encoded_image = cv2.imencode(".png", panel)
+            base64_panels.append(base64.b64encode(encoded_image).decode("utf-8"))
+        return base64_panels
+
+    def extract_image(self, img):
+        """
+        Extract the panels of a decoded page.
+
+        Returns:
+        - list: The panels as images, or the page itself if it fails the
+          paper texture check.
+        """
+        if not self.is_paper(img):
+            return [img]
+        imgs, bubble_masks = self._remove_text_and_bubbles([img])
+        return self.generate_panels(imgs[0], bubble_masks[0])
+
+    def extract_page(self, base64_image, geometry=False):
+        """
+        Extract the panels of a single page, without the progress output of
+        `extract`.
+
+        Args:
+        - geometry (bool): Return Panel descriptors instead of encoded panels,
+          so crops are only made (at whatever size is needed) by the caller.
+          Text is never removed in this mode, but `max_pct_bubble` still
+          leaves out dialogue-only panels.
+
+        Returns:
+        - list: The base64 encoded PNG panels, or the page itself if it fails
+          the paper texture check. With `geometry`, a Panel for each panel, or
+          one covering the whole page.
+        """
+        img = load_image_from_base64(base64_image, self.grayscale)
+        if geometry:
+            return self.select_panels(self.analyze_page(img))
+        if not self.is_paper(img):
+            return [base64_image]
+        imgs, bubble_masks = self._remove_text_and_bubbles([img])
+        return self.encode_panels(imgs[0], bubble_masks[0])
 
     def extract(self, base64_images):
         print("Loading images ... ", end="")
         # Decode each base64 string to an image array
-        imgs = [load_image_from_base64(x) for x in base64_images]
+        imgs = [load_image_from_base64(x, self.grayscale) for x in base64_images]
         print("Number of images loaded:", len(imgs))
 
         # Dictionary to store base64 encoded panels
         panels_dict = {}
 
+        is_paper = [self.is_paper(img) for img in imgs]
+
+        # remove text from every page at once, so detection runs in batches
+        paper = [i for i in range(len(imgs)) if is_paper[i]]
+        bubble_masks = [None] * len(imgs)
+        cleaned, masks = self._remove_text_and_bubbles([imgs[i] for i in paper])
+        for i, img, mask in zip(paper, cleaned, masks):
+            imgs[i] = img
+            bubble_masks[i] = mask
+
         for i, img in tqdm(enumerate(imgs), desc="Processing images"):
-            # Check for paper texture
-            hist, bins = np.histogram(img.copy().ravel(), 256, [0, 256])
-            if np.sum(hist[50:200]) / np.sum(hist) < self.paper_th:
+            if is_paper[i]:
                 # If the image passes the paper texture check, process it
-                if not self.keep_text:
-                    img = self.remove_text([img])[
-                        0
-                    ]  # Assuming remove_text can handle individual images or you adjust it accordingly
-
-                panels = self.generate_panels(img)
-                base64_panels = []
-                for panel in panels:
-                    # Convert panel to base64 encoded PNG
-                    _, encoded_image = cv2.imencode(".png", panel)
-                    base64_string = base64.b64encode(encoded_image).decode("utf-8")
-                    base64_panels.append(base64_string)
-
                 # Use the original index as key
-                panels_dict[i] = base64_panels
+                panels_dict[i] = self.encode_panels(img, bubble_masks[i])
             else:
                 print(f"Image {i} failed the paper texture check")
                 panels_dict[i] = [base64_images[i]]
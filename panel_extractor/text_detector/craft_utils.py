@@ -1,4 +1,4 @@
-"""  
+"""
 Copyright (c) 2019-present NAVER Corp.
 MIT License
 """
@@ -17,6 +17,13 @@ def warpCoord(Minv, pt):
     return np.array([out[0] / out[2], out[1] / out[2]])
 
 
+def labelMaxima(values, labels, num_labels):
+    """maximum of values over each label, in one pass"""
+    peaks = np.full(num_labels, -np.inf, dtype=np.float32)
+    np.maximum.at(peaks, labels.ravel(), values.ravel())
+    return peaks
+
+
 def getDetBoxes_core(textmap, linkmap, text_threshold, link_threshold, low_text):
     """end of auxilary functions"""
     # prepare data
@@ -33,6 +40,12 @@ def getDetBoxes_core(textmap, linkmap, text_threshold, link_threshold, low_text)
         text_score_comb.astype(np.uint8), connectivity=4
     )
 
+    # per-label maxima in one pass: a component passes the text threshold iff
+    # at least one of its pixels does
+    strong = np.bincount(labels[textmap >= text_threshold], minlength=nLabels) > 0
+    # link-only pixels, removed from every segmentation map below
+    link_area = np.logical_and(link_score == 1, text_score == 0)
+
     det = []
     mapper = []
     for k in range(1, nLabels):
@@ -42,13 +55,9 @@ def getDetBoxes_core(textmap, linkmap, text_threshold, link_threshold, low_text)
             continue
 
         # thresholding
-        if np.max(textmap[labels == k]) < text_threshold:
+        if not strong[k]:
             continue
 
-        # make segmentation map
-        segmap = np.zeros(textmap.shape, dtype=np.uint8)
-        segmap[labels == k] = 255
-        segmap[np.logical_and(link_score == 1, text_score == 0)] = 0  # remove link area
         x, y = stats[k, cv2.CC_STAT_LEFT], stats[k, cv2.CC_STAT_TOP]
         w, h = stats[k, cv2.CC_STAT_WIDTH], stats[k, cv2.CC_STAT_HEIGHT]
         niter = int(math.sqrt(size * min(w, h) / (w * h)) * 2)
@@ -62,15 +71,22 @@ def getDetBoxes_core(textmap, linkmap, text_threshold, link_threshold, low_text)
             ex = img_w
         if ey >= img_h:
             ey = img_h
+
+        # make segmentation map, only over the component's ROI: the component
+        # and its dilation never reach outside it
+        segmap = np.zeros((ey - sy, ex - sx), dtype=np.uint8)
+        segmap[labels[sy:ey, sx:ex] == k] = 255
+        segmap[link_area[sy:ey, sx:ex]] = 0  # remove link area
         kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (1 + niter, 1 + niter))
-        segmap[sy:ey, sx:ex] = cv2.dilate(segmap[sy:ey, sx:ex], kernel)
+        segmap = cv2.dilate(segmap, kernel)
 
-        # make box
+        # make box, in image coordinates
         np_contours = (
             np.roll(np.array(np.where(segmap != 0)), 1, axis=0)
             .transpose()
             .reshape(-1, 2)
         )
+        np_contours += (sx, sy)
         rectangle = cv2.minAreaRect(np_contours)
         box = cv2.boxPoints(rectangle)
 
@@ -93,6 +109,46 @@ def getDetBoxes_core(textmap, linkmap, text_threshold, link_threshold, low_text)
     return det, labels, mapper
 
 
+def _line_hits(mask, line_img, p):
+    """
+    Whether the line between (p[0], p[1]) and (p[2], p[3]) crosses the mask.
+
+    The line is drawn into the zeroed scratch buffer `line_img`, and only the
+    bounding box of its end points is checked and cleared again.
+    """
+    x0, y0, x1, y1 = int(p[0]), int(p[1]), int(p[2]), int(p[3])
+    cv2.line(line_img, (x0, y0), (x1, y1), 1, thickness=1)
+    ys = slice(max(0, min(y0, y1)), max(0, max(y0, y1) + 1))
+    xs = slice(max(0, min(x0, x1)), max(0, max(x0, x1) + 1))
+    hits = np.any(np.logical_and(mask[ys, xs], line_img[ys, xs]))
+    line_img[ys, xs] = 0
+    return hits
+
+
+def getUncertainRegions(
+    textmap, linkmap, text_threshold, link_threshold, low_text, margin
+):
+    """
+    Bounding boxes (x, y, w, h) of the text components whose peak score is
+    within `margin` of the text threshold, i.e. whose detection could go
+    either way at a different resolution.
+    """
+    ret, text_score = cv2.threshold(textmap, low_text, 1, 0)
+    ret, link_score = cv2.threshold(linkmap, link_threshold, 1, 0)
+    text_score_comb = np.clip(text_score + link_score, 0, 1)
+    nLabels, labels, stats, centroids = cv2.connectedComponentsWithStats(
+        text_score_comb.astype(np.uint8), connectivity=4
+    )
+    peaks = labelMaxima(textmap, labels, nLabels)
+    uncertain = (
+        (peaks >= text_threshold - margin)
+        & (peaks < text_threshold + margin)
+        & (stats[:, cv2.CC_STAT_AREA] >= 10)
+    )
+    uncertain[0] = False  # background
+    return [tuple(stats[k, :4]) for k in np.flatnonzero(uncertain)]
+
+
 def getPoly_core(boxes, labels, mapper, linkmap):
     # configs
     num_cp = 5
@@ -127,17 +183,13 @@ def getPoly_core(boxes, labels, mapper, linkmap):
         word_label[word_label > 0] = 1
 
         """ Polygon generation """
-        # find top/bottom contours
-        cp = []
-        max_len = -1
-        for i in range(w):
-            region = np.where(word_label[:, i] != 0)[0]
-            if len(region) < 2:
-                continue
-            cp.append((i, region[0], region[-1]))
-            length = region[-1] - region[0] + 1
-            if length > max_len:
-                max_len = length
+        # find top/bottom contours, for all columns at once
+        word_mask = word_label != 0
+        columns = np.flatnonzero(np.count_nonzero(word_mask, axis=0) >= 2)
+        tops = np.argmax(word_mask[:, columns], axis=0)
+        bottoms = word_mask.shape[0] - 1 - np.argmax(word_mask[::-1, columns], axis=0)
+        cp = list(zip(columns, tops, bottoms))
+        max_len = np.max(bottoms - tops + 1) if len(columns) else -1
 
         # pass if max_len is similar to h
         if h * max_len_ratio < max_len:
@@ -154,7 +206,7 @@ def getPoly_core(boxes, labels, mapper, linkmap):
         num_sec = 0
         prev_h = -1
         for i in range(0, len(cp)):
-            (x, sy, ey) = cp[i]
+            x, sy, ey = cp[i]
             if (seg_num + 1) * seg_w <= x and seg_num <= tot_seg:
                 # average previous segment
                 if num_sec == 0:
@@ -212,6 +264,7 @@ def getPoly_core(boxes, labels, mapper, linkmap):
 
         # get edge points to cover character heatmaps
         isSppFound, isEppFound = False, False
+        line_img = np.zeros(word_label.shape, dtype=np.uint8)  # scratch buffer
         grad_s = (pp[1][1] - pp[0][1]) / (pp[1][0] - pp[0][0]) + (
             pp[2][1] - pp[1][1]
         ) / (pp[2][0] - pp[1][0])
@@ -221,37 +274,15 @@ def getPoly_core(boxes, labels, mapper, linkmap):
         for r in np.arange(0.5, max_r, step_r):
             dx = 2 * half_char_h * r
             if not isSppFound:
-                line_img = np.zeros(word_label.shape, dtype=np.uint8)
                 dy = grad_s * dx
                 p = np.array(new_pp[0]) - np.array([dx, dy, dx, dy])
-                cv2.line(
-                    line_img,
-                    (int(p[0]), int(p[1])),
-                    (int(p[2]), int(p[3])),
-                    1,
-                    thickness=1,
-                )
-                if (
-                    np.sum(np.logical_and(word_label, line_img)) == 0
-                    or r + 2 * step_r >= max_r
-                ):
+                if not _line_hits(word_mask, line_img, p) or r + 2 * step_r >= max_r:
                     spp = p
                     isSppFound = True
             if not isEppFound:
-                line_img = np.zeros(word_label.shape, dtype=np.uint8)
                 dy = grad_e * dx
                 p = np.array(new_pp[-1]) + np.array([dx, dy, dx, dy])
-                cv2.line(
-                    line_img,
-                    (int(p[0]), int(p[1])),
-                    (int(p[2]), int(p[3])),
-                    1,
-                    thickness=1,
-                )
-                if (
-                    np.sum(np.logical_and(word_label, line_img)) == 0
-                    or r + 2 * step_r >= max_r
-                ):
+                if not _line_hits(word_mask, line_img, p) or r + 2 * step_r >= max_r:
                     epp = p
                     isEppFound = True
             if isSppFound and isEppFound:
@@ -293,9 +324,10 @@ def getDetBoxes(textmap, linkmap, text_threshold, link_threshold, low_text, poly
 
 
 def adjustResultCoordinates(polys, ratio_w, ratio_h, ratio_net=2):
-    if len(polys) > 0:
-        polys = np.array(polys)
-        for k in range(len(polys)):
-            if polys[k] is not None:
-                polys[k] *= (ratio_w * ratio_net, ratio_h * ratio_net)
+    # polys mixes None and arrays, so it can't be stacked into one array
+    polys = list(polys)
+    for k in range(len(polys)):
+        if polys[k] is not None:
+            scale = (ratio_w * ratio_net, ratio_h * ratio_net)
+            polys[k] = polys[k] * np.array(scale, dtype=polys[k].dtype)
     return polys
@@ -0,0 +1,83 @@
+# stdlib
+import argparse
+from argparse import RawTextHelpFormatter
+
+# 3p
+import torch
+
+# project
+from .craft import CRAFT
+from .main_text_detector import TextDetector, WEIGHTS, EXPORTED_MODELS
+
+
+def load_craft():
+    net = CRAFT()
+    net.load_state_dict(
+        TextDetector.copyStateDict(torch.load(WEIGHTS, map_location="cpu"))
+    )
+    return net.eval()
+
+
+def export_torchscript(net, example, output):
+    with torch.no_grad():
+        # sizes are traced as ops, so the graph accepts any 32-aligned canvas
+        traced = torch.jit.trace(net, example)
+    torch.jit.save(torch.jit.freeze(traced), output)
+
+
+def export_onnx(net, example, output):
+    torch.onnx.export(
+        net,
+        (example,),
+        output,
+        input_names=["image"],
+        output_names=["y", "feature"],
+        dynamic_axes={
+            "image": {0: "batch", 2: "height", 3: "width"},
+            "y": {0: "batch", 1: "height", 2: "width"},
+            "feature": {0: "batch", 2: "height", 3: "width"},
+        },
+        opset_version=17,
+        dynamo=False,
+    )
+
+
+def main(args):
+    output = args.output or EXPORTED_MODELS[args.format]
+    net = load_craft()
+    example = torch.randn(1, 3, args.canvas_size, args.canvas_size)
+    if args.format == "torchscript":
+        export_torchscript(net, example, str(output))
+    else:
+        export_onnx(net, example, str(output))
+    print(f"Exported CRAFT to {output}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Export the CRAFT text detector for the torchscript and onnx backends.",
+        formatter_class=RawTextHelpFormatter,
+    )
+    parser.add_argument(
+        "--format",
+        choices=list(EXPORTED_MODELS),
+        default="torchscript",
+        help="Format to export to.",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=str,
+        default=None,
+        help="""Path of the exported model.
+Defaults to the path TextDetector loads it from, next to the weights.""",
+    )
+    parser.add_argument(
+        "--canvas_size",
+        type=int,
+        default=768,
+        help="Side of the example input used for tracing (any 32-aligned size works).",
+    )
+
+    args = parser.parse_args()
+    main(args)
@@ -82,6 +82,26 @@ def resize_aspect_ratio(img, square_size, interpolation, mag_ratio=1):
     return resized, ratio, size_heatmap
 
 
+def adaptive_canvas_size(
+    height, width, max_canvas, dpi, glyph_pt=8, glyph_px=16, min_canvas=512
+):
+    """
+    Pick the canvas size that scales typical glyphs to about `glyph_px`
+    pixels, so high-resolution scans aren't run at more pixels than the
+    detector needs. Pages whose glyphs are already that tall are never
+    upscaled, not even to `min_canvas`.
+
+    Args:
+    - dpi (float): Resolution the page was rendered or scanned at.
+    - glyph_pt (float): Typical dialogue glyph height in points.
+    """
+    longest = max(height, width)
+    glyph = glyph_pt * dpi / 72  # glyph height in source pixels
+    scale = glyph_px / glyph
+    floor = min_canvas if scale > 1 else min(min_canvas, longest)
+    return int(min(max(longest * scale, floor), max_canvas))
+
+
 def cvt2HeatmapImg(img):
     img = (np.clip(img, 0, 1) * 255).astype(np.uint8)
     img = cv2.applyColorMap(img, cv2.COLORMAP_JET)
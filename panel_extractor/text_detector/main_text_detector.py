@@ -1,18 +1,42 @@
 # stdlib
 from pathlib import Path
 from collections import OrderedDict
+from contextlib import contextmanager
+import threading
 
 # 3p
 from tqdm import tqdm
 import cv2
+import numpy as np
 import torch
 import torch.backends.cudnn as cudnn
-from torch.autograd import Variable
 
 # project
 from .craft import CRAFT
-from .craft_utils import getDetBoxes, adjustResultCoordinates
-from .imgproc import resize_aspect_ratio, normalizeMeanVariance
+from .craft_utils import (
+    getDetBoxes_core,
+    getPoly_core,
+    getUncertainRegions,
+    adjustResultCoordinates,
+    labelMaxima,
+)
+from .imgproc import (
+    resize_aspect_ratio,
+    normalizeMeanVariance,
+    loadImage,
+    adaptive_canvas_size,
+)
+
+WEIGHTS = Path(__file__).absolute().parent / "weights/craft_mlt_25k.pth"
+# where export.py writes the exported graphs by default
+EXPORTED_MODELS = {
+    "torchscript": WEIGHTS.with_suffix(".ts"),
+    "onnx": WEIGHTS.with_suffix(".onnx"),
+}
+BACKENDS = ("torch",) + tuple(EXPORTED_MODELS)
+PRECISIONS = ("fp32", "bf16", "int8")
+# sample manga pages used to calibrate the int8 model
+CALIBRATION_IMAGES = Path(__file__).absolute().parents[1] / "images"
 
 
 class TextDetector:
@@ -23,66 +47,311 @@ class TextDetector:
         link_threshold=0.4,
         canvas_size=1280,
         mag_ratio=1.5,
+        batch_size=4,
+        poly=True,
+        backend="torch",
+        model_path=None,
+        threads=None,
+        precision="fp32",
+        calibration_images=None,
+        adaptive_canvas=False,
+        dpi=None,
+        fast=False,
+        fast_scale=0.5,
+        refine_margin=0.2,
     ):
         self.text_threshold = text_threshold
         self.low_text = low_text
         self.link_threshold = link_threshold
         self.canvas_size = canvas_size
         self.mag_ratio = mag_ratio
+        self.batch_size = batch_size
+        # without polygons, the boxes are returned as polys too
+        self.poly = poly
+        # size the canvas from the page resolution, up to canvas_size
+        assert not adaptive_canvas or dpi, "The adaptive canvas needs the page dpi"
+        self.adaptive_canvas = adaptive_canvas
+        self.dpi = dpi
+        # detect at fast_scale of the resolution, and only re-run the
+        # components within refine_margin of text_threshold at full resolution
+        self.fast = fast
+        self.fast_scale = fast_scale
+        self.refine_margin = refine_margin
+
+        assert backend in BACKENDS, f"Unknown backend {backend}, use one of {BACKENDS}"
+        self.backend = backend
+        assert (
+            precision in PRECISIONS
+        ), f"Unknown precision {precision}, use one of {PRECISIONS}"
+        assert (
+            precision == "fp32" or backend == "torch"
+        ), "Reduced precision is only available with the torch backend"
+        self.precision = precision
+        # torch's thread count is process-wide, so it is only applied around
+        # this detector's own forward passes (onnxruntime sessions have theirs)
+        self.threads = threads
 
         # load model
-        self.net = CRAFT()
-        weights = Path(__file__).absolute().parent / "weights/craft_mlt_25k.pth"
-        self.cuda = torch.cuda.is_available()
-        if self.cuda:
-            self.net.load_state_dict(self.copyStateDict(torch.load(weights)))
-            self.net = self.net.cuda()
-            self.net = torch.nn.DataParallel(self.net)
-            cudnn.benchmark = False
+        if backend == "torch":
+            self.net = CRAFT()
+            # quantized kernels only run on the CPU
+            self.cuda = torch.cuda.is_available() and precision != "int8"
+            if self.cuda:
+                self.net.load_state_dict(self.copyStateDict(torch.load(WEIGHTS)))
+                self.net = self.net.cuda()
+                self.net = torch.nn.DataParallel(self.net)
+                cudnn.benchmark = False
+            else:
+                self.net.load_state_dict(
+                    self.copyStateDict(torch.load(WEIGHTS, map_location="cpu"))
+                )
+            self.net.eval()
+            if precision == "int8":
+                self.net = self._quantize(calibration_images or CALIBRATION_IMAGES)
+        else:
+            # exported graphs are for CPU workers
+            self.cuda = False
+            self._load_exported(model_path or EXPORTED_MODELS[backend], threads)
+
+    def _load_exported(self, model_path, threads):
+        if not Path(model_path).exists():
+            raise FileNotFoundError(
+                f"No exported {self.backend} model at {model_path}, "
+                f"create it with `python -m panel_extractor.text_detector.export`"
+            )
+        if self.backend == "torchscript":
+            # the export is frozen; this adds the oneDNN conv fusions for the CPU
+            self.net = torch.jit.optimize_for_inference(
+                torch.jit.load(str(model_path), map_location="cpu")
+            )
         else:
-            self.net.load_state_dict(
-                self.copyStateDict(torch.load(weights, map_location="cpu"))
+            try:
+                import onnxruntime
+            except ImportError:
+                raise ImportError(
+                    "The onnx backend needs onnxruntime: pip install onnxruntime"
+                )
+            options = onnxruntime.SessionOptions()
+            if threads:
+                options.intra_op_num_threads = threads
+            self.session = onnxruntime.InferenceSession(
+                str(model_path), options, providers=["CPUExecutionProvider"]
             )
 
-        self.net.eval()
+    def _quantize(self, calibration_images):
+        """
+        Statically quantize the network to int8, calibrating the activation
+        ranges on sample pages (a directory or a list of image paths).
+        """
+        from torch.ao.quantization import get_default_qconfig_mapping
+        from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
 
-    def detect(self, imgs):
-        return [self.test_net(img) for img in tqdm(imgs, desc="Detecting text")]
+        if isinstance(calibration_images, (str, Path)):
+            calibration_images = sorted(
+                path
+                for path in Path(calibration_images).iterdir()
+                if path.suffix.lower() in (".jpg", ".jpeg", ".png")
+            )
+        samples = [
+            torch.from_numpy(self._preprocess(loadImage(str(path)))[0][None])
+            for path in calibration_images
+        ]
+        assert samples, "int8 precision needs at least one calibration image"
 
-    def test_net(self, image):
-        # resize
-        img_resized, target_ratio, size_heatmap = resize_aspect_ratio(
-            image,
-            self.canvas_size,
-            interpolation=cv2.INTER_LINEAR,
-            mag_ratio=self.mag_ratio,
+        engine = (
+            "x86" if "x86" in torch.backends.quantized.supported_engines else "qnnpack"
         )
-        ratio_h = ratio_w = 1 / target_ratio
+        torch.backends.quantized.engine = engine
+        prepared = prepare_fx(
+            self.net, get_default_qconfig_mapping(engine), (samples[0],)
+        )
+        with torch.no_grad(), self._torch_threads():
+            for x in tqdm(samples, desc="Calibrating int8 model"):
+                prepared(x)
+        return convert_fx(prepared)
 
-        # preprocessing
-        x = normalizeMeanVariance(img_resized)
-        x = torch.from_numpy(x).permute(2, 0, 1)  # [h, w, c] to [c, h, w]
-        x = Variable(x.unsqueeze(0))  # [c, h, w] to [b, c, h, w]
+    def detect(self, imgs, batch_size=None):
+        """
+        Detect text on a list of images, running them through the network in
+        mini-batches.
+
+        Images are resized onto 32-aligned canvases exactly as for a single
+        image, and only images with the same canvas shape are batched
+        together, so the results match `test_net` image by image.
+
+        Returns:
+        - list: A (boxes, polys) tuple per image, in input order.
+        """
+        if self.fast:
+            return [self._detect_fast(img) for img in tqdm(imgs, desc="Detecting text")]
+
+        batch_size = batch_size or self.batch_size
+        prepared = [self._preprocess(img) for img in imgs]
+
+        # pages of a volume usually share a size, hence a canvas shape
+        groups = {}
+        for i, (x, _) in enumerate(prepared):
+            groups.setdefault(x.shape, []).append(i)
+        batches = [
+            indices[start : start + batch_size]
+            for indices in groups.values()
+            for start in range(0, len(indices), batch_size)
+        ]
+
+        results = [None] * len(imgs)
+        for batch in tqdm(batches, desc="Detecting text"):
+            y = self._forward(np.stack([prepared[i][0] for i in batch]))
+
+            # split the score and link maps back per image
+            for j, i in enumerate(batch):
+                results[i] = self._postprocess(
+                    y[j, :, :, 0], y[j, :, :, 1], prepared[i][1]
+                )
+
+        return results
+
+    def _forward(self, x):
+        if self.backend == "onnx":
+            return self.session.run(["y"], {"image": x})[0]
+
+        x = torch.from_numpy(x)
         if self.cuda:
             x = x.cuda()
 
         # forward pass
-        with torch.no_grad():
-            y, feature = self.net(x)
+        with torch.no_grad(), self._torch_threads():
+            if self.precision == "bf16":
+                device = "cuda" if self.cuda else "cpu"
+                with torch.autocast(device, dtype=torch.bfloat16):
+                    y, feature = self.net(x)
+            else:
+                y, feature = self.net(x)
+        return y.float().cpu().data.numpy()
+
+    @contextmanager
+    def _torch_threads(self):
+        if not self.threads:
+            yield
+            return
+        previous = torch.get_num_threads()
+        torch.set_num_threads(self.threads)
+        try:
+            yield
+        finally:
+            torch.set_num_threads(previous)
 
-        # make score and link map
-        score_text = y[0, :, :, 0].cpu().data.numpy()
-        score_link = y[0, :, :, 1].cpu().data.numpy()
+    def test_net(self, image):
+        return self.detect([image], batch_size=1)[0]
+
+    def _detect_fast(self, image):
+        # coarse pass, keeping only the components clearly above the threshold
+        full_ratio = self._ratio(image)
+        x, ratio = self._preprocess(image, full_ratio * self.fast_scale)
+        y = self._forward(x[None])[0]
+        boxes, polys = self._postprocess(
+            y[:, :, 0],
+            y[:, :, 1],
+            ratio,
+            min_peak=self.text_threshold + self.refine_margin,
+        )
+        boxes, polys = list(boxes), list(polys)
+        regions = getUncertainRegions(
+            y[:, :, 0],
+            y[:, :, 1],
+            self.text_threshold,
+            self.link_threshold,
+            self.low_text,
+            self.refine_margin,
+        )
+        if not regions:
+            return boxes, polys
+
+        # padded regions in image coordinates (the heatmap is at half scale),
+        # overlapping ones merged
+        scale = 2 / ratio
+        mask = np.zeros(image.shape[:2], dtype=np.uint8)
+        for rx, ry, rw, rh in regions:
+            pad = max(rw, rh) // 2 + 2
+            x0, y0 = int(max(0, (rx - pad) * scale)), int(max(0, (ry - pad) * scale))
+            x1, y1 = int((rx + rw + pad) * scale), int((ry + rh + pad) * scale)
+            mask[y0:y1, x0:x1] = 1
+        num_crops, _, crops, _ = cv2.connectedComponentsWithStats(mask, connectivity=4)
+        crops = crops[1:]
+        if np.sum(crops[:, cv2.CC_STAT_AREA]) > mask.size / 2:
+            # refining would cost about as much as a full-resolution pass
+            x, ratio = self._preprocess(image)
+            y = self._forward(x[None])[0]
+            return self._postprocess(y[:, :, 0], y[:, :, 1], ratio)
+
+        # refine at full resolution; text the coarse pass already found can
+        # reach into a crop, so boxes centred on a coarse box are dropped
+        coarse = [np.asarray(box, dtype=np.float32) for box in boxes]
+        for cx, cy, cw, ch, _ in crops:
+            x, ratio = self._preprocess(image[cy : cy + ch, cx : cx + cw], full_ratio)
+            y = self._forward(x[None])[0]
+            crop_boxes, crop_polys = self._postprocess(y[:, :, 0], y[:, :, 1], ratio)
+            for box, poly in zip(crop_boxes, crop_polys):
+                center = tuple(float(c) for c in np.mean(box, axis=0) + (cx, cy))
+                if any(cv2.pointPolygonTest(c, center, False) >= 0 for c in coarse):
+                    continue
+                boxes.append(box + (cx, cy))
+                polys.append(poly + (cx, cy))
+        return boxes, polys
+
+    def _canvas_size(self, image):
+        if not self.adaptive_canvas:
+            return self.canvas_size
+        height, width = image.shape[:2]
+        return adaptive_canvas_size(height, width, self.canvas_size, dpi=self.dpi)
+
+    def _ratio(self, image):
+        # the scale resize_aspect_ratio resizes the image by
+        longest = max(image.shape[:2])
+        return min(self.mag_ratio * longest, self._canvas_size(image)) / longest
+
+    def _preprocess(self, image, ratio=None):
+        # resize
+        if ratio is None:
+            img_resized, target_ratio, size_heatmap = resize_aspect_ratio(
+                image,
+                self._canvas_size(image),
+                interpolation=cv2.INTER_LINEAR,
+                mag_ratio=self.mag_ratio,
+            )
+        else:
+            img_resized, target_ratio, size_heatmap = resize_aspect_ratio(
+                image,
+                max(image.shape[:2]) * ratio,
+                interpolation=cv2.INTER_LINEAR,
+                mag_ratio=ratio,
+            )
+
+        # preprocessing
+        x = normalizeMeanVariance(img_resized)
+        x = np.ascontiguousarray(x.transpose(2, 0, 1))  # [h, w, c] to [c, h, w]
+        return x, target_ratio
+
+    def _postprocess(self, score_text, score_link, target_ratio, min_peak=None):
+        ratio_h = ratio_w = 1 / target_ratio
 
         # Post-processing
-        boxes, polys = getDetBoxes(
+        boxes, labels, mapper = getDetBoxes_core(
             score_text,
             score_link,
             self.text_threshold,
             self.link_threshold,
             self.low_text,
-            poly=True,
         )
+        if min_peak is not None and mapper:
+            # drop the components whose peak score is below min_peak
+            peaks = labelMaxima(score_text, labels, labels.max() + 1)[mapper]
+            keep = [k for k, peak in enumerate(peaks) if peak >= min_peak]
+            boxes = [boxes[k] for k in keep]
+            mapper = [mapper[k] for k in keep]
+        if self.poly:
+            polys = getPoly_core(boxes, labels, mapper, score_link)
+        else:
+            polys = [None] * len(boxes)
 
         # coordinate adjustment
         boxes = adjustResultCoordinates(boxes, ratio_w, ratio_h)
@@ -93,7 +362,8 @@ class TextDetector:
 
         return boxes, polys
 
-    def copyStateDict(self, state_dict):
+    @staticmethod
+    def copyStateDict(state_dict):
         if list(state_dict.keys())[0].startswith("module"):
             start_idx = 1
         else:
@@ -103,3 +373,33 @@ class TextDetector:
             name = ".".join(k.split(".")[start_idx:])
             new_state_dict[name] = v
         return new_state_dict
+
+
+# process-wide registry, so every PanelExtractor shares one loaded model
+_detectors = {}
+_detectors_lock = threading.Lock()
+
+
+def _registry_key(value):
+    # settings as a hashable value, e.g. a list of calibration images
+    if isinstance(value, dict):
+        return tuple(sorted((key, _registry_key(item)) for key, item in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_registry_key(item) for item in value)
+    if isinstance(value, Path):
+        return str(value)
+    return value
+
+
+def get_text_detector(**kwargs):
+    """
+    Return the process's TextDetector for these settings, loading the CRAFT
+    weights on first use.
+    """
+    key = _registry_key(kwargs)
+    with _detectors_lock:
+        if key not in _detectors:
+            print("Load text detector ... ", end="")
+            _detectors[key] = TextDetector(**kwargs)
+            print("Done!")
+        return _detectors[key]
@@ -0,0 +1,134 @@
+# stdlib
+import argparse
+from argparse import RawTextHelpFormatter
+from pathlib import Path
+import time
+
+# 3p
+import cv2
+import numpy as np
+
+# project
+from .imgproc import loadImage
+from .main_text_detector import TextDetector, PRECISIONS, CALIBRATION_IMAGES
+
+
+def text_mask(shape, boxes):
+    mask = np.zeros(shape[:2], dtype=np.uint8)
+    for box in boxes:
+        cv2.fillPoly(mask, [np.asarray(box).astype("int32")], 1)
+    return mask
+
+
+def box_iou(a, b):
+    # IoU of the axis-aligned bounds of two detected boxes
+    (ax0, ay0), (ax1, ay1) = np.min(a, 0), np.max(a, 0)
+    (bx0, by0), (bx1, by1) = np.min(b, 0), np.max(b, 0)
+    w = max(0, min(ax1, bx1) - max(ax0, bx0))
+    h = max(0, min(ay1, by1) - max(ay0, by0))
+    union = (ax1 - ax0) * (ay1 - ay0) + (bx1 - bx0) * (by1 - by0) - w * h
+    return w * h / union if union > 0 else 0
+
+
+def matched(boxes, reference, threshold=0.5):
+    """Number of `boxes` overlapping a `reference` box with IoU >= threshold."""
+    return sum(
+        any(box_iou(box, ref) >= threshold for ref in reference) for box in boxes
+    )
+
+
+def run(detector, imgs):
+    detector.detect(imgs[:1])  # warm up
+    start = time.time()
+    results = detector.detect(imgs)
+    return results, time.time() - start
+
+
+def main(args):
+    paths = sorted(
+        path
+        for path in Path(args.folder).iterdir()
+        if path.suffix.lower() in (".jpg", ".jpeg", ".png")
+    )
+    imgs = [loadImage(str(path)) for path in paths]
+    print(f"{len(imgs)} pages from {args.folder}")
+
+    results = {}
+    for precision in args.precisions:
+        detector = TextDetector(
+            canvas_size=args.canvas_size,
+            mag_ratio=args.mag_ratio,
+            poly=False,
+            precision=precision,
+            threads=args.threads,
+        )
+        results[precision] = run(detector, imgs)
+
+    reference, reference_time = results["fp32"]
+    if not any(len(boxes) for boxes, _ in reference):
+        # e.g. untrained weights; timings alone say nothing about the tradeoff
+        print("fp32 found no text on these pages, so there is nothing to compare")
+        return
+    print(
+        f"{'precision':>9} {'sec/page':>9} {'speedup':>8} {'boxes':>6} "
+        f"{'recall':>7} {'precision':>9} {'mask IoU':>9}"
+    )
+    for precision, (detections, elapsed) in results.items():
+        found = sum(len(boxes) for boxes, _ in detections)
+        expected = sum(len(boxes) for boxes, _ in reference)
+        true_positives = sum(
+            matched(boxes, ref_boxes)
+            for (boxes, _), (ref_boxes, _) in zip(detections, reference)
+        )
+        recalled = sum(
+            matched(ref_boxes, boxes)
+            for (boxes, _), (ref_boxes, _) in zip(detections, reference)
+        )
+        intersection = union = 0
+        for img, (boxes, _), (ref_boxes, _) in zip(imgs, detections, reference):
+            mask = text_mask(img.shape, boxes)
+            ref_mask = text_mask(img.shape, ref_boxes)
+            intersection += np.count_nonzero(mask & ref_mask)
+            union += np.count_nonzero(mask | ref_mask)
+        print(
+            f"{precision:>9} {elapsed / len(imgs):>9.2f} "
+            f"{reference_time / elapsed:>7.2f}x {found:>6} "
+            f"{recalled / max(expected, 1):>7.1%} "
+            f"{true_positives / max(found, 1):>9.1%} "
+            f"{intersection / max(union, 1):>9.1%}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare the speed and boxes of reduced-precision text detection against fp32.",
+        formatter_class=RawTextHelpFormatter,
+    )
+    parser.add_argument(
+        "-f",
+        "--folder",
+        default=str(CALIBRATION_IMAGES),
+        type=str,
+        help="Folder of manga pages to detect text on.",
+    )
+    parser.add_argument(
+        "-p",
+        "--precisions",
+        nargs="+",
+        choices=PRECISIONS,
+        default=list(PRECISIONS),
+        help="Precisions to compare (fp32 is always included as the reference).",
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=1,
+        help="Intra-op threads, to report throughput per core.",
+    )
+    parser.add_argument("--canvas_size", type=int, default=1280)
+    parser.add_argument("--mag_ratio", type=float, default=1.5)
+
+    args = parser.parse_args()
+    if "fp32" not in args.precisions:
+        args.precisions.insert(0, "fp32")
+    main(args)
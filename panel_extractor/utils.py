@@ -51,8 +51,37 @@ def load_image(img_file):
     return img
 
 
-def load_image_from_base64(base64_string):
-    img_data = base64.b64decode(base64_string)
-    img_array = np.array(bytearray(img_data), dtype=np.uint8)
-    img = cv2.imdecode(img_array, cv2.IMREAD_COLOR)
-    return img
+def is_colour(img, tolerance=16, min_share=0.001, row_step=4):
+    """
+    Whether a BGR image has colour: more than `min_share` of its pixels (on
+    every `row_step`-th row) have channels differing by over `tolerance`,
+    which leaves room for the chroma noise of grey JPEG scans.
+    """
+    if len(img.shape) == 2:
+        return False
+    b, g, r = cv2.split(img[::row_step, :, :3])
+    spread = cv2.max(cv2.absdiff(b, g), cv2.absdiff(g, r))
+    return np.count_nonzero(spread > tolerance) > min_share * spread.size
+
+
+def drop_colour(img):
+    """Single-channel copy of a monochrome image; colour images are kept."""
+    if len(img.shape) == 2 or is_colour(img):
+        return img
+    return img[:, :, 0].copy()
+
+
+def load_image_from_bytes(img_data, grayscale=False):
+    """
+    Decode an encoded image to BGR, or with `grayscale` to a single channel
+    unless the image has colour (grey files are never expanded).
+    """
+    img_array = np.frombuffer(img_data, dtype=np.uint8)
+    if not grayscale:
+        return cv2.imdecode(img_array, cv2.IMREAD_COLOR)
+    return drop_colour(cv2.imdecode(img_array, cv2.IMREAD_ANYCOLOR))
+
+
+def load_image_from_base64(base64_string, grayscale=False):
+    """Decode a base64 encoded image, see load_image_from_bytes."""
+    return load_image_from_bytes(base64.b64decode(base64_string), grayscale)
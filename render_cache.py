@@ -0,0 +1,99 @@
+import hashlib
+import os
+import tempfile
+
+DEFAULT_RENDER_CACHE_DIR = os.path.join(
+    os.path.expanduser("~"), ".cache", "manga-reader", "renders"
+)
+
+
+def file_digest(path, chunk_size=1024 * 1024):
+    """Return the sha256 hex digest of a file's contents."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class RenderCache:
+    """
+    Persistent cache of rendered and scaled page images.
+
+    Entries are keyed by the PDF's content hash, the page index, the render DPI
+    and the target size ("full" for the unscaled render), so a cached page is
+    reused for any copy of the same PDF and invalidated when any of those
+    change. Entries are saved with the extension of their format (PNG unless
+    told otherwise). The cache is bounded by `max_bytes`; the least recently used
+    entries (by modification time, which is bumped on every hit) are evicted
+    first.
+    """
+
+    SUFFIX = ".png"
+    # every extension entries are saved with, for eviction
+    SUFFIXES = (".png", ".jpg", ".webp", ".score")
+
+    def __init__(self, directory=DEFAULT_RENDER_CACHE_DIR, max_bytes=2 * 1024**3):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(pdf_digest, page_index, dpi, size):
+        return hashlib.sha256(
+            f"{pdf_digest}:{page_index}:{dpi}:{size}".encode("utf-8")
+        ).hexdigest()
+
+    def _path(self, key, suffix=None):
+        return os.path.join(self.directory, key[:2], key + (suffix or self.SUFFIX))
+
+    def contains(self, key, suffix=None):
+        return os.path.exists(self._path(key, suffix))
+
+    def get(self, key, suffix=None):
+        path = self._path(key, suffix)
+        try:
+            with open(path, "rb") as f:
+                image_bytes = f.read()
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(path)  # mark as recently used
+        except FileNotFoundError:
+            pass  # evicted by another process in the meantime
+        return image_bytes
+
+    def put(self, key, image_bytes, suffix=None):
+        path = self._path(key, suffix)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write to a temporary file first so readers never see a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, "wb") as f:
+            f.write(image_bytes)
+        os.replace(tmp_path, path)
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits in max_bytes."""
+        entries = []
+        total = 0
+        for dirpath, _, filenames in os.walk(self.directory):
+            for filename in filenames:
+                if not filename.endswith(self.SUFFIXES):
+                    continue
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
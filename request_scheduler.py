@@ -0,0 +1,317 @@
+import asyncio
+import random
+import threading
+import time
+
+from openai import (
+    APIConnectionError,
+    APIError,
+    APITimeoutError,
+    InternalServerError,
+    RateLimitError,
+)
+
+# Tier 1 limits for gpt-4o, see https://platform.openai.com/account/limits
+DEFAULT_REQUESTS_PER_MINUTE = 500
+DEFAULT_TOKENS_PER_MINUTE = 30000
+
+# max_tokens of the vision requests
+MAX_COMPLETION_TOKENS = 4096
+# what a completion typically uses; the estimate is settled against the real
+# usage once the response arrives
+TYPICAL_COMPLETION_TOKENS = 1000
+
+RETRYABLE_ERRORS = (
+    RateLimitError,
+    APIConnectionError,
+    APITimeoutError,
+    InternalServerError,
+)
+
+
+class TokenBucket:
+    """
+    A per-minute budget that refills continuously.
+
+    Callers check `wait_time` and only `take` the amount once it is covered, so
+    a refund (or a request that used less than it reserved) shortens the wait
+    of everyone still queued.
+    """
+
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self.available = per_minute
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.available = min(
+            self.capacity, self.available + (now - self.updated) * self.rate
+        )
+        self.updated = now
+
+    def wait_time(self, amount):
+        self._refill()
+        # a single request larger than the whole budget can still go through
+        missing = min(amount, self.capacity) - self.available
+        return max(0, missing / self.rate)
+
+    def take(self, amount):
+        self._refill()
+        self.available -= min(amount, self.capacity)
+
+    def refund(self, amount):
+        self._refill()
+        self.available = min(self.capacity, self.available + amount)
+
+
+def _is_rate_limit(error):
+    if isinstance(error, RateLimitError):
+        return True
+    return isinstance(error, APIError) and "rate limit" in str(error).lower()
+
+
+def _retry_after(error):
+    # honour the server's Retry-After header when it sends one
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    try:
+        return float(response.headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def _used_tokens(result):
+    # vision_analysis returns either a raw completion or a dict with total_tokens
+    if isinstance(result, dict):
+        return result.get("total_tokens")
+    usage = getattr(result, "usage", None)
+    return getattr(usage, "total_tokens", None)
+
+
+class RequestScheduler:
+    """
+    Shared scheduler for every OpenAI request in a run.
+
+    Limits the number of requests in flight and keeps them within a
+    requests-per-minute and a tokens-per-minute budget. A request takes its
+    slot first, then waits until the budget covers its estimate, checking at
+    least every `recheck_interval` seconds so budget returned by finished
+    requests is used straight away. Rate-limit and
+    transient errors are retried with exponential backoff (or the server's
+    Retry-After), and a rate-limit error pauses all callers, not only the one
+    that hit it.
+    """
+
+    def __init__(
+        self,
+        max_concurrency=4,
+        requests_per_minute=DEFAULT_REQUESTS_PER_MINUTE,
+        tokens_per_minute=DEFAULT_TOKENS_PER_MINUTE,
+        max_retries=5,
+        min_backoff=4,
+        max_backoff=60,
+        recheck_interval=0.5,
+    ):
+        self.max_concurrency = max_concurrency
+        self.recheck_interval = recheck_interval
+        self.max_retries = max_retries
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.requests = (
+            TokenBucket(requests_per_minute) if requests_per_minute else None
+        )
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._async_slots = None  # created on first use, inside the event loop
+        self._lock = threading.Lock()
+        self._paused_until = 0
+        self.stats = {"requests": 0, "retries": 0, "rate_limited": 0, "waited": 0.0}
+
+    def _reserve(self, estimated_tokens):
+        # called with a slot held; takes the budget and returns 0 once it covers
+        # the request, otherwise how long to wait before checking again
+        with self._lock:
+            delay = max(0, self._paused_until - time.monotonic())
+            if self.requests is not None:
+                delay = max(delay, self.requests.wait_time(1))
+            if self.tokens is not None:
+                delay = max(delay, self.tokens.wait_time(estimated_tokens))
+            if delay:
+                delay = min(delay, self.recheck_interval)
+                self.stats["waited"] += delay
+                return delay
+            if self.requests is not None:
+                self.requests.take(1)
+            if self.tokens is not None:
+                self.tokens.take(estimated_tokens)
+        return 0
+
+    def _settle(self, estimated_tokens, result):
+        # charge the request what it actually used instead of the estimate
+        used = _used_tokens(result)
+        with self._lock:
+            self.stats["requests"] += 1
+            if self.tokens is None or used is None:
+                return
+            self.tokens.refund(estimated_tokens - used)
+
+    def _backoff(self, error, attempt, estimated_tokens):
+        delay = _retry_after(error)
+        if delay is None:
+            delay = min(self.max_backoff, self.min_backoff * 2**attempt)
+            delay += random.uniform(0, 1)
+        with self._lock:
+            # the failed attempt used none of its estimate, and the retry
+            # reserves a fresh one
+            if self.tokens is not None:
+                self.tokens.refund(estimated_tokens)
+            self.stats["retries"] += 1
+            if _is_rate_limit(error):
+                self.stats["rate_limited"] += 1
+                self._paused_until = max(self._paused_until, time.monotonic() + delay)
+        print(f"Request failed ({type(error).__name__}), retrying in {delay:.1f}s...")
+        return delay
+
+    def _should_retry(self, error, attempt):
+        retryable = isinstance(error, RETRYABLE_ERRORS) or _is_rate_limit(error)
+        return retryable and attempt < self.max_retries
+
+    def call(self, func, *args, estimated_tokens=MAX_COMPLETION_TOKENS, **kwargs):
+        """
+        Run `func(*args, **kwargs)` once a slot and enough budget are free.
+
+        Args:
+        - func (callable): The function making the OpenAI request.
+        - estimated_tokens (int): Expected prompt plus completion tokens, charged
+          against the tokens-per-minute budget before the request is sent.
+
+        Returns:
+        - The return value of `func`.
+        """
+        attempt = 0
+        while True:
+            with self._slots:
+                delay = self._reserve(estimated_tokens)
+                while delay:
+                    time.sleep(delay)
+                    delay = self._reserve(estimated_tokens)
+                try:
+                    result = func(*args, **kwargs)
+                except Exception as e:
+                    if not self._should_retry(e, attempt):
+                        raise
+                    error = e
+                else:
+                    self._settle(estimated_tokens, result)
+                    return result
+
+            delay = self._backoff(error, attempt, estimated_tokens)
+            time.sleep(delay)
+            attempt += 1
+
+    async def acall(
+        self, func, *args, estimated_tokens=MAX_COMPLETION_TOKENS, **kwargs
+    ):
+        """
+        Async counterpart of `call` for coroutine functions (e.g. requests on an
+        AsyncOpenAI client). Waiting happens with asyncio.sleep, so the event
+        loop keeps running other work; both variants share the same budgets.
+        """
+        if self._async_slots is None:
+            self._async_slots = asyncio.Semaphore(self.max_concurrency)
+        attempt = 0
+        while True:
+            async with self._async_slots:
+                delay = self._reserve(estimated_tokens)
+                while delay:
+                    await asyncio.sleep(delay)
+                    delay = self._reserve(estimated_tokens)
+                try:
+                    result = await func(*args, **kwargs)
+                except Exception as e:
+                    if not self._should_retry(e, attempt):
+                        raise
+                    error = e
+                else:
+                    self._settle(estimated_tokens, result)
+                    return result
+
+            delay = self._backoff(error, attempt, estimated_tokens)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    def report(self):
+        return (
+            f"{self.stats['requests']} requests, {self.stats['retries']} retries "
+            f"({self.stats['rate_limited']} rate limited), "
+            f"{self.stats['waited']:.1f}s spent waiting for rate budget"
+        )
+
+
+def _request_parts(messages):
+    # (image count, text length) of a chat completion request's messages
+    images = text = 0
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            text += len(content)
+            continue
+        for part in content or []:
+            if part.get("type") == "image_url":
+                images += 1
+            else:
+                text += len(part.get("text", ""))
+    return images, text
+
+
+def estimate_request_tokens(messages=(), max_tokens=None, **request):
+    """
+    Rough token estimate for a chat completion request: 85 tokens per
+    low-detail image, ~4 characters per text token and a typical completion
+    (capped at the request's max_tokens).
+    """
+    images, text = _request_parts(messages)
+    completion = TYPICAL_COMPLETION_TOKENS
+    if max_tokens is not None:
+        completion = min(completion, max_tokens)
+    return 85 * images + text // 4 + completion
+
+
+class _Namespace:
+    pass
+
+
+class ScheduledOpenAI:
+    """
+    Wraps an OpenAI client so every `chat.completions.create` goes through a
+    RequestScheduler, estimated from the request itself. Wrap the result in a
+    CachedOpenAI so cache hits skip the scheduler altogether.
+    """
+
+    def __init__(self, client, scheduler):
+        self.client = client
+        self.scheduler = scheduler
+        self.chat = _Namespace()
+        self.chat.completions = _Namespace()
+        self.chat.completions.create = self._create
+
+    def _create(self, **request):
+        return self.scheduler.call(
+            self.client.chat.completions.create,
+            estimated_tokens=estimate_request_tokens(**request),
+            **request,
+        )
+
+
+class ScheduledAsyncOpenAI(ScheduledOpenAI):
+    """ScheduledOpenAI for an AsyncOpenAI client."""
+
+    async def _create(self, **request):
+        return await self.scheduler.acall(
+            self.client.chat.completions.create,
+            estimated_tokens=estimate_request_tokens(**request),
+            **request,
+        )
@@ -0,0 +1,177 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from openai.types.chat import ChatCompletion
+
+DEFAULT_RESPONSE_CACHE_PATH = os.path.join(
+    os.path.expanduser("~"), ".cache", "manga-reader", "responses.sqlite"
+)
+
+
+class CacheMissError(Exception):
+    """Raised in replay mode when a request has no cached response."""
+
+
+def _digest_images(value):
+    # replace inline images by the digest of their content, so keys stay small
+    if isinstance(value, dict):
+        return {key: _digest_images(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_digest_images(item) for item in value]
+    if isinstance(value, str) and value.startswith("data:"):
+        return "sha256:" + hashlib.sha256(value.encode("utf-8")).hexdigest()
+    return value
+
+
+def request_key(**request):
+    """
+    Hash a chat completion request: the model, every system and user text, the
+    digests of the images and their `detail`, and any other parameters
+    (max_tokens, response_format, ...).
+    """
+    canonical = json.dumps(_digest_images(request), sort_keys=True, default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Persistent SQLite cache of chat completion responses.
+
+    Entries expire after `ttl` seconds, and the least recently used entries are
+    dropped once there are more than `max_entries`. In read-only mode the cache
+    is never written to, which lets a run be replayed from earlier responses.
+    """
+
+    def __init__(
+        self,
+        path=DEFAULT_RESPONSE_CACHE_PATH,
+        ttl=30 * 24 * 3600,
+        max_entries=50000,
+        read_only=False,
+    ):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.read_only = read_only
+        self.stats = {"hits": 0, "misses": 0, "tokens_saved": 0}
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, response TEXT, created REAL, last_used REAL)"
+        )
+        self._db.commit()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT response, created FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or (self.ttl and now - row[1] > self.ttl):
+                self.stats["misses"] += 1
+                return None
+            if not self.read_only:
+                self._db.execute(
+                    "UPDATE responses SET last_used = ? WHERE key = ?", (now, key)
+                )
+                self._db.commit()
+            self.stats["hits"] += 1
+        return row[0]
+
+    def put(self, key, response):
+        if self.read_only:
+            return
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)",
+                (key, response, now, now),
+            )
+            self._evict(now)
+            self._db.commit()
+
+    def _evict(self, now):
+        if self.ttl:
+            self._db.execute(
+                "DELETE FROM responses WHERE created < ?", (now - self.ttl,)
+            )
+        if self.max_entries:
+            self._db.execute(
+                "DELETE FROM responses WHERE key NOT IN "
+                "(SELECT key FROM responses ORDER BY last_used DESC LIMIT ?)",
+                (self.max_entries,),
+            )
+
+    def lookup(self, request):
+        """
+        Return the request key and its cached response, with the usage zeroed
+        since a cache hit costs no tokens (the response is None on a miss).
+        """
+        key = request_key(**request)
+        cached = self.get(key)
+        if cached is None:
+            if self.read_only:
+                raise CacheMissError(f"No cached response for request {key[:12]}")
+            return key, None
+
+        response = ChatCompletion.model_validate_json(cached)
+        if response.usage is not None:
+            with self._lock:
+                self.stats["tokens_saved"] += response.usage.total_tokens
+            response.usage.prompt_tokens = 0
+            response.usage.completion_tokens = 0
+            response.usage.total_tokens = 0
+        return key, response
+
+    def store(self, key, response):
+        self.put(key, response.model_dump_json())
+
+    def report(self):
+        return (
+            f"{self.stats['hits']} hits, {self.stats['misses']} misses, "
+            f"{self.stats['tokens_saved']:,} tokens saved"
+        )
+
+
+class _Namespace:
+    pass
+
+
+class CachedOpenAI:
+    """
+    Wraps an OpenAI client so `chat.completions.create` is served from a
+    ResponseCache when an identical request was made before.
+    """
+
+    def __init__(self, client, cache):
+        self.client = client
+        self.cache = cache
+        self.chat = _Namespace()
+        self.chat.completions = _Namespace()
+        self.chat.completions.create = self._create
+
+    def _create(self, **request):
+        key, response = self.cache.lookup(request)
+        if response is not None:
+            return response
+        response = self.client.chat.completions.create(**request)
+        self.cache.store(key, response)
+        return response
+
+
+class CachedAsyncOpenAI(CachedOpenAI):
+    """CachedOpenAI for an AsyncOpenAI client."""
+
+    async def _create(self, **request):
+        key, response = self.cache.lookup(request)
+        if response is not None:
+            return response
+        response = await self.client.chat.completions.create(**request)
+        self.cache.store(key, response)
+        return response
@@ -0,0 +1,57 @@
+import cv2
+import numpy as np
+import pytest
+import torch
+
+from panel_extractor.text_detector import main_text_detector
+from panel_extractor.text_detector.craft import CRAFT
+
+
+@pytest.fixture(scope="session")
+def craft_weights(tmp_path_factory):
+    # randomly initialised CRAFT weights, so the tests don't need the download
+    path = tmp_path_factory.mktemp("weights") / "craft.pth"
+    torch.manual_seed(0)
+    torch.save(CRAFT().state_dict(), path)
+    return path
+
+
+@pytest.fixture
+def ink_detector(craft_weights, monkeypatch):
+    """
+    Build TextDetectors whose network runs, but whose score maps are replaced
+    by the ink of the input: dark strokes score about 0.9, lighter ones less,
+    and paper 0.
+    """
+    monkeypatch.setattr(main_text_detector, "WEIGHTS", craft_weights)
+
+    def build(**kwargs):
+        detector = main_text_detector.TextDetector(**kwargs)
+        forward = detector._forward
+
+        def ink_forward(x):
+            y = forward(x)
+            # undo normalizeMeanVariance on the red channel
+            value = x[:, 0] * 0.229 * 255 + 0.485 * 255
+            for i in range(len(x)):
+                ink = np.clip(1 - value[i] / 255, 0, 1)
+                # the canvas padding is pure black, the pages' ink never is
+                ink[value[i] < 1] = 0
+                y[i, :, :, 0] = cv2.resize(ink, y.shape[2:0:-1])
+                y[i, :, :, 1] = 0
+            return y
+
+        detector._forward = ink_forward
+        return detector
+
+    return build
+
+
+@pytest.fixture
+def text_page():
+    # a straight line of text, a curved one and a short word on a white page
+    page = np.full((600, 800, 3), 255, dtype=np.uint8)
+    cv2.rectangle(page, (100, 100), (400, 125), (20, 20, 20), -1)
+    cv2.ellipse(page, (400, 420), (250, 120), 0, 200, 340, (20, 20, 20), 20)
+    cv2.rectangle(page, (600, 100), (615, 115), (20, 20, 20), -1)
+    return page
@@ -0,0 +1,49 @@
+import cv2
+import numpy as np
+import pytest
+
+import craft_utils_reference as reference
+from panel_extractor.text_detector import craft_utils
+
+
+def score_maps(seed, shape=(384, 512)):
+    # lines of character blobs, some slanted and some faint, joined by links
+    rng = np.random.default_rng(seed)
+    textmap = np.zeros(shape, dtype=np.float32)
+    linkmap = np.zeros(shape, dtype=np.float32)
+    for _ in range(rng.integers(4, 12)):
+        x, y = rng.integers(10, shape[1] - 150), rng.integers(10, shape[0] - 30)
+        size = int(rng.integers(4, 12))
+        slope = rng.uniform(-0.4, 0.4)
+        peak = rng.uniform(0.5, 1.0)
+        centers = [
+            (int(x + k * 2.2 * size), int(y + slope * k * 2.2 * size))
+            for k in range(rng.integers(1, 8))
+        ]
+        for cx, cy in centers:
+            blob = np.zeros(shape, dtype=np.float32)
+            cv2.circle(blob, (cx, cy), size, peak, -1)
+            textmap = np.maximum(textmap, cv2.GaussianBlur(blob, (0, 0), size / 2))
+        for a, b in zip(centers, centers[1:]):
+            cv2.line(linkmap, a, b, rng.uniform(0.3, 0.9), max(1, size // 2))
+    noise = rng.uniform(0, 0.45, shape).astype(np.float32)
+    textmap = np.maximum(textmap, cv2.GaussianBlur(noise, (0, 0), 3))
+    return textmap, linkmap
+
+
+@pytest.mark.parametrize("seed", range(12))
+def test_vectorized_boxes_match_the_original(seed):
+    textmap, linkmap = score_maps(seed)
+
+    boxes, polys = craft_utils.getDetBoxes(textmap, linkmap, 0.7, 0.4, 0.4, poly=True)
+    ref_boxes, ref_polys = reference.getDetBoxes(
+        textmap, linkmap, 0.7, 0.4, 0.4, poly=True
+    )
+
+    assert len(boxes) == len(ref_boxes) > 0
+    for box, ref in zip(boxes, ref_boxes):
+        np.testing.assert_allclose(box, ref, atol=1e-4)
+    assert [p is None for p in polys] == [p is None for p in ref_polys]
+    for poly, ref in zip(polys, ref_polys):
+        if ref is not None:
+            np.testing.assert_allclose(poly, ref, atol=1e-3)
@@ -0,0 +1,66 @@
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+from panel_extractor import main
+from panel_extractor.main import MANIFEST, extract_folder
+
+
+def write_page(path, panels):
+    # `panels` side by side panels of dark art on white paper
+    page = np.full((600, 800, 3), 255, dtype=np.uint8)
+    width = 760 // panels
+    for k in range(panels):
+        x = 20 + k * width
+        cv2.rectangle(page, (x, 20), (x + width - 40, 580), (40, 40, 40), -1)
+    assert cv2.imwrite(str(path), page)
+
+
+def panel_files(folder):
+    return sorted(f for f in os.listdir(folder / "panels") if f != MANIFEST)
+
+
+def test_rerun_replaces_panels_of_the_page(tmp_path):
+    settings = dict(keep_text=True, min_pct_panel=5)
+    write_page(tmp_path / "page.png", 3)
+    assert extract_folder(tmp_path, settings, workers=1) == 3
+
+    write_page(tmp_path / "page.png", 2)
+    assert extract_folder(tmp_path, settings, workers=1, resume=False) == 2
+    assert panel_files(tmp_path) == ["page_0.png", "page_1.png"]
+
+
+def test_changed_settings_extract_every_page_again(tmp_path):
+    write_page(tmp_path / "page.png", 2)
+    assert extract_folder(tmp_path, dict(keep_text=True, min_pct_panel=5), 1) == 2
+    assert extract_folder(tmp_path, dict(keep_text=True, min_pct_panel=5), 1) == 0
+    # both panels are now too small, and the old ones are gone
+    assert extract_folder(tmp_path, dict(keep_text=True, min_pct_panel=60), 1) == 0
+    assert panel_files(tmp_path) == []
+
+
+def test_unwritable_format_is_saved_as_png(tmp_path, monkeypatch):
+    monkeypatch.setattr(main.cv2, "haveImageWriter", lambda path: False)
+    main._init_worker(dict(keep_text=True, min_pct_panel=5), 1)
+    write_page(tmp_path / "page.jpg", 2)
+
+    assert main.extract_page(str(tmp_path / "page.jpg"), str(tmp_path), "page") == 2
+    assert os.path.exists(tmp_path / "page_1.png")
+
+
+def test_failed_write_raises(tmp_path):
+    with pytest.raises(OSError):
+        main._write(
+            str(tmp_path / "missing" / "page_0.png"), np.zeros((4, 4), np.uint8)
+        )
+
+
+def test_pages_differing_only_by_extension_are_rejected(tmp_path):
+    write_page(tmp_path / "page.jpg", 2)
+    write_page(tmp_path / "page.png", 3)
+
+    with pytest.raises(ValueError, match="page.jpg, page.png"):
+        extract_folder(tmp_path, dict(keep_text=True, min_pct_panel=5), workers=1)
+    assert not os.path.exists(tmp_path / "panels")
@@ -0,0 +1,38 @@
+import time
+import types
+
+import fake_backends
+import request_scheduler
+from fake_backends import FakeOpenAI
+from request_scheduler import RequestScheduler
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def test_scheduler_completes_under_fake_rpm_limit(monkeypatch):
+    clock = Clock()
+    fake_time = types.SimpleNamespace(
+        monotonic=clock.monotonic, sleep=clock.sleep, time=time.time
+    )
+    monkeypatch.setattr(fake_backends, "time", fake_time)
+    monkeypatch.setattr(request_scheduler, "time", fake_time)
+    fake = FakeOpenAI(latency=0, requests_per_minute=5)
+    scheduler = RequestScheduler(requests_per_minute=None)
+    request = dict(model="gpt-4o", messages=[{"role": "user", "content": "Hi"}])
+
+    for _ in range(8):
+        scheduler.call(fake.chat.completions.create, **request)
+
+    # the sixth request waits for the first minute to pass, once
+    assert fake.stats["rate_limited"] == 1
+    assert scheduler.stats["requests"] == 8
+    assert 60 <= clock.now < 61
@@ -0,0 +1,58 @@
+import io
+
+import pytest
+from PIL import Image
+
+from image_encoding import ImageEncoder
+from render_cache import RenderCache
+
+
+def page():
+    image = Image.new("RGB", (64, 48), "white")
+    image.paste((30, 30, 30), (8, 8, 40, 32))
+    return image
+
+
+@pytest.mark.parametrize(
+    "format, pil_format, mode",
+    [("png", "PNG", "RGB"), ("jpeg", "JPEG", "RGB"), ("webp", "WEBP", "RGB")],
+)
+def test_encoder_formats(format, pil_format, mode):
+    encoder = ImageEncoder(format, quality=70)
+
+    decoded = Image.open(io.BytesIO(encoder.encode(page())))
+
+    assert decoded.format == pil_format
+    assert decoded.mode == mode
+    assert decoded.size == (64, 48)
+    assert encoder.stats["png_bytes"] == 0
+
+
+def test_grayscale_encoding():
+    encoder = ImageEncoder("jpeg", grayscale=True)
+
+    assert Image.open(io.BytesIO(encoder.encode(page()))).mode == "L"
+    assert encoder.tag == "jpeg-q85-gray"
+
+
+def test_savings_are_measured_on_request():
+    encoder = ImageEncoder("jpeg", measure_savings=True)
+    encoded = encoder.encode(page())
+
+    assert encoder.stats["bytes"] == len(encoded)
+    assert encoder.stats["png_bytes"] > 0
+    assert "saved" in encoder.report()
+    assert encoder.clone().measure_savings
+
+
+def test_render_cache_entries_carry_their_format(tmp_path):
+    cache = RenderCache(str(tmp_path))
+    key = cache.key("digest", 0, 72, "512.jpeg-q85")
+    cache.put(key, b"jpeg bytes", ".jpg")
+
+    assert cache.get(key) is None
+    assert cache.get(key, ".jpg") == b"jpeg bytes"
+    assert cache._path(key, ".jpg").endswith(".jpg")
+    cache.max_bytes = 0
+    cache.evict()
+    assert not cache.contains(key, ".jpg")
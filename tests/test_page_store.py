@@ -0,0 +1,112 @@
+import base64
+import functools
+import pickle
+
+import fitz
+import pytest
+
+from manga_extraction import generate_image_array_from_pdf_parallel
+from panel_extractor.panel_extractor import PanelExtractor
+from panel_extractor.utils import load_image_from_bytes
+from page_store import (
+    PackedPageStore,
+    PageStore,
+    page_base64,
+    page_bytes,
+    page_digest,
+)
+from render_cache import RenderCache
+
+
+def test_page_store_round_trip(tmp_path):
+    store = PageStore(str(tmp_path / "pages"))
+    first = store.put(b"page one")
+    second = store.put(b"page two")
+
+    assert first.read() == b"page one"
+    assert page_bytes(second) == b"page two"
+    assert base64.b64decode(page_base64(first)) == b"page one"
+    # identical pages share one file
+    assert store.put(b"page one") == first
+    assert len(list((tmp_path / "pages").rglob("*.png"))) == 2
+
+
+def test_pack_file_round_trip_and_reopen(tmp_path):
+    path = str(tmp_path / "pages.pack")
+    store = PackedPageStore(path)
+    handles = [store.put(data) for data in (b"one", b"two", b"one", b"three")]
+
+    assert [h.read() for h in handles] == [b"one", b"two", b"one", b"three"]
+    assert handles[0].offset == handles[2].offset
+    size = (tmp_path / "pages.pack").stat().st_size
+    assert size == 3 * PackedPageStore.HEADER.size + len(b"onetwothree")
+
+    # the index is rebuilt from the pack, in a new run or a worker process
+    reopened = PackedPageStore(path)
+    assert reopened.put(b"two").offset == handles[1].offset
+    copy = pickle.loads(pickle.dumps(store))
+    assert copy.read(handles[3]) == b"three"
+    store.close()
+
+
+def test_page_digest_is_the_same_for_handles_and_base64(tmp_path):
+    store = PageStore(str(tmp_path))
+    handle = store.put(b"page")
+
+    assert page_digest(handle) == page_digest(base64.b64encode(b"page").decode())
+
+
+@pytest.fixture
+def pdf(tmp_path):
+    doc = fitz.open()
+    for k in range(5):
+        page = doc.new_page(width=200, height=300)
+        page.draw_rect(fitz.Rect(20, 20 + 40 * k, 180, 60 + 40 * k), fill=(0, 0, 0))
+    path = str(tmp_path / "volume.pdf")
+    doc.save(path)
+    return path
+
+
+def test_parallel_render_matches_in_process_render(pdf, tmp_path):
+    full, scaled = generate_image_array_from_pdf_parallel(pdf, workers=1)
+    parallel = generate_image_array_from_pdf_parallel(pdf, workers=2)
+    store = PageStore(str(tmp_path / "pages"))
+    stored = generate_image_array_from_pdf_parallel(pdf, workers=2, store=store)
+
+    assert (full, scaled) == parallel
+    assert [page_bytes(h) for h in stored[0]] == full
+    assert [page_bytes(h) for h in stored[1]] == scaled
+
+
+def test_render_cache_serves_a_second_run(pdf, tmp_path):
+    cache = RenderCache(str(tmp_path / "renders"))
+    render = functools.partial(
+        generate_image_array_from_pdf_parallel,
+        pdf,
+        workers=1,
+        cache=cache,
+        paper_scores=True,
+    )
+    first = render()
+    entries = sorted((tmp_path / "renders").rglob("*.png"))
+    second = render()
+
+    assert len(entries) == 10
+    assert second == first
+    # the paper scores come from the cache as well
+    assert None not in second[2]
+    # and are measured again for renders cached without them
+    for path in (tmp_path / "renders").rglob("*.score"):
+        path.unlink()
+    assert render() == first
+
+
+def test_paper_score_row_step(pdf):
+    full, _, scores = generate_image_array_from_pdf_parallel(
+        pdf, workers=1, paper_scores=True, paper_row_step=7
+    )
+
+    for page, score in zip(full, scores):
+        img = load_image_from_bytes(page)
+        assert score == PanelExtractor.paper_score(img, 7)
+        assert score != PanelExtractor.paper_score(img, 1)
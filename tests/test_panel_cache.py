@@ -0,0 +1,31 @@
+import numpy as np
+
+from panel_cache import PanelCache
+from panel_extractor.panel_extractor import PanelExtractor
+
+
+def test_analysis_is_keyed_by_settings(tmp_path):
+    page = np.full((400, 300), 255, dtype=np.uint8)
+    page[100:200] = 120
+    cache = PanelCache(str(tmp_path))
+    coarse = PanelExtractor(paper_row_step=16)
+    cache.put_analysis("page", coarse.analyze_page(page), coarse.analysis_settings())
+
+    fine = PanelExtractor(paper_row_step=1)
+    assert cache.get_analysis("page", fine.analysis_settings()) is None
+    assert cache.get_analysis(
+        "page", PanelExtractor(paper_row_step=16).analysis_settings()
+    )
+
+
+def test_bubble_shares_round_trip(tmp_path):
+    analysis = {
+        "size": (10, 10),
+        "paper_score": 0.1,
+        "candidates": [],
+        "bubble_shares": [],
+    }
+    cache = PanelCache(str(tmp_path))
+    cache.put_analysis("page", analysis)
+
+    assert cache.get_analysis("page")["bubble_shares"] == []
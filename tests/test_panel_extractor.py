@@ -0,0 +1,106 @@
+import base64
+
+import cv2
+import numpy as np
+
+from panel_extractor.panel_extractor import PanelExtractor
+from panel_extractor.utils import load_image_from_base64, load_image_from_bytes
+
+
+def box(x, y, w, h):
+    return np.array([[x, y], [x + w, y], [x + w, y + h], [x, y + h]], np.float32)
+
+
+def test_large_bubble_around_short_text():
+    page = np.full((600, 800), 255, dtype=np.uint8)
+    cv2.ellipse(page, (400, 300), (150, 80), 0, 0, 360, 0, 3)
+    cv2.putText(page, "HI", (385, 310), cv2.FONT_HERSHEY_SIMPLEX, 0.6, 0, 2)
+
+    [mask] = PanelExtractor().get_speech_bubble_mask([page], [[box(383, 292, 30, 20)]])
+
+    inside = np.zeros_like(page)
+    cv2.ellipse(inside, (400, 300), (146, 76), 0, 0, 360, 255, -1)
+    assert np.count_nonzero(mask[inside == 255]) > 0.95 * np.count_nonzero(inside)
+    # nothing outside the bubble
+    assert np.count_nonzero(mask[:, :240]) == np.count_nonzero(mask[:, 560:]) == 0
+
+
+def test_text_outside_bubbles_masks_its_box():
+    page = np.full((600, 800), 255, dtype=np.uint8)
+    cv2.putText(page, "HI", (385, 310), cv2.FONT_HERSHEY_SIMPLEX, 0.6, 0, 2)
+
+    [mask] = PanelExtractor().get_speech_bubble_mask([page], [[box(383, 292, 30, 20)]])
+
+    assert np.count_nonzero(mask) <= 31 * 21
+
+
+class StubDetector:
+    def __init__(self, boxes):
+        self.boxes = boxes
+
+    def detect(self, imgs):
+        return [(self.boxes, self.boxes) for _ in imgs]
+
+
+def bubble_panel_page():
+    # a panel that is one big speech bubble, next to a panel of dark art
+    page = np.full((600, 800), 255, dtype=np.uint8)
+    cv2.rectangle(page, (20, 20), (380, 580), 40, -1)
+    cv2.rectangle(page, (420, 20), (780, 580), 40, -1)
+    cv2.ellipse(page, (600, 300), (170, 270), 0, 0, 360, 255, -1)
+    cv2.ellipse(page, (600, 300), (170, 270), 0, 0, 360, 0, 3)
+    return page
+
+
+def test_geometry_leaves_out_dialogue_panels():
+    page = bubble_panel_page()
+    keep = PanelExtractor(min_pct_panel=10)
+    dialogue_free = PanelExtractor(min_pct_panel=10, max_pct_bubble=50)
+    dialogue_free._text_detector = StubDetector([box(540, 270, 120, 60)])
+
+    [panel] = keep.select_panels(keep.analyze_page(page))
+    assert panel.bbox[0] > 400
+    analysis = dialogue_free.analyze_page(page)
+    assert dialogue_free.select_panels(analysis) == []
+    # the analysis serves extractors without a bubble limit too
+    assert keep.select_panels(analysis)[0].bbox == panel.bbox
+
+
+def test_detector_options_reach_the_detector(monkeypatch):
+    from panel_extractor.text_detector import main_text_detector
+
+    calls = []
+    monkeypatch.setattr(
+        main_text_detector, "get_text_detector", lambda **kwargs: calls.append(kwargs)
+    )
+    PanelExtractor(detector_options={"backend": "onnx"}).text_detector
+
+    assert calls == [{"poly": False, "backend": "onnx"}]
+
+
+def test_grayscale_decode_keeps_colour_pages():
+    gray = np.full((60, 80, 3), 200, dtype=np.uint8)
+    colour = gray.copy()
+    colour[10:50, 10:70] = (0, 0, 255)
+    gray_png = cv2.imencode(".png", gray)[1].tobytes()
+    colour_png = cv2.imencode(".png", colour)[1].tobytes()
+    one_channel_png = cv2.imencode(".png", gray[:, :, 0])[1].tobytes()
+
+    assert load_image_from_bytes(gray_png, grayscale=True).shape == (60, 80)
+    assert load_image_from_bytes(one_channel_png, grayscale=True).shape == (60, 80)
+    assert load_image_from_bytes(colour_png, grayscale=True).shape == (60, 80, 3)
+    assert load_image_from_bytes(gray_png).shape == (60, 80, 3)
+    encoded = base64.b64encode(gray_png).decode()
+    assert load_image_from_base64(encoded, grayscale=True).shape == (60, 80)
+
+
+def test_grayscale_extraction_matches_colour():
+    page = bubble_panel_page()
+    colour = PanelExtractor(min_pct_panel=10, keep_text=True)
+    gray = PanelExtractor(min_pct_panel=10, keep_text=True, grayscale=True)
+
+    [expected] = colour.extract_image(cv2.cvtColor(page, cv2.COLOR_GRAY2BGR))
+    [panel] = gray.extract_image(page)
+
+    assert panel.shape == expected.shape[:2]
+    assert (panel == expected[:, :, 0]).all()
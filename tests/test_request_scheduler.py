@@ -0,0 +1,49 @@
+import asyncio
+import time
+
+import httpx
+from openai import APIConnectionError
+
+import request_scheduler
+from request_scheduler import RequestScheduler
+
+
+def test_retry_refunds_failed_attempt(monkeypatch):
+    monkeypatch.setattr(request_scheduler.random, "uniform", lambda a, b: 0)
+    scheduler = RequestScheduler(tokens_per_minute=30000, min_backoff=0)
+    attempts = []
+
+    def request():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise APIConnectionError(request=httpx.Request("POST", "http://test"))
+        return {"total_tokens": 1000}
+
+    scheduler.call(request, estimated_tokens=1000)
+
+    assert len(attempts) == 2
+    assert scheduler.stats["retries"] == 1
+    # only the successful attempt's usage is charged
+    assert abs(scheduler.tokens.available - 29000) < 50
+
+
+def test_refunds_shorten_queued_waits():
+    # 12 requests reserving 5,000 tokens each but using 1,000: the estimates
+    # alone would need two minutes of budget, the real usage fits at once
+    scheduler = RequestScheduler(
+        max_concurrency=4, tokens_per_minute=30000, recheck_interval=0.01
+    )
+
+    async def request():
+        await asyncio.sleep(0.01)
+        return {"total_tokens": 1000}
+
+    async def run():
+        calls = [scheduler.acall(request, estimated_tokens=5000) for _ in range(12)]
+        return await asyncio.gather(*calls)
+
+    start = time.monotonic()
+    asyncio.run(run())
+
+    assert time.monotonic() - start < 2
+    assert scheduler.stats["requests"] == 12
@@ -0,0 +1,137 @@
+import asyncio
+import json
+
+import pytest
+from openai.types.chat import ChatCompletion
+
+import response_cache
+from fake_backends import FakeAsyncOpenAI
+from request_scheduler import RequestScheduler, ScheduledAsyncOpenAI
+from response_cache import (
+    CacheMissError,
+    CachedAsyncOpenAI,
+    ResponseCache,
+    request_key,
+)
+
+REQUEST = dict(
+    model="gpt-4o",
+    messages=[
+        {"role": "system", "content": "Summarize the pages."},
+        {
+            "role": "user",
+            "content": [
+                {"type": "text", "text": "Volume 1"},
+                {"type": "image_url", "image_url": {"url": "data:image/png;base64,AA"}},
+            ],
+        },
+    ],
+    max_tokens=4096,
+)
+
+
+def test_warm_cache_makes_no_reservations(tmp_path, monkeypatch):
+    cache = ResponseCache(str(tmp_path / "responses.sqlite"))
+    scheduler = RequestScheduler()
+    reservations = []
+    reserve = scheduler._reserve
+    monkeypatch.setattr(
+        scheduler,
+        "_reserve",
+        lambda tokens: reservations.append(tokens) or reserve(tokens),
+    )
+    fake = FakeAsyncOpenAI(latency=0)
+    client = CachedAsyncOpenAI(ScheduledAsyncOpenAI(fake, scheduler), cache)
+
+    asyncio.run(client.chat.completions.create(**REQUEST))
+    assert len(reservations) == 1
+    response = asyncio.run(client.chat.completions.create(**REQUEST))
+
+    assert len(reservations) == 1
+    assert fake.stats["requests"] == 1
+    assert response.usage.total_tokens == 0
+
+
+def completion(content="{}"):
+    return ChatCompletion.model_validate(
+        {
+            "id": "chatcmpl-test",
+            "object": "chat.completion",
+            "created": 0,
+            "model": "gpt-4o",
+            "choices": [
+                {
+                    "index": 0,
+                    "finish_reason": "stop",
+                    "message": {"role": "assistant", "content": content},
+                }
+            ],
+            "usage": {
+                "prompt_tokens": 90,
+                "completion_tokens": 10,
+                "total_tokens": 100,
+            },
+        }
+    )
+
+
+def test_hits_cost_no_tokens(tmp_path):
+    cache = ResponseCache(str(tmp_path / "responses.sqlite"))
+    key, missing = cache.lookup(REQUEST)
+    cache.store(key, completion("recap"))
+
+    _, hit = cache.lookup(REQUEST)
+
+    assert missing is None
+    assert hit.choices[0].message.content == "recap"
+    assert hit.usage.total_tokens == 0
+    assert cache.stats == {"hits": 1, "misses": 1, "tokens_saved": 100}
+
+
+def test_key_covers_images_and_parameters():
+    other_image = json.loads(json.dumps(REQUEST))
+    other_image["messages"][1]["content"][1]["image_url"]["url"] += "A"
+
+    assert request_key(**REQUEST) == request_key(**json.loads(json.dumps(REQUEST)))
+    assert request_key(**REQUEST) != request_key(**other_image)
+    assert request_key(**REQUEST) != request_key(**{**REQUEST, "max_tokens": 10})
+
+
+def test_entries_expire_after_the_ttl(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(response_cache.time, "time", lambda: now[0])
+    cache = ResponseCache(str(tmp_path / "responses.sqlite"), ttl=60)
+    cache.put("key", "response")
+
+    now[0] += 59
+    assert cache.get("key") == "response"
+    now[0] += 2
+    assert cache.get("key") is None
+
+
+def test_read_only_cache_never_writes(tmp_path):
+    path = str(tmp_path / "responses.sqlite")
+    ResponseCache(path).put("recorded", "response")
+    cache = ResponseCache(path, read_only=True)
+
+    cache.put("new", "response")
+
+    assert cache.get("recorded") == "response"
+    assert cache.get("new") is None
+    with pytest.raises(CacheMissError):
+        cache.lookup(REQUEST)
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(response_cache.time, "time", lambda: now[0])
+    cache = ResponseCache(str(tmp_path / "responses.sqlite"), max_entries=2)
+    for key in ("a", "b"):
+        now[0] += 1
+        cache.put(key, key)
+    now[0] += 1
+    cache.get("a")  # "b" is now the least recently used
+    now[0] += 1
+    cache.put("c", "c")
+
+    assert [cache.get(key) for key in ("a", "b", "c")] == ["a", None, "c"]
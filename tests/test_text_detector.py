@@ -0,0 +1,96 @@
+import cv2
+import numpy as np
+import torch
+
+from panel_extractor.text_detector import main_text_detector
+from panel_extractor.text_detector.imgproc import adaptive_canvas_size
+from panel_extractor.text_detector.main_text_detector import get_text_detector
+
+
+def test_detect_with_polygons(ink_detector, text_page):
+    detector = ink_detector(poly=True, mag_ratio=1)
+    [(boxes, polys)] = detector.detect([text_page])
+
+    assert len(boxes) == len(polys) == 3
+    # the short word is too small for a polygon and falls back to its box
+    assert sorted(len(poly) for poly in polys) == [4, 14, 14]
+    for poly in polys:
+        assert poly.shape[1] == 2
+        assert (poly >= 0).all() and (poly.max(axis=0) <= (800, 600)).all()
+
+
+def test_fast_detection(ink_detector, text_page):
+    # a lighter line of text scores close to text_threshold, so it is refined
+    # at full resolution
+    cv2.rectangle(text_page, (450, 200), (700, 225), (60, 60, 60), -1)
+    boxes, polys = ink_detector(mag_ratio=1).test_net(text_page)
+    fast_boxes, fast_polys = ink_detector(mag_ratio=1, fast=True).test_net(text_page)
+
+    assert len(fast_boxes) == len(fast_polys) == len(boxes) == 4
+    for box in fast_boxes:
+        center = np.mean(box, axis=0)
+        assert any(cv2.pointPolygonTest(b, center, False) >= 0 for b in boxes)
+
+
+def test_adaptive_canvas_follows_the_scan_resolution():
+    # a 7.2 x 5 inch page scanned at 150 and at 600 dpi
+    low = adaptive_canvas_size(1080, 750, 4096, dpi=150)
+    high = adaptive_canvas_size(4320, 3000, 4096, dpi=600)
+    # glyphs end up the same height, so the scan's extra pixels are dropped
+    assert low == high < 1080
+    # the same pixels are only upscaled when their glyphs are smaller
+    assert adaptive_canvas_size(1080, 750, 4096, dpi=300) == 518
+    assert adaptive_canvas_size(1080, 750, 4096, dpi=72) > 1080
+    assert adaptive_canvas_size(400, 300, 4096, dpi=300) <= 400
+
+
+def test_detector_canvas_uses_the_page_dpi(ink_detector, text_page):
+    render = ink_detector(adaptive_canvas=True, dpi=72)._preprocess(text_page)
+    scan = ink_detector(adaptive_canvas=True, dpi=300)._preprocess(text_page)
+
+    assert render[1] == 1.5  # small glyphs, still capped by mag_ratio
+    assert scan[1] < 1
+    assert render[0].shape != scan[0].shape
+
+
+def test_registry_accepts_unhashable_settings(monkeypatch):
+    monkeypatch.setattr(main_text_detector, "_detectors", {})
+    monkeypatch.setattr(main_text_detector, "TextDetector", lambda **kwargs: object())
+    images = ["a.jpg", "b.jpg"]
+
+    first = get_text_detector(precision="int8", calibration_images=images)
+    again = get_text_detector(precision="int8", calibration_images=list(images))
+
+    assert first is again
+    assert (
+        get_text_detector(precision="int8", calibration_images=images[:1]) is not first
+    )
+
+
+def test_threads_only_apply_to_the_detector(craft_weights, monkeypatch):
+    monkeypatch.setattr(main_text_detector, "WEIGHTS", craft_weights)
+    threads = torch.get_num_threads()
+    detector = main_text_detector.TextDetector(threads=threads + 1, canvas_size=256)
+    seen = []
+    net = detector.net
+    detector.net = lambda x: seen.append(torch.get_num_threads()) or net(x)
+
+    detector.test_net(np.full((200, 200, 3), 255, dtype=np.uint8))
+
+    assert seen == [threads + 1]
+    assert torch.get_num_threads() == threads
+
+
+def test_batched_detection_matches_single_images(ink_detector, text_page):
+    detector = ink_detector(mag_ratio=1)
+    smaller = cv2.resize(text_page, (400, 300))
+    pages = [text_page, smaller, cv2.flip(text_page, 1), np.full_like(text_page, 255)]
+
+    batched = detector.detect(pages, batch_size=4)
+
+    assert [len(boxes) for boxes, _ in batched] == [3, 3, 3, 0]
+    for page, (boxes, polys) in zip(pages, batched):
+        single_boxes, single_polys = detector.test_net(page)
+        assert len(boxes) == len(single_boxes)
+        for box, single in zip(boxes, single_boxes):
+            np.testing.assert_allclose(box, single, atol=1e-3)
@@ -1,52 +1,272 @@
+import base64
+import io
 import json
+import math
+import threading
+
+from PIL import Image
+
+from page_store import page_base64, page_bytes
+from image_encoding import ImageEncoder
 
 # $0.01/1000 tokens
 VISION_PRICE_PER_TOKEN = 0.00001
 # 0.0005/1000 tokens
 GPT_3_5_TURBO_PRICE_PER_TOKEN = 0.0000005
 
+PROFILE_REFERENCE_TEXT = "Here are some character profile pages, for your reference:"
+CHAPTER_REFERENCE_TEXT = "Here are some chapter start pages, for your reference:"
 
-def analyze_images_with_gpt4_vision(
-    character_profiles, pages, client, prompt, instructions, detail="low"
+
+def _image_parts(images, detail, encoder=None):
+    # Build the image_url message parts for a list of pages or panels
+    encoder = encoder or ImageEncoder()
+    return [
+        {
+            "type": "image_url",
+            "image_url": {
+                "url": encoder.data_url(page_base64(img_base64)),
+                "detail": detail,
+            },
+        }
+        for img_base64 in images
+    ]
+
+
+def estimate_image_tokens(width, height, detail="low"):
+    """
+    Estimate the prompt tokens an image costs, following OpenAI's published
+    rules: a flat 85 tokens at low detail, otherwise 170 tokens per 512px tile
+    (after fitting in 2048x2048 and scaling the short side to 768) plus 85.
+    """
+    if detail == "low":
+        return 85
+    scale = min(1, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    tiles = math.ceil(width / 512) * math.ceil(height / 512)
+    return 170 * tiles + 85
+
+
+def make_contact_sheet(images, encoder=None):
+    """
+    Tile a list of images into a single image, row by row on a square-ish grid.
+
+    Args:
+    - images (list): Pages as base64 strings or page handles.
+    - encoder (ImageEncoder): Encoding of the resulting sheet, PNG by default.
+
+    Returns:
+    - str: The contact sheet as a base64 string.
+    """
+    encoder = encoder or ImageEncoder()
+    tiles = [Image.open(io.BytesIO(page_bytes(img))).convert("RGB") for img in images]
+    cell_width = max(tile.width for tile in tiles)
+    cell_height = max(tile.height for tile in tiles)
+    columns = math.ceil(math.sqrt(len(tiles)))
+    rows = math.ceil(len(tiles) / columns)
+
+    sheet = Image.new("RGB", (columns * cell_width, rows * cell_height), "white")
+    for i, tile in enumerate(tiles):
+        row, column = divmod(i, columns)
+        sheet.paste(tile, (column * cell_width, row * cell_height))
+
+    return base64.b64encode(encoder.encode(sheet)).decode("utf-8")
+
+
+class ReferenceImages:
+    """
+    A set of reference images whose message is built once and shared by every
+    request that includes it.
+
+    The data URLs are only assembled on construction, and the instance keeps
+    per-stage counts of how many requests, bytes and (estimated) image tokens
+    it contributed.
+    """
+
+    def __init__(self, images, text, detail="low", encoder=None, contact_sheet=False):
+        if contact_sheet and len(images) > 1:
+            images = [make_contact_sheet(images, encoder)]
+            text = text + " (combined into a single contact sheet)"
+
+        content = [{"type": "text", "text": text}] + _image_parts(
+            images, detail, encoder
+        )
+        self.message = {"role": "user", "content": content}
+        self.image_count = len(images)
+        self.bytes = sum(len(part["image_url"]["url"]) for part in content[1:])
+        self.tokens = 0
+        for img in images:
+            width, height = Image.open(io.BytesIO(page_bytes(img))).size
+            self.tokens += estimate_image_tokens(width, height, detail)
+
+        self.usage = {}
+        self._lock = threading.Lock()
+
+    def use(self, stage):
+        """Return the shared message, counting it towards `stage`."""
+        with self._lock:
+            usage = self.usage.setdefault(
+                stage, {"requests": 0, "bytes": 0, "tokens": 0}
+            )
+            usage["requests"] += 1
+            usage["bytes"] += self.bytes
+            usage["tokens"] += self.tokens
+        return self.message
+
+
+class ReferenceContext:
+    """
+    The reference images of a run (character profiles, chapter starts, ...),
+    resolved once and handed to every vision call that needs them.
+    """
+
+    def __init__(self, detail="low", encoder=None, contact_sheet=False):
+        self.detail = detail
+        self.encoder = encoder
+        self.contact_sheet = contact_sheet
+        self.references = {}
+
+    def add(self, name, images, text):
+        reference = ReferenceImages(
+            images, text, self.detail, self.encoder, self.contact_sheet
+        )
+        self.references[name] = reference
+        return reference
+
+    def report(self):
+        lines = []
+        for name, reference in self.references.items():
+            for stage, usage in reference.usage.items():
+                lines.append(
+                    f"{name} references in {stage}: {usage['requests']} requests, "
+                    f"{usage['bytes']:,} bytes, ~{usage['tokens']:,} image tokens"
+                )
+        return "\n".join(lines)
+
+
+def _reference_message(reference, text, detail, encoder, stage):
+    # Reuse a prebuilt reference message when given one, otherwise build it
+    if isinstance(reference, ReferenceImages):
+        return reference.use(stage)
+    return {
+        "role": "user",
+        "content": [{"type": "text", "text": text}]
+        + _image_parts(reference, detail, encoder),
+    }
+
+
+def _summary_messages(character_profiles, pages, prompt, instructions, detail, encoder):
+    # Construct the messages including the prompt and images
+    return [
+        {"role": "system", "content": instructions},
+        _reference_message(
+            character_profiles, PROFILE_REFERENCE_TEXT, detail, encoder, "summary"
+        ),
+        {
+            "role": "user",
+            "content": [{"type": "text", "text": prompt}]
+            + _image_parts(pages, detail, encoder),
+        },
+    ]
+
+
+def _important_pages_messages(
+    profile_reference, chapter_reference, pages, prompt, instructions, detail, encoder
 ):
     # Construct the messages including the prompt and images
-    messages = [
+    return [
         {"role": "system", "content": instructions},
+        _reference_message(
+            profile_reference,
+            PROFILE_REFERENCE_TEXT,
+            detail,
+            encoder,
+            "important_pages",
+        ),
+        _reference_message(
+            chapter_reference,
+            CHAPTER_REFERENCE_TEXT,
+            detail,
+            encoder,
+            "important_pages",
+        ),
         {
             "role": "user",
-            "content": [
-                {
-                    "type": "text",
-                    "text": "Here are some character profile pages, for your reference:",
-                }
-            ]
-            + [
-                {
-                    "type": "image_url",
-                    "image_url": {
-                        "url": f"data:image/png;base64,{img_base64}",
-                        "detail": detail,
-                    },
-                }
-                for img_base64 in character_profiles
-            ],
+            "content": [{"type": "text", "text": prompt}]
+            + _image_parts(pages, detail, encoder),
         },
+    ]
+
+
+def _important_panels_messages(
+    profile_reference, panels, prompt, instructions, detail, encoder
+):
+    # Construct the messages including the prompt and images
+    return [
+        {"role": "system", "content": instructions},
+        _reference_message(
+            profile_reference,
+            PROFILE_REFERENCE_TEXT,
+            detail,
+            encoder,
+            "important_panels",
+        ),
         {
             "role": "user",
             "content": [{"type": "text", "text": prompt}]
-            + [
-                {
-                    "type": "image_url",
-                    "image_url": {
-                        "url": f"data:image/png;base64,{img_base64}",
-                        "detail": detail,
-                    },
-                }
-                for img_base64 in pages
-            ],
+            + _image_parts(panels, detail, encoder),
         },
     ]
 
+
+def _completions_messages(text, prompt):
+    return [
+        {"role": "system", "content": prompt},
+        {"role": "user", "content": [{"type": "text", "text": text}]},
+    ]
+
+
+def _parse_json(response_text):
+    # parse response text json from response.choices[0].message.content into object
+    try:
+        return json.loads(response_text)
+    except (TypeError, json.JSONDecodeError):
+        return None
+
+
+def _parse_json_fallback(response):
+    try:
+        return json.loads(response.choices[0].message.content)
+    except (AttributeError, IndexError, json.JSONDecodeError) as e:
+        print("Even after using GPT to parse the json, we failed. Fatal error.")
+        raise e
+
+
+def _is_content_policy_violation(error):
+    if "content_policy_violation" in str(error):
+        print(
+            "The input image may contain content that is not allowed by OpenAI's safety system."
+        )
+        return True
+    # anything else, including rate limits, is left to the request scheduler
+    return False
+
+
+def analyze_images_with_gpt4_vision(
+    character_profiles,
+    pages,
+    client,
+    prompt,
+    instructions,
+    detail="low",
+    encoder=None,
+):
+    messages = _summary_messages(
+        character_profiles, pages, prompt, instructions, detail, encoder
+    )
+
     response = client.chat.completions.create(
         model="gpt-4o", messages=messages, max_tokens=4096
     )
@@ -54,6 +274,27 @@ def analyze_images_with_gpt4_vision(
     return response
 
 
+async def analyze_images_with_gpt4_vision_async(
+    character_profiles,
+    pages,
+    client,
+    prompt,
+    instructions,
+    detail="low",
+    encoder=None,
+):
+    # Same as analyze_images_with_gpt4_vision, on an AsyncOpenAI client
+    messages = _summary_messages(
+        character_profiles, pages, prompt, instructions, detail, encoder
+    )
+
+    response = await client.chat.completions.create(
+        model="gpt-4o", messages=messages, max_tokens=4096
+    )
+
+    return response
+
+
 def detect_important_pages(
     profile_reference,
     chapter_reference,
@@ -62,63 +303,17 @@ def detect_important_pages(
     prompt,
     instructions,
     detail="low",
+    encoder=None,
 ):
-    # Construct the messages including the prompt and images
-    messages = [
-        {"role": "system", "content": instructions},
-        {
-            "role": "user",
-            "content": [
-                {
-                    "type": "text",
-                    "text": "Here are some character profile pages, for your reference:",
-                }
-            ]
-            + [
-                {
-                    "type": "image_url",
-                    "image_url": {
-                        "url": f"data:image/png;base64,{img_base64}",
-                        "detail": detail,
-                    },
-                }
-                for img_base64 in profile_reference
-            ],
-        },
-        {
-            "role": "user",
-            "content": [
-                {
-                    "type": "text",
-                    "text": "Here are some chapter start pages, for your reference:",
-                }
-            ]
-            + [
-                {
-                    "type": "image_url",
-                    "image_url": {
-                        "url": f"data:image/png;base64,{img_base64}",
-                        "detail": detail,
-                    },
-                }
-                for img_base64 in chapter_reference
-            ],
-        },
-        {
-            "role": "user",
-            "content": [{"type": "text", "text": prompt}]
-            + [
-                {
-                    "type": "image_url",
-                    "image_url": {
-                        "url": f"data:image/png;base64,{img_base64}",
-                        "detail": detail,
-                    },
-                }
-                for img_base64 in pages
-            ],
-        },
-    ]
+    messages = _important_pages_messages(
+        profile_reference,
+        chapter_reference,
+        pages,
+        prompt,
+        instructions,
+        detail,
+        encoder,
+    )
 
     response = client.chat.completions.create(
         model="gpt-4o", messages=messages, max_tokens=4096
@@ -126,21 +321,13 @@ def detect_important_pages(
     response_text = response.choices[0].message.content
     tokens = response.usage.total_tokens
 
-    # parse response text json from response.choices[0].message.content into object
-    try:
-        # Extract the text content from the first choice's message (if structured as expected)
-        parsed_response = json.loads(response_text)
-    except (AttributeError, IndexError, json.JSONDecodeError) as e:
+    parsed_response = _parse_json(response_text)
+    if parsed_response is None:
         # Handle cases where parsing fails or the structure is not as expected
         print(f"Using GPT as a backup to format JSON object...")
         response = completions(client, response_text, JSON_PARSE_PROMPT)
         tokens += response.usage.total_tokens
-        try:
-            parsed_response = json.loads(response.choices[0].message.content)
-        except (AttributeError, IndexError, json.JSONDecodeError) as e:
-            parsed_response = None
-            print("Even after using GPT to parse the json, we failed. Fatal error.")
-            raise e
+        parsed_response = _parse_json_fallback(response)
 
     return {
         "total_tokens": tokens,
@@ -148,15 +335,61 @@ def detect_important_pages(
     }
 
 
-def completions(client, text, prompt):
-    messages = [
-        {"role": "system", "content": prompt},
-        {"role": "user", "content": [{"type": "text", "text": text}]},
-    ]
+async def detect_important_pages_async(
+    profile_reference,
+    chapter_reference,
+    pages,
+    client,
+    prompt,
+    instructions,
+    detail="low",
+    encoder=None,
+):
+    # Same as detect_important_pages, on an AsyncOpenAI client
+    messages = _important_pages_messages(
+        profile_reference,
+        chapter_reference,
+        pages,
+        prompt,
+        instructions,
+        detail,
+        encoder,
+    )
+
+    response = await client.chat.completions.create(
+        model="gpt-4o", messages=messages, max_tokens=4096
+    )
+    response_text = response.choices[0].message.content
+    tokens = response.usage.total_tokens
+
+    parsed_response = _parse_json(response_text)
+    if parsed_response is None:
+        print(f"Using GPT as a backup to format JSON object...")
+        response = await completions_async(client, response_text, JSON_PARSE_PROMPT)
+        tokens += response.usage.total_tokens
+        parsed_response = _parse_json_fallback(response)
+
+    return {
+        "total_tokens": tokens,
+        "parsed_response": parsed_response["important_pages"],
+    }
+
 
+def completions(client, text, prompt):
     response = client.chat.completions.create(
         model="gpt-3.5-turbo-0125",
-        messages=messages,
+        messages=_completions_messages(text, prompt),
+        max_tokens=4096,
+        response_format={"type": "json_object"},
+    )
+
+    return response
+
+
+async def completions_async(client, text, prompt):
+    response = await client.chat.completions.create(
+        model="gpt-3.5-turbo-0125",
+        messages=_completions_messages(text, prompt),
         max_tokens=4096,
         response_format={"type": "json_object"},
     )
@@ -165,80 +398,78 @@ def completions(client, text, prompt):
 
 
 def get_important_panels(
-    profile_reference, panels, client, prompt, instructions, detail="low"
+    profile_reference,
+    panels,
+    client,
+    prompt,
+    instructions,
+    detail="low",
+    encoder=None,
 ):
-    # Construct the messages including the prompt and images
-    messages = [
-        {"role": "system", "content": instructions},
-        {
-            "role": "user",
-            "content": [
-                {
-                    "type": "text",
-                    "text": "Here are some character profile pages, for your reference:",
-                }
-            ]
-            + [
-                {
-                    "type": "image_url",
-                    "image_url": {
-                        "url": f"data:image/png;base64,{img_base64}",
-                        "detail": detail,
-                    },
-                }
-                for img_base64 in profile_reference
-            ],
-        },
-        {
-            "role": "user",
-            "content": [{"type": "text", "text": prompt}]
-            + [
-                {
-                    "type": "image_url",
-                    "image_url": {
-                        "url": f"data:image/png;base64,{img_base64}",
-                        "detail": detail,
-                    },
-                }
-                for img_base64 in panels
-            ],
-        },
-    ]
+    messages = _important_panels_messages(
+        profile_reference, panels, prompt, instructions, detail, encoder
+    )
     try:
         response = client.chat.completions.create(
             model="gpt-4o", messages=messages, max_tokens=4096
         )
     except Exception as e:
-        if "content_policy_violation" in str(e):
-            print(
-                "The input image may contain content that is not allowed by OpenAI's safety system."
-            )
-            return {"total_tokens": 0, "parsed_response": []}
-        if "rate_limit_exceeded" in str(e):
-            print("Rate limit exceeded. Please wait a few minutes before trying again.")
+        if _is_content_policy_violation(e):
             return {"total_tokens": 0, "parsed_response": []}
-        else:
-            raise e
+        raise e
 
     response_text = response.choices[0].message.content
     print("GPT RESPONSE:", response_text)
     tokens = response.usage.total_tokens
 
-    # parse response text json from response.choices[0].message.content into object
-    try:
-        # Extract the text content from the first choice's message (if structured as expected)
-        parsed_response = json.loads(response_text)
-    except (AttributeError, IndexError, json.JSONDecodeError) as e:
+    parsed_response = _parse_json(response_text)
+    if parsed_response is None:
         # Handle cases where parsing fails or the structure is not as expected
         print(f"Using GPT as a backup to format JSON object...")
         response = completions(client, response_text, JSON_PARSE_PROMPT_PANELS)
         tokens += response.usage.total_tokens
-        try:
-            parsed_response = json.loads(response.choices[0].message.content)
-        except (AttributeError, IndexError, json.JSONDecodeError) as e:
-            parsed_response = None
-            print("Even after using GPT to parse the json, we failed. Fatal error.")
-            raise e
+        parsed_response = _parse_json_fallback(response)
+
+    return {
+        "total_tokens": tokens,
+        "parsed_response": parsed_response["important_panels"],
+    }
+
+
+async def get_important_panels_async(
+    profile_reference,
+    panels,
+    client,
+    prompt,
+    instructions,
+    detail="low",
+    encoder=None,
+):
+    # Same as get_important_panels, on an AsyncOpenAI client
+    messages = _important_panels_messages(
+        profile_reference, panels, prompt, instructions, detail, encoder
+    )
+    try:
+        response = await client.chat.completions.create(
+            model="gpt-4o", messages=messages, max_tokens=4096
+        )
+    except Exception as e:
+        if _is_content_policy_violation(e):
+            return {"total_tokens": 0, "parsed_response": []}
+        raise e
+
+    response_text = response.choices[0].message.content
+    print("GPT RESPONSE:", response_text)
+    tokens = response.usage.total_tokens
+
+    parsed_response = _parse_json(response_text)
+    if parsed_response is None:
+        print(f"Using GPT as a backup to format JSON object...")
+        response = await completions_async(
+            client, response_text, JSON_PARSE_PROMPT_PANELS
+        )
+        tokens += response.usage.total_tokens
+        parsed_response = _parse_json_fallback(response)
 
     return {
         "total_tokens": tokens,